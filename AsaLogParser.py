@@ -0,0 +1,87 @@
+'''
+AsaLogParser.py
+Parsing of CISCO ASA Teardown TCP/UDP events (302014/302016).
+
+parseTeardown() matches the regular expression and returns only the fields the
+aggregation uses, taken with a single group() call, the duration in seconds.
+
+Example line:
+Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711
+for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234 TCP FINs
+'''
+import re
+
+# -------- Following secion is valid for CISCO ASA Log Format
+# Regular expression for syslog elements matching.
+# Compile here only once to avoid pattern interpretation for every further use.
+# Syslog header of the relay and ASA header, in front of "Teardown"
+headerPattern = r'(?P<DateTime>\w+\s+\d+\s+(\d+):(\d+):(\d+))\s(?P<Hostname>\S+)'\
+                r'\s:\s\w+\s\d+\s(\d+):(\d+):(\d+)\s\w+:\s(?P<ASA_Session>\S+)'
+regExPattern = re.compile(r'^' + headerPattern + r'\s(?:Teardown)'\
+                          r'\s(?P<ConnectionType>\S+)\s(\S+)\s(?P<ConnectionID>\d+)' \
+                          r'\sfor\s(?P<SourceZone>\S+):(?P<SourceIP>\d+.\d+.\d+.\d+)/(?P<SourcePort>\d+)(\(any\))*'\
+                          r'\sto\s(?P<TargetZone>\S+):(?P<TargetIP>\d+.\d+.\d+.\d+)/(?P<TargetPort>\d+)(\(any\))*\s'\
+                          r'(duration)\s(?P<Duration>(?P<Hours>\d+):(?P<Minutes>\d+):(?P<Seconds>\d+))\s(bytes)\s(?P<Bytes>\d+)'\
+                          r'\s*(?P<Result>.*)'
+                        )
+
+# Groups returned by matchTeardown()
+FIELD_GROUPS = ('ConnectionType', 'SourceZone', 'SourceIP', 'TargetZone', 'TargetIP', 'TargetPort',
+                'Hours', 'Minutes', 'Seconds', 'Bytes')
+
+regExFileDatePattern = re.compile(r'.*(\d{4})-(\d{2})-(\d{2}).*')
+
+searchItems = ('Teardown TCP', 'Teardown UDP')
+# Same for undecoded lines (the readers work on bytes, only extracted fields are decoded)
+bytesRegExPattern = re.compile(regExPattern.pattern.encode('ascii'))
+bytesSearchItems = tuple(item.encode('ascii') for item in searchItems)
+# "item in line" is much slower for bytes than for str, a search over the alternation is faster
+bytesSearchPattern = re.compile(b'|'.join(re.escape(item) for item in bytesSearchItems))
+# -------- End of CISCO ASA specific log Format
+
+def matchTeardown(line, regExPattern=regExPattern):
+    '''
+    Parse a Teardown line with the regex.
+    Returns (connType, sourceZone, sourceIP, targetZone, targetIP, targetPort, durationSeconds, bytes)
+    or None, if the line does not match.
+    '''
+    matchObj = regExPattern.match(line)
+    if not matchObj:
+        return None
+    connType, sourceZone, sourceIP, targetZone, targetIP, targetPort, hours, minutes, seconds, connBytes = \
+        matchObj.group(*FIELD_GROUPS)
+    return (connType, sourceZone, sourceIP, targetZone, targetIP, targetPort,
+            int(hours) * 3600 + int(minutes) * 60 + int(seconds), int(connBytes))
+
+def bytesPattern(pattern):
+    ''' Bytes version of a compiled str pattern (e.g. regExPattern), for matching undecoded lines. '''
+    if isinstance(pattern.pattern, bytes):
+        return pattern
+    return re.compile(pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE)
+
+def matchTeardownBytes(line, regExPattern, encoding='latin-1'):
+    ''' matchTeardown() for an undecoded line and a bytes pattern (see bytesPattern()). '''
+    matchObj = regExPattern.match(line)
+    if not matchObj:
+        return None
+    connType, sourceZone, sourceIP, targetZone, targetIP, targetPort, hours, minutes, seconds, connBytes = \
+        matchObj.group(*FIELD_GROUPS)
+    return (connType.decode(encoding), sourceZone.decode(encoding), sourceIP.decode(encoding),
+            targetZone.decode(encoding), targetIP.decode(encoding), targetPort.decode('ascii'),
+            int(hours) * 3600 + int(minutes) * 60 + int(seconds), int(connBytes))
+
+def matchTeardownRaw(line, regExPattern):
+    ''' matchTeardownBytes() without decoding, the text fields are returned as bytes. '''
+    return matchTeardown(line, regExPattern)
+
+def parseTeardown(line, regExPattern=regExPattern):
+    ''' Parse a Teardown line, returns the tuple of matchTeardown() or None if the line does not match. '''
+    return matchTeardown(line, regExPattern)
+
+def parseTeardownBytes(line, encoding='latin-1', regExPattern=bytesRegExPattern):
+    ''' parseTeardown() for an undecoded line, the fields are decoded with encoding. '''
+    return matchTeardownBytes(line, regExPattern, encoding)
+
+def parseTeardownRaw(line, regExPattern=bytesRegExPattern):
+    ''' parseTeardownBytes() without decoding, for callers which decode distinct values only. '''
+    return matchTeardown(line, regExPattern)
@@ -0,0 +1,217 @@
+'''
+ConnectionStore.py
+Compact aggregate of accumulated connections.
+
+A connection (SourceIP, SourceZone, TargetIP, TargetZone, TargetPort, ConnectionType)
+is packed into a single int key:
+    SourceIP (32 bit) | SourceZone (16) | TargetIP (32) | TargetZone (16) | TargetPort (16) | ConnectionType (16)
+IPs and ports are stored as numbers, zones and connection types as ids into a table
+of interned names. The aggregated values live in typed arrays, addressed by the row
+number stored for a key: count, firstSeen / lastSeen (date ordinals) and totalBytes.
+Strings are only rendered again when the store is written (rows()).
+With subnets (a SubnetTree), IPs are replaced by the representative of their subnet
+when they are converted (and when other stores are merged), and rendered as subnets.
+'''
+import datetime
+from array import array
+
+# Bits of the zone and connection type ids in a packed key
+NAME_ID_MASK = (0xFFFF << 80) | (0xFFFF << 32) | 0xFFFF
+# Bits of SourceIP and TargetIP in a packed key
+IP_MASK = (0xFFFFFFFF << 96) | (0xFFFFFFFF << 48)
+# Distinct IPs are cached for the str -> int conversion, the cache is dropped when it grows beyond this
+IP_CACHE_SIZE = 1000000
+
+def ipToInt(ip):
+    ''' Dotted quad to 32 bit int, raises ValueError for anything else. '''
+    a, b, c, d = ip.split('.')
+    a, b, c, d = int(a), int(b), int(c), int(d)
+    if a > 255 or b > 255 or c > 255 or d > 255:
+        raise ValueError('Invalid IPv4 address: {}'.format(ip))
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+def intToIp(value):
+    return '{}.{}.{}.{}'.format(value >> 24, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+class ConnectionStore:
+    # SubnetTree or None, a class attribute as well for stores pickled without it
+    subnets = None
+
+    def __init__(self):
+        # packed connection key -> row in the value arrays
+        self.rowIndex = {}
+        self.counts = array('q')
+        self.firstSeen = array('i')
+        self.lastSeen = array('i')
+        self.totalBytes = array('q')
+        # interned zone and connection type names
+        self.names = []
+        self.nameIds = {}
+        self.ipCache = {}
+
+    def __len__(self):
+        return len(self.rowIndex)
+
+    def __getstate__(self):
+        # The IP cache is rebuilt on demand, no need to pickle it with partial results
+        state = self.__dict__.copy()
+        state['ipCache'] = {}
+        return state
+
+    def nameId(self, name):
+        nameId = self.nameIds.get(name)
+        if nameId is None:
+            nameId = len(self.names)
+            if nameId > 0xFFFF:
+                raise ValueError('Too many distinct zone/connection type names')
+            self.names.append(name)
+            self.nameIds[name] = nameId
+        return nameId
+
+    def ipValue(self, ip):
+        value = self.ipCache.get(ip)
+        if value is None:
+            if len(self.ipCache) >= IP_CACHE_SIZE:
+                self.ipCache.clear()
+            value = ipToInt(ip)
+            if self.subnets is not None:
+                value = self.subnets.map(value)
+            self.ipCache[ip] = value
+        return value
+
+    def key(self, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType):
+        ''' Packed key of a connection, raises ValueError for values which cannot be represented. '''
+        port = int(targetPort)
+        if port > 0xFFFF:
+            raise ValueError('Invalid port: {}'.format(targetPort))
+        return ((((((self.ipValue(sourceIP) << 16 | self.nameId(sourceZone)) << 32
+                   | self.ipValue(targetIP)) << 16 | self.nameId(targetZone)) << 16
+                 | port) << 16) | self.nameId(connType))
+
+    def unpackKeyValues(self, key):
+        ''' Inverse of key(): (SourceIP int, SourceZone, TargetIP int, TargetZone, TargetPort int, ConnectionType). '''
+        names = self.names
+        return (key >> 96,
+                names[(key >> 80) & 0xFFFF],
+                (key >> 48) & 0xFFFFFFFF,
+                names[(key >> 32) & 0xFFFF],
+                (key >> 16) & 0xFFFF,
+                names[key & 0xFFFF])
+
+    def unpackKey(self, key):
+        ''' Inverse of key(), returns the six connection fields as strings (IPs as subnets with subnets). '''
+        sourceIP, sourceZone, targetIP, targetZone, targetPort, connType = self.unpackKeyValues(key)
+        renderIp = intToIp if self.subnets is None else self.subnets.render
+        return (renderIp(sourceIP), sourceZone, renderIp(targetIP), targetZone, str(targetPort), connType)
+
+    def recordValues(self, key):
+        ''' unpackKeyValues() for records(), with subnets the IPs are rendered as subnets. '''
+        values = self.unpackKeyValues(key)
+        if self.subnets is None:
+            return values
+        render = self.subnets.render
+        return values[:-6] + (render(values[-6]), values[-5], render(values[-4])) + values[-3:]
+
+    def clear(self):
+        ''' Remove all connections, the name table is kept. '''
+        self.rowIndex = {}
+        self.counts = array('q')
+        self.firstSeen = array('i')
+        self.lastSeen = array('i')
+        self.totalBytes = array('q')
+
+    def addKey(self, key, dateOrdinal, connBytes, count=1, lastOrdinal=None):
+        row = self.rowIndex.get(key)
+        if lastOrdinal is None:
+            lastOrdinal = dateOrdinal
+        if row is None:
+            self.rowIndex[key] = len(self.counts)
+            self.counts.append(count)
+            self.firstSeen.append(dateOrdinal)
+            self.lastSeen.append(lastOrdinal)
+            self.totalBytes.append(connBytes)
+        else:
+            self.counts[row] += count
+            # In case log files are not in sequential order, test dates
+            if dateOrdinal < self.firstSeen[row]:
+                self.firstSeen[row] = dateOrdinal
+            if lastOrdinal > self.lastSeen[row]:
+                self.lastSeen[row] = lastOrdinal
+            self.totalBytes[row] += connBytes
+
+    def addKeys(self, keys, firstSeen, totalBytes, counts, lastSeen):
+        ''' addKey() for sequences of distinct keys and their values, appended in bulk to an empty store. '''
+        if self.rowIndex:
+            for key, first, connBytes, count, last in zip(keys, firstSeen, totalBytes, counts, lastSeen):
+                self.addKey(key, first, connBytes, count, last)
+            return
+        self.rowIndex = dict(zip(keys, range(len(keys))))
+        self.counts.extend(counts)
+        self.firstSeen.extend(firstSeen)
+        self.lastSeen.extend(lastSeen)
+        self.totalBytes.extend(totalBytes)
+
+    def add(self, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes):
+        ''' Count one connection seen at dateOrdinal (datetime.date.toordinal()), raises ValueError like key(). '''
+        # Per line hot path, cache lookups are inlined and key()/addKey() are only used for new values
+        ipCache = self.ipCache
+        nameIds = self.nameIds
+        sourceValue = ipCache.get(sourceIP)
+        targetValue = ipCache.get(targetIP)
+        sourceZoneId = nameIds.get(sourceZone)
+        targetZoneId = nameIds.get(targetZone)
+        connTypeId = nameIds.get(connType)
+        port = int(targetPort)
+        if (sourceValue is None or targetValue is None or sourceZoneId is None or targetZoneId is None
+                or connTypeId is None or port > 0xFFFF):
+            key = self.key(sourceIP, sourceZone, targetIP, targetZone, targetPort, connType)
+        else:
+            key = (((((sourceValue << 16 | sourceZoneId) << 32 | targetValue) << 16 | targetZoneId) << 16
+                    | port) << 16) | connTypeId
+
+        row = self.rowIndex.get(key)
+        if row is None:
+            self.addKey(key, dateOrdinal, connBytes)
+        else:
+            self.counts[row] += 1
+            if dateOrdinal < self.firstSeen[row]:
+                self.firstSeen[row] = dateOrdinal
+            elif dateOrdinal > self.lastSeen[row]:
+                self.lastSeen[row] = dateOrdinal
+            self.totalBytes[row] += connBytes
+
+    def merge(self, other):
+        ''' Add all connections of other (e.g. the partial result of a worker) to this store. '''
+        # Name ids of other have to be translated into ids of this store
+        idMap = [self.nameId(name) for name in other.names]
+        translate = idMap != list(range(len(idMap)))
+        # Partial results of workers hold the IPs, map() returns representatives unchanged
+        mapIp = self.subnets.map if self.subnets is not None else None
+        for key, row in other.rowIndex.items():
+            if translate:
+                key = ((key & ~NAME_ID_MASK)
+                       | idMap[(key >> 80) & 0xFFFF] << 80
+                       | idMap[(key >> 32) & 0xFFFF] << 32
+                       | idMap[key & 0xFFFF])
+            if mapIp is not None:
+                key = ((key & ~IP_MASK)
+                       | mapIp((key >> 96) & 0xFFFFFFFF) << 96
+                       | mapIp((key >> 48) & 0xFFFFFFFF) << 48)
+            self.addKey(key, other.firstSeen[row], other.totalBytes[row], other.counts[row], other.lastSeen[row])
+
+    def rows(self):
+        ''' Yields (SourceIP, SourceZone, TargetIP, TargetZone, TargetPort, ConnectionType, count, firstSeen, lastSeen, totalBytes). '''
+        isoDates = {}
+        for key, row in self.rowIndex.items():
+            first = self.firstSeen[row]
+            last = self.lastSeen[row]
+            if first not in isoDates:
+                isoDates[first] = datetime.date.fromordinal(first).isoformat()
+            if last not in isoDates:
+                isoDates[last] = datetime.date.fromordinal(last).isoformat()
+            yield self.unpackKey(key) + (self.counts[row], isoDates[first], isoDates[last], self.totalBytes[row])
+
+    def records(self):
+        ''' Like rows(), but with the values as stored: recordValues() + (count, firstSeen, lastSeen ordinals, totalBytes). '''
+        for key, row in self.rowIndex.items():
+            yield self.recordValues(key) + (self.counts[row], self.firstSeen[row], self.lastSeen[row], self.totalBytes[row])
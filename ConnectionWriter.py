@@ -0,0 +1,150 @@
+'''
+ConnectionWriter.py
+Output of accumulated connections (AllConnections.<format>).
+
+Formats:
+    csv      semicolon separated text with a header line, as written so far
+    csv.gz   the same, gzip compressed
+    npz      NumPy archive with one typed array per column (requires numpy)
+    parquet  Parquet file with typed columns (requires pyarrow)
+Text rows are rendered with one % format per row and written in blocks of WRITE_ROWS
+rows with a single write() each, instead of a print() per row.
+The columnar formats are written from the connection values (store.records()), so
+IPs stay integers and nothing is rendered as text: SourceIP / TargetIP uint32,
+TargetPort uint16, count / totalBytes int64, firstSeen / lastSeen dates (datetime64[D] /
+date32), zones and connection types as strings, the bucket of a rollup (see RollupStore)
+as timestamp. Parquet is written as a stream of row groups of COLUMN_BLOCK_ROWS rows,
+npz collects the columns in memory and is written at the end (np.load(fileName)[column]
+returns the column).
+'''
+import gzip
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ('csv', 'csv.gz', 'npz', 'parquet')
+FIELDS = ('SourceIP', 'SourceZone', 'TargetIP', 'TargetZone', 'TargetPort', 'ConnectionType',
+          'count', 'firstSeen', 'lastSeen', 'totalBytes')
+WRITE_ROWS = 10000
+WRITE_BUFFER = 1024 * 1024
+COLUMN_BLOCK_ROWS = 1000000
+COMPRESS_LEVEL = 6
+# datetime.date(1970, 1, 1).toordinal(), date ordinals -> days since the epoch
+EPOCH_ORDINAL = 719163
+# NumPy and Arrow type per field, dates are date ordinals, buckets hours since the epoch (see RollupStore)
+FIELD_TYPES = {
+    'bucket': ('datetime64[h]', 'timestamp[s]'),
+    'SourceIP': ('uint32', 'uint32'),
+    'SourceZone': ('U', 'string'),
+    'TargetIP': ('uint32', 'uint32'),
+    'TargetZone': ('U', 'string'),
+    'TargetPort': ('uint16', 'uint16'),
+    'ConnectionType': ('U', 'string'),
+    'count': ('int64', 'int64'),
+    'firstSeen': ('datetime64[D]', 'date32'),
+    'lastSeen': ('datetime64[D]', 'date32'),
+    'totalBytes': ('int64', 'int64'),
+    'SourceSubnet': ('U', 'string'),
+    'TargetSubnet': ('U', 'string'),
+}
+# Fields of stores with subnets (see SubnetTree), their records() hold the subnets as text
+SUBNET_FIELDS = {'SourceIP': 'SourceSubnet', 'TargetIP': 'TargetSubnet'}
+
+def available(outputFormat):
+    ''' True if the modules required by outputFormat are installed. '''
+    if outputFormat == 'npz':
+        return np is not None
+    if outputFormat == 'parquet':
+        return pa is not None
+    return outputFormat in FORMATS
+
+def connectionFileName(outputDirectory, outputFormat='csv'):
+    return outputDirectory + 'AllConnections.' + outputFormat
+
+def writeCsv(rows, fileName, fields=FIELDS, compress=False):
+    ''' Write rows (tuples, at least len(fields) values) as semicolon separated text. '''
+    if compress:
+        outFile = gzip.open(fileName, 'wt', compresslevel=COMPRESS_LEVEL)
+    else:
+        outFile = open(fileName, 'wt', buffering=WRITE_BUFFER)
+    template = ';'.join(['%s'] * len(fields)) + '\n'
+    columns = len(fields)
+    with outFile:
+        outFile.write(';'.join(fields) + '\n')
+        rows = iter(rows)
+        while True:
+            block = list(islice(rows, WRITE_ROWS))
+            if not block:
+                break
+            if len(block[0]) != columns:
+                block = [row[:columns] for row in block]
+            outFile.write(''.join(map(template.__mod__, block)))
+
+def _columnBlocks(records, columns):
+    # Blocks of up to COLUMN_BLOCK_ROWS records, transposed into (values of column 0, ...)
+    records = iter(records)
+    while True:
+        block = list(islice(records, COLUMN_BLOCK_ROWS))
+        if not block:
+            return
+        yield list(zip(*block))[:columns]
+
+def _numpyColumn(values, dtype):
+    if dtype == 'datetime64[D]':
+        return (np.array(values, dtype=np.int64) - EPOCH_ORDINAL).astype(dtype)
+    if dtype == 'datetime64[h]':
+        return np.array(values, dtype=np.int64).astype(dtype)
+    return np.array(values, dtype=dtype)
+
+def writeNpz(records, fileName, fields=FIELDS):
+    ''' Write records (see ConnectionStore.records()) as compressed NumPy archive. '''
+    dtypes = [FIELD_TYPES[field][0] for field in fields]
+    parts = [[] for field in fields]
+    for block in _columnBlocks(records, len(fields)):
+        for part, values, dtype in zip(parts, block, dtypes):
+            part.append(_numpyColumn(values, dtype))
+    arrays = {field: np.concatenate(part) if part else _numpyColumn((), dtype)
+              for field, part, dtype in zip(fields, parts, dtypes)}
+    # Written to an open file, np.savez would append .npz to other file names
+    with open(fileName, 'wb') as outFile:
+        np.savez_compressed(outFile, **arrays)
+
+def _arrowColumn(values, arrowType):
+    if arrowType == 'date32':
+        return pa.array([value - EPOCH_ORDINAL for value in values], type=pa.int32()).cast(pa.date32())
+    if arrowType == 'timestamp[s]':
+        return pa.array([value * 3600 for value in values], type=pa.int64()).cast(pa.timestamp('s'))
+    return pa.array(values, type=pa.type_for_alias(arrowType))
+
+def writeParquet(records, fileName, fields=FIELDS):
+    ''' Write records (see ConnectionStore.records()) as Parquet file, one row group per block. '''
+    types = [FIELD_TYPES[field][1] for field in fields]
+    schema = pa.schema([(field, pa.type_for_alias(arrowType)) for field, arrowType in zip(fields, types)])
+    with pq.ParquetWriter(fileName, schema) as writer:
+        for block in _columnBlocks(records, len(fields)):
+            columns = [_arrowColumn(values, arrowType) for values, arrowType in zip(block, types)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+def writeConnections(store, fileName, outputFormat='csv', fields=FIELDS):
+    ''' Write the connections of store (any store with rows() and records() of fields) in outputFormat. '''
+    if getattr(store, 'subnets', None) is not None:
+        fields = tuple(SUBNET_FIELDS.get(field, field) for field in fields)
+    if outputFormat == 'csv':
+        writeCsv(store.rows(), fileName, fields)
+    elif outputFormat == 'csv.gz':
+        writeCsv(store.rows(), fileName, fields, compress=True)
+    elif outputFormat == 'npz':
+        writeNpz(store.records(), fileName, fields)
+    elif outputFormat == 'parquet':
+        writeParquet(store.records(), fileName, fields)
+    else:
+        raise ValueError('Unknown output format: {}'.format(outputFormat))
@@ -0,0 +1,105 @@
+'''
+Diagnostics.py
+Log file and diagnostics of bad input lines for parseSyslog.py / parseSyslogNew.py.
+
+logHandle() keeps one buffered handle per log file for the whole run (flushed at exit),
+instead of opening and closing the log file for every message.
+
+Diagnostics counts the bad lines of every file per kind (Teardown lines the parser did not
+match, connections which could not be stored) and keeps
+    - the first logLimit lines per file and kind in the log (later ones are only counted),
+    - a reservoir sample of up to samples lines per file and kind (uniformly drawn from
+      all bad lines of the file), written to the sample file when the file is done,
+    - a summary line per file and kind in the log.
+So a malformed or new format file costs a counter increment per line, and its lines can
+still be looked at.
+'''
+import atexit
+import random
+import datetime
+
+LOG_BUFFER = 64 * 1024
+SAMPLES = 20
+LOG_LIMIT = 10
+MESSAGES = {'unmatched': 'Regex did not catch relevant line',
+            'invalid': 'Connection cannot be stored, line'}
+# Log file name -> open handle
+_handles = {}
+
+def _closeHandles():
+    for handle in _handles.values():
+        handle.close()
+    _handles.clear()
+
+def logHandle(fileName):
+    ''' Buffered handle of a log file, opened for appending on first use and closed at exit. '''
+    handle = _handles.get(fileName)
+    if handle is None:
+        if not _handles:
+            atexit.register(_closeHandles)
+        handle = _handles[fileName] = open(fileName, 'at', buffering=LOG_BUFFER)
+    return handle
+
+def logLine(logMessage, logType='INFO'):
+    return '{}: {} - {}'.format(str(datetime.datetime.now()), logType, logMessage)
+
+class Diagnostics:
+
+    def __init__(self, logFile, sampleFile, encoding='latin-1', samples=SAMPLES, logLimit=LOG_LIMIT, seed=None):
+        self.logFile = logFile
+        self.sampleFile = sampleFile
+        self.encoding = encoding
+        self.samples = samples
+        self.logLimit = logLimit
+        self.random = random.Random(seed)
+        self.fileName = None
+        self.counters = {}
+        self.reservoirs = {}
+        self.totals = dict.fromkeys(MESSAGES, 0)
+
+    def log(self, logMessage, logType='INFO'):
+        print(logLine(logMessage, logType), file=logHandle(self.logFile))
+
+    def startFile(self, fileName):
+        self.fileName = fileName
+        self.counters = dict.fromkeys(MESSAGES, 0)
+        self.reservoirs = {kind: [] for kind in MESSAGES}
+
+    def _record(self, kind, lineNumber, line):
+        count = self.counters[kind] = self.counters[kind] + 1
+        if count <= self.logLimit:
+            self.log('{}: {}!'.format(MESSAGES[kind], lineNumber), 'ERROR')
+            self.log(line.decode(self.encoding, 'replace').rstrip('\r\n'))
+        # Reservoir sampling (algorithm R): every bad line ends up in the sample with the same probability
+        reservoir = self.reservoirs[kind]
+        if count <= self.samples:
+            reservoir.append((lineNumber, line))
+        else:
+            index = self.random.randrange(count)
+            if index < self.samples:
+                reservoir[index] = (lineNumber, line)
+
+    def miss(self, lineNumber, line):
+        ''' A Teardown line the parser did not match (the logMiss() of the parsers). '''
+        self._record('unmatched', lineNumber, line)
+
+    def invalid(self, lineNumber, line):
+        ''' A connection which could not be stored (ConnectionStore.add() raised ValueError). '''
+        self._record('invalid', lineNumber, line)
+
+    def endFile(self):
+        ''' Log the counters of the current file and write its samples. '''
+        for kind, count in self.counters.items():
+            if not count:
+                continue
+            self.totals[kind] += count
+            reservoir = sorted(self.reservoirs[kind])
+            self.log('{} {} lines, {} not logged, {} sampled to {}'.format(
+                     count, kind, max(count - self.logLimit, 0), len(reservoir), self.sampleFile), 'ERROR')
+            sampleFile = logHandle(self.sampleFile)
+            print(logLine('{}: {} {} lines, {} sampled'.format(self.fileName, count, kind, len(reservoir)), 'ERROR'),
+                  file=sampleFile)
+            for lineNumber, line in reservoir:
+                print('{}: {}'.format(lineNumber, line.decode(self.encoding, 'replace').rstrip('\r\n')), file=sampleFile)
+        self.counters = dict.fromkeys(MESSAGES, 0)
+        self.reservoirs = {kind: [] for kind in MESSAGES}
@@ -0,0 +1,144 @@
+'''
+DuplicateFilter.py
+Suppression of duplicate Teardown events (--dedup), e.g. of HA firewall pairs logging under
+one hostname or redundant syslog relays which send the same event more than once.
+
+An event is identified by the hostname of the firewall, the timestamp and message id it put
+in front of the Teardown message, the connection id and the bytes. The timestamp of the
+relay is not part of it, so copies a relay received a second apart are recognized as well,
+while equal events of different firewalls are kept. Instead of keeping every event, the
+keys are added to a Bloom filter of fixed size, blocked into 64 bit words: all bits of a
+key are in one word, so a lookup is a single mask test. There are two generations of it:
+the current one takes the new keys, the previous one is still looked up. When the current
+one holds as many keys as it can take at the false positive rate, it becomes the previous
+one and a new one is started. Memory stays at memoryBytes and a distinct event is taken
+for a duplicate with a probability of at most fpRate.
+
+Copies of an event are recognized as long as fewer keys than one generation holds lie
+between them. The window is the time (syslog timestamps) a generation has to cover, so
+copies less than window seconds apart are always recognized; generations filled faster
+are counted as shortGenerations, --dedup-memory should be raised then.
+
+DuplicateFilter.lines() wraps the lines of a file and drops duplicate Teardown lines, all
+other lines are passed through. The filter of a run is shared by all of its files, so
+copies in adjacent files are recognized as well; the workers of threadedParseSyslog.py
+have a filter per file (or range of a file).
+'''
+import math
+import hashlib
+from array import array
+import AsaLogParser as ALP
+import RollupStore as RS
+
+DEFAULT_MEMORY = 16 * 1024 * 1024
+DEFAULT_FP_RATE = 0.001
+DEFAULT_WINDOW = 60
+# The second half of the 128 bit hash selects the bits within a word, 6 bits each
+MAX_HASHES = 10
+TEARDOWN = b' Teardown '
+HEADER = b' : '
+
+def eventKey(line):
+    ''' Key of the Teardown event of an undecoded line: hostname, firewall timestamp and message id, connection id, bytes (or None). '''
+    head, sep, tail = line.partition(TEARDOWN)
+    end = head.find(HEADER)
+    t = tail.split(b' ', 11)
+    if end < 0 or len(t) < 11:
+        return None
+    # "Jan 15 14:36:09 fw01 : Jan 15 14:36:09 UTC: %ASA-6-302014:", the hostname ends the relay header
+    return b'|'.join((head[:end].rpartition(b' ')[2], head[end + len(HEADER):], t[2], t[10].rstrip()))
+
+def _falsePositiveRate(keysPerWord, hashes):
+    # Blocked Bloom filter: mean over the Poisson distributed number of keys in the word of a lookup
+    rate = 0.0
+    probability = math.exp(-keysPerWord)
+    for keys in range(100):
+        if keys:
+            probability *= keysPerWord / keys
+        rate += probability * (1 - (63 / 64) ** (hashes * keys)) ** hashes
+    return rate
+
+def blockedLayout(fpRate):
+    ''' (hashes, keys per 64 bit word) for which a lookup in two generations stays below fpRate. '''
+    best = (1, 0.0)
+    for hashes in range(1, MAX_HASHES + 1):
+        low, high = 0.0, 64.0
+        for step in range(40):
+            middle = (low + high) / 2
+            if _falsePositiveRate(middle, hashes) <= fpRate / 2:
+                low = middle
+            else:
+                high = middle
+        if low > best[1]:
+            best = (hashes, low)
+    return best
+
+class DuplicateFilter:
+
+    def __init__(self, memoryBytes=DEFAULT_MEMORY, fpRate=DEFAULT_FP_RATE, windowSeconds=DEFAULT_WINDOW):
+        if not 0 < fpRate < 1:
+            raise ValueError('The false positive rate has to be between 0 and 1')
+        if windowSeconds < 1:
+            raise ValueError('The window has to be at least one second')
+        # Both generations share the memory
+        self.words = max(memoryBytes // 16, 1)
+        self.hashes, keysPerWord = blockedLayout(fpRate)
+        self.capacity = max(1, int(self.words * keysPerWord))
+        self.windowSeconds = windowSeconds
+        self.current = array('Q', bytes(8 * self.words))
+        self.previous = array('Q', bytes(8 * self.words))
+        self.currentKeys = 0
+        self.duplicates = 0
+        self.generations = 1
+        self.shortGenerations = 0
+
+    def seen(self, key):
+        ''' True if key (bytes) was seen before, adds it otherwise. '''
+        value = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), 'little')
+        word = (value & 0xFFFFFFFFFFFFFFFF) % self.words
+        value >>= 64
+        mask = 0
+        for i in range(self.hashes):
+            mask |= 1 << (value & 63)
+            value >>= 6
+        if self.current[word] & mask == mask or self.previous[word] & mask == mask:
+            self.duplicates += 1
+            return True
+        if self.currentKeys >= self.capacity:
+            self.previous = self.current
+            self.current = array('Q', bytes(8 * self.words))
+            self.currentKeys = 0
+            self.generations += 1
+        self.current[word] |= mask
+        self.currentKeys += 1
+        return False
+
+    def lines(self, lines, dateOrdinal):
+        ''' Yields the undecoded lines of a file dated dateOrdinal without duplicate Teardown lines. '''
+        searchTeardown = ALP.bytesSearchPattern.search
+        lineHour = RS.lineClock(dateOrdinal)
+        seen = self.seen
+        generations = generationStart = None
+        for line in lines:
+            if searchTeardown(line):
+                key = eventKey(line)
+                if key is not None:
+                    if seen(key):
+                        continue
+                    if self.generations != generations:
+                        # The line started a generation (or is the first of the file): check the time the last one covered
+                        seconds = self._seconds(line, lineHour)
+                        if generations is not None and seconds is not None and generationStart is not None \
+                                and seconds - generationStart < self.windowSeconds:
+                            self.shortGenerations += 1
+                        generations = self.generations
+                        generationStart = seconds
+            yield line
+
+    def _seconds(self, line, lineHour):
+        # "Jan 15 14:36:09 ...", minutes and seconds follow the first ':'
+        colon = line.find(b':')
+        try:
+            return lineHour(line) * 3600 + int(line[colon + 1:colon + 3]) * 60 + int(line[colon + 4:colon + 6])
+        except ValueError:
+            return None
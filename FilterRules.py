@@ -0,0 +1,134 @@
+'''
+FilterRules.py
+Relevance filter of parsed Teardown connections, shared by all entry points.
+
+The rules are a JSON object (see DEFAULT_RULES, every key is optional):
+    minBytes     connections with fewer bytes are ignored
+    protocols    connection types to keep, null keeps all
+    sourceZones  {"include": [...] or null, "exclude": [...]}
+    targetZones  same for the target zone
+    drop         list of rules for connections to be ignored, each with the optional keys
+                 protocols, ports (lists, missing means any), minDuration and maxDuration
+                 (in seconds, inclusive)
+Without a rules file, DEFAULT_RULES reproduce the previous hard-coded filter.
+
+compileRules() turns the rules into a function reject(connType, sourceZone, targetZone,
+targetPort, duration, connBytes), which returns None for relevant connections and
+otherwise the name of the RunReport counter of the failed check. Rules are compiled
+into sets and int compares once, so the check costs a few lookups per line.
+Rules are passed around as dicts (picklable) and compiled where they are used.
+Incremental states (--state, --sqlite) do not record the rules, use --rebuild after
+changing them.
+'''
+import json
+
+DEFAULT_RULES = {
+    # Ignore 0 byte entries
+    'minBytes': 1,
+    'protocols': None,
+    'sourceZones': {'include': None, 'exclude': []},
+    'targetZones': {'include': None, 'exclude': []},
+    'drop': [
+        # UDP requests with timeouts (UDP does not supply TCP return values), duration > 0:01:59
+        {'protocols': ['UDP'], 'ports': ['53', '137', '138', '161'], 'minDuration': 120},
+    ],
+}
+DROP_KEYS = ('protocols', 'ports', 'minDuration', 'maxDuration')
+ZONE_KEYS = ('include', 'exclude')
+
+def _nameSet(value, name):
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(item, (str, int)) for item in value):
+        raise ValueError('{} has to be a list of names, got {!r}'.format(name, value))
+    return frozenset(str(item) for item in value)
+
+def _seconds(value, name):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError('{} has to be a number of seconds, got {!r}'.format(name, value))
+    return value
+
+def checkRules(rules):
+    ''' Raise ValueError for unknown keys or values of the wrong type. '''
+    if not isinstance(rules, dict):
+        raise ValueError('Rules have to be a JSON object')
+    unknown = set(rules) - set(DEFAULT_RULES)
+    if unknown:
+        raise ValueError('Unknown rules: {}'.format(', '.join(sorted(unknown))))
+    if not isinstance(rules.get('minBytes', 0), int):
+        raise ValueError('minBytes has to be a number')
+    _nameSet(rules.get('protocols'), 'protocols')
+    for zones in ('sourceZones', 'targetZones'):
+        value = rules.get(zones, {})
+        if not isinstance(value, dict) or set(value) - set(ZONE_KEYS):
+            raise ValueError('{} has to be an object with include and exclude'.format(zones))
+        for key in ZONE_KEYS:
+            _nameSet(value.get(key), '{}.{}'.format(zones, key))
+    if not isinstance(rules.get('drop', []), list):
+        raise ValueError('drop has to be a list of rules')
+    for number, rule in enumerate(rules.get('drop', []), 1):
+        if not isinstance(rule, dict) or set(rule) - set(DROP_KEYS):
+            raise ValueError('drop rule {} may only have the keys {}'.format(number, ', '.join(DROP_KEYS)))
+        _nameSet(rule.get('protocols'), 'drop rule {} protocols'.format(number))
+        _nameSet(rule.get('ports'), 'drop rule {} ports'.format(number))
+        _seconds(rule.get('minDuration'), 'drop rule {} minDuration'.format(number))
+        _seconds(rule.get('maxDuration'), 'drop rule {} maxDuration'.format(number))
+
+def loadRules(fileName):
+    ''' Rules of a JSON file, missing keys are taken from DEFAULT_RULES. '''
+    with open(fileName, 'rt') as inFile:
+        rules = json.load(inFile)
+    checkRules(rules)
+    return dict(DEFAULT_RULES, **rules)
+
+def compileRules(rules=None):
+    ''' Returns reject(connType, sourceZone, targetZone, targetPort, duration, connBytes). '''
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    minBytes = rules['minBytes']
+    protocols = _nameSet(rules['protocols'], 'protocols')
+    sourceInclude = _nameSet(rules['sourceZones'].get('include'), 'sourceZones.include')
+    sourceExclude = _nameSet(rules['sourceZones'].get('exclude'), 'sourceZones.exclude') or frozenset()
+    targetInclude = _nameSet(rules['targetZones'].get('include'), 'targetZones.include')
+    targetExclude = _nameSet(rules['targetZones'].get('exclude'), 'targetZones.exclude') or frozenset()
+    checkZones = bool(sourceInclude is not None or sourceExclude or targetInclude is not None or targetExclude)
+
+    # Drop rules with protocols and ports are indexed by connType -> port -> [(minDuration, maxDuration)],
+    # the others are tested one by one
+    indexed = {}
+    others = []
+    for rule in rules['drop']:
+        ruleProtocols = _nameSet(rule.get('protocols'), 'protocols')
+        rulePorts = _nameSet(rule.get('ports'), 'ports')
+        durations = (rule.get('minDuration') or 0, rule.get('maxDuration'))
+        if ruleProtocols is not None and rulePorts is not None:
+            for protocol in ruleProtocols:
+                for port in rulePorts:
+                    indexed.setdefault(protocol, {}).setdefault(port, []).append(durations)
+        else:
+            others.append((ruleProtocols, rulePorts) + durations)
+
+    def reject(connType, sourceZone, targetZone, targetPort, duration, connBytes):
+        if connBytes < minBytes:
+            return 'filteredBytes'
+        if protocols is not None and connType not in protocols:
+            return 'filteredProtocol'
+        if checkZones and (sourceZone in sourceExclude or targetZone in targetExclude
+                           or (sourceInclude is not None and sourceZone not in sourceInclude)
+                           or (targetInclude is not None and targetZone not in targetInclude)):
+            return 'filteredZone'
+        ports = indexed.get(connType)
+        if ports is not None:
+            durations = ports.get(targetPort)
+            if durations is not None:
+                for minDuration, maxDuration in durations:
+                    if duration >= minDuration and (maxDuration is None or duration <= maxDuration):
+                        return 'filteredDropRule'
+        for ruleProtocols, rulePorts, minDuration, maxDuration in others:
+            if ((ruleProtocols is None or connType in ruleProtocols) and (rulePorts is None or targetPort in rulePorts)
+                    and duration >= minDuration and (maxDuration is None or duration <= maxDuration)):
+                return 'filteredDropRule'
+        return None
+
+    return reject
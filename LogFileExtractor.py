@@ -1,113 +1,131 @@
-import gzip
 import datetime
+import LogFileSplitter as LFS
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+import RunReport as RR
+import DuplicateFilter as DF
+import PartitionedStore as PS
+import Sketches as SK
+
+def extractLines(connections, lines, dateOrdinal, regExPattern, encoding='latin-1', rules=None, logMiss=None,
+                 sketches=None):
+    '''
+    Add the valid Teardown connections of lines (seen at dateOrdinal) to connections, returns the number of lines.
+    lines are undecoded (bytes), only the fields of Teardown lines are decoded with encoding.
+    Connections are filtered by rules (see FilterRules, defaults if None).
+    logMiss(lineNumber, line) is called for Teardown lines the parser does not match.
+    The stored connections are added to sketches (Sketches.ConnectionSketches) as well, if given.
+    A PartitionedStore gets every connection in the partition of the hostname of its line.
+    '''
+    searchTeardown = ALP.bytesSearchPattern.search
+    regExPattern = ALP.bytesPattern(regExPattern)
+    reject = FR.compileRules(rules)
+    partitioned = isinstance(connections, PS.PartitionedStore)
+    store = connections
+    lineNumber = 0
+
+    for line in lines:
+        lineNumber += 1 
+        # Restrict to relevant Teardown events, for which the parser is optimized.
+        if searchTeardown(line):
+            fields = ALP.parseTeardownBytes(line, encoding, regExPattern)
+            if fields is None:
+                if logMiss is not None:
+                    logMiss(lineNumber, line)
+                continue
+            connType, connSourceZone, connSourceIP, connTargetZone, connTargetIP, connTargetPort, duration, connBytes = fields
+
+            # Check for relevance of log entry
+            if reject(connType, connSourceZone, connTargetZone, connTargetPort, duration, connBytes) is None:
+                # Store unique connections with number of occurences, first/last seen date and total bytes
+                if partitioned:
+                    store = connections.partition(PS.hostname(line))
+                try:
+                    store.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                              dateOrdinal, connBytes)
+                except ValueError:
+                    continue
+                if sketches is not None:
+                    sketches.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                                 dateOrdinal, connBytes)
+    return lineNumber
+
+def fileDateOrdinal(fileName, regExFileDatePattern):
+    ''' Date ordinal of the log file, taken from its name (1970-01-01 if there is no date in the name, the entry points skip such files). '''
+    matchObj = regExFileDatePattern.match(fileName)
+
+    if matchObj:
+        fileYear = matchObj.group(1)
+        fileMonth = matchObj.group(2)
+        fileDay = matchObj.group(3)
+    else:
+        fileYear = '1970'
+        fileMonth = '01'
+        fileDay = '01'
+
+    return datetime.date(int(fileYear), int(fileMonth), int(fileDay)).toordinal()
 
 class LogFileExtractor:
     
-    def __init__(self, fileName, encoding, regExPattern, regExFileDatePattern):
+    def __init__(self, fileName, encoding, regExPattern, regExFileDatePattern, startOffset=0, endOffset=None, gzipIndex=None,
+                 stats=None, rules=None, dedup=None, partitionBy=None, sketchCapacity=None):
         self.fileName = fileName
         self.encdg = encoding
         self.regExPattern = regExPattern
         self.regExFileDatePattern = regExFileDatePattern
-        # Declare dictionaries which will store accumulated connections
-        self.connections = {}
-        self.firstSeen = {}
-        self.lastSeen = {}
-        
-    def extractData(self):
-        # Open File
-        if self.fileName.endswith('.gz'):
-            inFile = gzip.open(self.fileName, 'rt', encoding=self.encdg)
+        # Byte range of the uncompressed file to be processed, see LogFileSplitter
+        self.startOffset = startOffset
+        self.endOffset = endOffset
+        self.gzipIndex = gzipIndex
+        # RunReport.FileStats, if counters and stage timers are requested
+        self.stats = stats
+        # FilterRules as dict, None for the default rules
+        self.rules = rules
+        # (memoryBytes, fpRate, windowSeconds) of a DuplicateFilter for this file (range), None for no --dedup
+        self.dedup = dedup
+        self.duplicates = 0
+        # Sketches.ConnectionSketches of the parsed connections, if a capacity is given
+        self.sketches = SK.ConnectionSketches(sketchCapacity) if sketchCapacity else None
+        # Declare store which will accumulate connections, per firewall for partitionBy 'hostname'
+        if partitionBy == 'hostname':
+            self.connections = PS.PartitionedStore()
         else:
-            inFile = open(self.fileName, 'rt', encoding=self.encdg)
+            self.connections = CS.ConnectionStore()
         
-        matchObj = self.regExFileDatePattern.match(self.fileName)
+    def _rangeLines(self, inFile):
+        # A line belongs to the range in which it starts.
+        pos = self.startOffset
+        if pos > 0:
+            # inFile is positioned one byte in front of the range, drop the partial line unless it ended there.
+            pos += len(inFile.readline()) - 1
+        for rawLine in inFile:
+            if self.endOffset is not None and pos >= self.endOffset:
+                break
+            pos += len(rawLine)
+            yield rawLine
 
-        if matchObj:
-            fileYear = matchObj.group(1)
-            fileMonth = matchObj.group(2)
-            fileDay = matchObj.group(3)
+    def extractData(self):
+        # Open File, lines are read undecoded
+        if self.startOffset > 0 or self.endOffset is not None:
+            inFile = LFS.openAt(self.fileName, max(self.startOffset - 1, 0), self.gzipIndex)
+            lines = self._rangeLines(inFile)
         else:
-            fileYear = '1970'
-            fileMonth = '01'
-            fileDay = '01'
+            inFile = LFS.openBinary(self.fileName)
+            lines = inFile
         
-        fileDate = datetime.date(int(fileYear), int(fileMonth), int(fileDay))
+        fileOrdinal = fileDateOrdinal(self.fileName, self.regExFileDatePattern)
+        if self.dedup is not None:
+            duplicateFilter = DF.DuplicateFilter(*self.dedup)
+            lines = duplicateFilter.lines(lines, fileOrdinal)
         
-        searchItems = ('Teardown TCP', 'Teardown UDP') 
-        lineNumber = 0
-        
-        for line in inFile:
-            lineNumber += 1 
-            # Restrict to relevant Teardown events, for which the regex is optimized.
-            if any(s in line for s in searchItems):
-                matchObj = self.regExPattern.match(line)
-                if matchObj:
-                    connDateTime    = matchObj.group('DateTime')
-                    # print(matchObj.group('Hostname'))
-                    # print(matchObj.group('ASA_Session'))
-                    connType        = matchObj.group('ConnectionType')
-                    # connID          = int(matchObj.group('ConnectionID'))
-                    connSourceZone  = matchObj.group('SourceZone')
-                    connSourceIP    = matchObj.group('SourceIP')
-                    connSourcePort  = matchObj.group('SourcePort')
-                    connTargetZone  = matchObj.group('TargetZone')
-                    connTargetIP    = matchObj.group('TargetIP')
-                    connTargetPort  = matchObj.group('TargetPort')   
-                    connDuration    = matchObj.group('Duration')    
-                    connBytes       = matchObj.group('Bytes')   
-                    connResult      = matchObj.group('Result')
-                else:
-                    ##############
-                    # logOutput("Regex did not catch relevant line: {}!".format(lineNumber), logf, 'ERROR')
-                    pass
-            
-                # Check for relevance of log entry
-                valid = True
-                
-                ''' 
-                Workaround - duration can be more than 23 hours causing datetime to raise an exception
-                to-do: clean exception handling
-                '''
-                hours = int(connDuration.split(':')[0])
-                if (hours > 23): 
-                    hours=23
-                    # logOutput('hours > 23: {} : {}/{}-{} bytes'.format(connDuration, connTargetPort, connType, connBytes), logf)
-                
-                duration = datetime.time( hours,
-                                          int(connDuration.split(':')[1]), 
-                                          int(connDuration.split(':')[2]))
-                # Ignore 0 byte entries
-                if (int(connBytes) < 1): 
-                    valid = False
-                else:
-                    # Skip UDP Port 53, 137, 138 requests with timeouts (UDP does not supply TCP return values)
-                    if (connType=="UDP") and (connTargetPort in ["53", "137", "138", "161"]) and (duration > datetime.time(0,1,59)): 
-                        valid = False 
-                    
-                if valid:
-                    # Store unique connections with number of occurences in dictionary                    
-                    key = ";".join([connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType])
-                    if key in self.connections:
-                        self.connections[key] += 1
-                    else:
-                        self.connections[key] = 1
-                        
-                    if key in self.firstSeen:
-                        # get iso formatted date and convert to datetime
-                        firstCompareDate = datetime.date(int(self.firstSeen[key][0:4]), 
-                                                         int(self.firstSeen[key][5:7]), 
-                                                         int(self.firstSeen[key][8:10]))
-                        lastCompareDate = datetime.date(int(self.lastSeen[key][0:4]), 
-                                                        int(self.lastSeen[key][5:7]), 
-                                                        int(self.lastSeen[key][8:10]))
-                        if firstCompareDate > fileDate: 
-                            self.firstSeen[key] = fileDate.isoformat()
-                        if lastCompareDate < fileDate:  
-                            self.lastSeen[key] = fileDate.isoformat()
-                    else:
-                        self.firstSeen[key] = fileDate.isoformat()
-                        self.lastSeen[key] = self.firstSeen[key]
-    
+        if self.stats is not None:
+            RR.extractLinesTimed(self.connections, lines, self.encdg, fileOrdinal, self.regExPattern, self.stats,
+                                 rules=self.rules, sketches=self.sketches)
+        else:
+            extractLines(self.connections, lines, fileOrdinal, self.regExPattern, self.encdg, self.rules,
+                         sketches=self.sketches)
         inFile.close()    
-        return self.connections, self.firstSeen, self.lastSeen
-        
\ No newline at end of file
+        if self.dedup is not None:
+            self.duplicates = duplicateFilter.duplicates
+        return self.connections
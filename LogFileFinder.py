@@ -0,0 +1,92 @@
+'''
+LogFileFinder.py
+Discovery of the log files of an input directory.
+
+The directory is scanned with os.scandir(), subdirectories as well with recursive. Files
+are selected by their name before anything else is looked at:
+    include  glob patterns (fnmatch) of the file names to take, all files by default
+    exclude  glob patterns of file and directory names to skip, excluded directories are
+             not scanned at all; gzip indexes (see LogFileSplitter) are always skipped
+    from/to  date range (date ordinals) of the date in the file path (regExFileDatePattern),
+             files without a date are skipped if a range is given
+Only the selected files are stat()ed, for largestFirst (descending size, so the largest
+files are started first and do not leave workers waiting at the end of a run).
+'''
+import os
+import fnmatch
+import argparse
+import datetime
+import AsaLogParser as ALP
+import LogFileSplitter as LFS
+
+def dateArgument(value):
+    ''' argparse type of --from / --to: YYYY-MM-DD to a date ordinal. '''
+    try:
+        return datetime.date.fromisoformat(value).toordinal()
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected YYYY-MM-DD")
+
+def positiveInt(value):
+    ''' argparse type of counts like --workers: an integer of at least 1. '''
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected an integer")
+    if number < 1:
+        raise argparse.ArgumentTypeError("has to be at least 1")
+    return number
+
+def fileDate(fileName, regExFileDatePattern=ALP.regExFileDatePattern):
+    ''' Date ordinal of the date in fileName, None if there is none. '''
+    matchObj = regExFileDatePattern.match(fileName)
+    if not matchObj:
+        return None
+    try:
+        return datetime.date(int(matchObj.group(1)), int(matchObj.group(2)), int(matchObj.group(3))).toordinal()
+    except ValueError:
+        return None
+
+def splitUndated(fileNames, regExFileDatePattern=ALP.regExFileDatePattern):
+    ''' (dated, undated) file names of fileNames, files without a date cannot be accounted to a day. '''
+    dated = []
+    undated = []
+    for fileName in fileNames:
+        (undated if fileDate(fileName, regExFileDatePattern) is None else dated).append(fileName)
+    return dated, undated
+
+def _matches(name, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+def findFiles(inputDirectory, include=None, exclude=None, recursive=False, dateFrom=None, dateTo=None,
+              largestFirst=False, regExFileDatePattern=ALP.regExFileDatePattern):
+    ''' Paths of the selected log files (see module description), sorted by path or largest first. '''
+    include = include or ('*',)
+    exclude = exclude or ()
+    files = []
+    directories = [inputDirectory]
+    while directories:
+        with os.scandir(directories.pop()) as scan:
+            for entry in scan:
+                # Hidden files and directories are skipped, like by glob
+                if entry.name.startswith('.') or _matches(entry.name, exclude):
+                    continue
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                    continue
+                if not entry.is_file() or entry.name.endswith(LFS.GZIP_INDEX_SUFFIX) or not _matches(entry.name, include):
+                    continue
+                if dateFrom is not None or dateTo is not None:
+                    dateOrdinal = fileDate(entry.path, regExFileDatePattern)
+                    if dateOrdinal is None or (dateFrom is not None and dateOrdinal < dateFrom) \
+                            or (dateTo is not None and dateOrdinal > dateTo):
+                        continue
+                files.append(entry)
+    if largestFirst:
+        files.sort(key=lambda entry: (-entry.stat().st_size, entry.path))
+    else:
+        files.sort(key=lambda entry: entry.path)
+    return [entry.path for entry in files]
@@ -0,0 +1,178 @@
+'''
+LogFilePipeline.py
+Staged parsing: a decompression stage feeding parser processes.
+
+The files are read (and .gz files inflated) by a single stage in the parent, which cuts
+the content into newline aligned chunks of CHUNK_SIZE bytes. The chunks are parsed by
+the workers of an executor, each chunk returns the partial aggregate of its lines.
+Inflating thereby overlaps with parsing, and all workers are busy even when there are
+fewer files than workers.
+If pigz or gzip is found on PATH, .gz files are inflated by an external 'pigz -dc' /
+'gzip -dc' process, which runs in parallel to the reading thread as well.
+
+At most maxPending chunks are on the way (submitted, parsed or waiting for the merge).
+The decompression stage blocks until the consumer has taken a result, so a slow merge
+throttles the reading instead of piling up chunks in memory.
+'''
+import io
+import time
+import queue
+import shutil
+import threading
+import subprocess
+import LogFileExtractor as LFE
+import LogFileSplitter as LFS
+import ConnectionStore as CS
+import RunReport as RR
+import Sketches as SK
+
+CHUNK_SIZE = 16 * 1024 * 1024
+# External inflaters in order of preference
+INFLATERS = ('pigz', 'gzip')
+_DONE = object()
+
+def findInflater():
+    ''' Command of an external inflater on PATH (e.g. ['/usr/bin/pigz', '-dc']) or None. '''
+    for name in INFLATERS:
+        path = shutil.which(name)
+        if path:
+            return [path, '-dc']
+    return None
+
+def readChunks(fileName, chunkSize=CHUNK_SIZE, inflater=None):
+    '''
+    Yields the uncompressed content of fileName as chunks ending with a newline (but the last one).
+    An external inflater is killed if the generator is closed before the end of the file.
+    '''
+    process = None
+    if inflater and fileName.endswith('.gz'):
+        process = subprocess.Popen(inflater + [fileName], stdout=subprocess.PIPE, bufsize=LFS.READ_BLOCKSIZE)
+        inFile = process.stdout
+    else:
+        inFile = LFS.openBinary(fileName)
+    completed = False
+    try:
+        with inFile:
+            rest = b''
+            while True:
+                block = inFile.read(chunkSize)
+                if not block:
+                    break
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    rest += block
+                    continue
+                yield rest + block[:end]
+                rest = block[end:]
+            if rest:
+                yield rest
+        completed = True
+    finally:
+        if process is not None and not completed:
+            # Stopped early (GeneratorExit or a read error): the inflater would block on the full pipe
+            process.kill()
+            process.wait()
+    if process is not None and process.wait() != 0:
+        raise OSError('{} failed for {} with exit code {}'.format(inflater[0], fileName, process.returncode))
+
+def parseChunk(chunk, fileName, dateOrdinal, regExPattern, encoding, report=False, rules=None, sketchCapacity=None):
+    # Runs inside a worker (process or thread), result has to be picklable
+    # Lines are split like lines read from a file (only at newlines, keeping them)
+    lines = io.BytesIO(chunk)
+    connections = CS.ConnectionStore()
+    sketches = SK.ConnectionSketches(sketchCapacity) if sketchCapacity else None
+    if report:
+        stats = RR.FileStats(fileName)
+        RR.extractLinesTimed(connections, lines, encoding, dateOrdinal, regExPattern, stats, rules=rules,
+                             sketches=sketches)
+    else:
+        stats = None
+        LFE.extractLines(connections, lines, dateOrdinal, regExPattern, encoding, rules, sketches=sketches)
+    return fileName, connections, stats, sketches
+
+def _profileChunk(*args):
+    return RR.profileCall(parseChunk, *args)
+
+class Pipeline:
+    '''
+    Parse fileNames chunk by chunk with the workers of executor. Iterating a Pipeline yields
+    (fileName, connections, stats, profileData, fileDone, sketches) per chunk in the order of
+    submission, fileDone is set for the last chunk of a file. sketches are the
+    Sketches.ConnectionSketches of the chunk if sketchCapacity is given, else None.
+    '''
+    def __init__(self, executor, fileNames, encoding, regExPattern, regExFileDatePattern, maxPending,
+                 chunkSize=CHUNK_SIZE, inflater=None, report=False, profile=False, rules=None, sketchCapacity=None):
+        self.executor = executor
+        self.fileNames = fileNames
+        self.encdg = encoding
+        self.regExPattern = regExPattern
+        self.regExFileDatePattern = regExFileDatePattern
+        self.chunkSize = chunkSize
+        self.inflater = inflater
+        self.report = report
+        self.profile = profile
+        self.rules = rules
+        self.sketchCapacity = sketchCapacity
+        # The last chunk of a file is held back until the next one is submitted, so at least 2
+        self.slots = threading.Semaphore(max(maxPending, 2))
+        self.results = queue.Queue()
+        self.stop = False
+        # Time spent reading and inflating in the decompression stage
+        self.readSeconds = 0.0
+        self.chunks = 0
+
+    def _produce(self):
+        # Decompression stage, runs in its own thread
+        try:
+            for fileName in self.fileNames:
+                dateOrdinal = LFE.fileDateOrdinal(fileName, self.regExFileDatePattern)
+                chunks = readChunks(fileName, self.chunkSize, self.inflater)
+                pending = None
+                try:
+                    while True:
+                        start = time.time()
+                        chunk = next(chunks, None)
+                        self.readSeconds += time.time() - start
+                        if chunk is None:
+                            break
+                        # Backpressure: wait for the consumer to take a result
+                        self.slots.acquire()
+                        if self.stop:
+                            return
+                        if pending is not None:
+                            self.results.put((pending, False))
+                        args = (chunk, fileName, dateOrdinal, self.regExPattern, self.encdg, self.report, self.rules,
+                                self.sketchCapacity)
+                        pending = self.executor.submit(_profileChunk if self.profile else parseChunk, *args)
+                        self.chunks += 1
+                finally:
+                    # Ends the inflater of a file which was not read to the end (stop or error)
+                    chunks.close()
+                # Holding back the last future of a file marks the end of the file
+                if pending is not None:
+                    self.results.put((pending, True))
+            self.results.put((_DONE, None))
+        except BaseException as error:
+            self.results.put((error, None))
+
+    def __iter__(self):
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                future, fileDone = self.results.get()
+                if future is _DONE:
+                    break
+                if isinstance(future, BaseException):
+                    raise future
+                if self.profile:
+                    (fileName, connections, stats, sketches), profileData = future.result()
+                else:
+                    (fileName, connections, stats, sketches), profileData = future.result(), None
+                self.slots.release()
+                yield fileName, connections, stats, profileData, fileDone, sketches
+        finally:
+            # Unblock the producer if the consumer gave up
+            self.stop = True
+            self.slots.release()
+            producer.join()
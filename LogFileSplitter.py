@@ -0,0 +1,232 @@
+'''
+LogFileSplitter.py
+Split single log files into byte ranges, which can be parsed in parallel.
+
+Ranges are expressed as offsets into the uncompressed content. A range does not
+have to start on a line boundary, LogFileExtractor assigns every line to the range
+in which the line starts.
+
+Gzip files cannot be entered at arbitrary positions. An access point index is built
+once (one full inflate) and stored beside the file as <file>.gz.idx. It holds the
+uncompressed size and the start of gzip members (multi member files as written by
+bgzip or concatenated rotations) as restart points. Gzip files are only split at these
+points, so every worker inflates just its own range. A single member file has no
+access point but its start and is parsed as one range (see splitGzipReason()).
+'''
+import io
+import os
+import gzip
+import json
+import zlib
+import bisect
+
+GZIP_INDEX_SUFFIX = '.idx'
+GZIP_INDEX_VERSION = 2
+# Minimum uncompressed distance between two stored access points
+DEFAULT_INDEX_SPACING = 32 * 1024 * 1024
+READ_BLOCKSIZE = 1024 * 1024
+
+class _BoundedFile(io.RawIOBase):
+    ''' Raw binary file from offset to size, content appended behind size (while it is read) is left out. '''
+    def __init__(self, fileName, offset, size):
+        self.raw = open(fileName, 'rb', buffering=0)
+        self.raw.seek(offset)
+        self.remaining = max(size - offset, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        with memoryview(buffer) as view:
+            n = self.raw.readinto(view[:self.remaining])
+        self.remaining -= n
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+def _openRaw(fileName, offset=0, size=None):
+    # Unbuffered, the callers put a BufferedReader or GzipFile on top
+    if size is not None:
+        return _BoundedFile(fileName, offset, size)
+    raw = open(fileName, 'rb', buffering=0)
+    raw.seek(offset)
+    return raw
+
+class _IndexedGzipFile(gzip.GzipFile):
+    '''
+    GzipFile reading from a member start inside the file, closes the underlying file as well.
+    prefix is returned in front of the content of the member, size limits the compressed input.
+    '''
+    def __init__(self, fileName, compressedOffset, prefix=b'', size=None):
+        raw = _openRaw(fileName, compressedOffset, size)
+        super().__init__(fileobj=raw, mode='rb')
+        # GzipFile closes myfileobj on close()
+        self.myfileobj = raw
+        self.prefix = prefix
+
+    def read(self, size=-1):
+        if self.prefix and size != 0:
+            prefix, self.prefix = self.prefix, b''
+            return prefix
+        return super().read(size)
+
+def buildGzipIndex(fileName, spacing=DEFAULT_INDEX_SPACING):
+    '''
+    Inflate fileName once and return its access point index. The points are
+    [compressedOffset, uncompressedOffset, previousByte], previousByte is the last uncompressed
+    byte in front of the point, so a range starting there needs nothing of the member before.
+    '''
+    points = [[0, 0, None]]
+    uncompressedOffset = 0
+    previousByte = None
+    # File offset of the first byte in data
+    inputOffset = 0
+    decomp = zlib.decompressobj(31)
+    with open(fileName, 'rb') as raw:
+        data = raw.read(READ_BLOCKSIZE)
+        while data:
+            out = decomp.decompress(data)
+            if out:
+                uncompressedOffset += len(out)
+                previousByte = out[-1]
+            if decomp.eof:
+                unused = decomp.unused_data
+                inputOffset += len(data) - len(unused)
+                data = unused
+                if len(data) < 2:
+                    data += raw.read(READ_BLOCKSIZE)
+                # Anything but a further member (e.g. zero padding) ends the file
+                if data[:2] != b'\x1f\x8b':
+                    break
+                decomp = zlib.decompressobj(31)
+                if uncompressedOffset - points[-1][1] >= spacing:
+                    points.append([inputOffset, uncompressedOffset, previousByte])
+            else:
+                inputOffset += len(data)
+                data = raw.read(READ_BLOCKSIZE)
+
+    stat = os.stat(fileName)
+    return {'version': GZIP_INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'uncompressedSize': uncompressedOffset,
+            'points': points}
+
+def saveGzipIndex(fileName, index):
+    try:
+        with open(fileName + GZIP_INDEX_SUFFIX, 'wt') as outFile:
+            json.dump(index, outFile)
+    except OSError:
+        # Read only archives still work, the index is just not kept for the next run
+        pass
+
+def loadGzipIndex(fileName):
+    ''' Return the stored index of fileName or None, if there is none or it is outdated. '''
+    try:
+        with open(fileName + GZIP_INDEX_SUFFIX, 'rt') as inFile:
+            index = json.load(inFile)
+        stat = os.stat(fileName)
+    except (OSError, ValueError):
+        return None
+    if (index.get('version') != GZIP_INDEX_VERSION or index.get('size') != stat.st_size
+            or index.get('mtime') != stat.st_mtime):
+        return None
+    return index
+
+def getGzipIndex(fileName, build=False, spacing=DEFAULT_INDEX_SPACING):
+    index = loadGzipIndex(fileName)
+    if index is None and build:
+        index = buildGzipIndex(fileName, spacing)
+        saveGzipIndex(fileName, index)
+    return index
+
+def splitGzipReason(gzipIndex, chunkSize):
+    ''' Why a .gz file with gzipIndex is not split into ranges of chunkSize, None if it is. '''
+    if gzipIndex is None:
+        return 'no access point index (see --gzip-index)'
+    if chunkSize <= 0 or gzipIndex['uncompressedSize'] <= chunkSize:
+        return None
+    if len(gzipIndex['points']) < 2:
+        return 'single gzip member, no access point but the start (recompress with bgzip to split it)'
+    return None
+
+def splitFile(fileName, chunkSize, gzipIndex=None):
+    ''' Return a list of (startOffset, endOffset) ranges, the last range is open ended (None). '''
+    if fileName.endswith('.gz'):
+        if gzipIndex is None or chunkSize <= 0:
+            return [(0, None)]
+        # Ranges start at access points only, a range in the middle of a member would have to
+        # inflate everything in front of it
+        ranges = []
+        start = 0
+        for compressedOffset, uncompressedOffset, previousByte in gzipIndex['points'][1:]:
+            if uncompressedOffset - start >= chunkSize:
+                ranges.append((start, uncompressedOffset))
+                start = uncompressedOffset
+        ranges.append((start, None))
+        return ranges
+
+    size = os.path.getsize(fileName)
+    if chunkSize <= 0 or size <= chunkSize:
+        return [(0, None)]
+
+    ranges = []
+    start = 0
+    while start + chunkSize < size:
+        ranges.append((start, start + chunkSize))
+        start += chunkSize
+    ranges.append((start, None))
+    return ranges
+
+def openBinary(fileName, size=None):
+    '''
+    Buffered binary stream of the uncompressed content of fileName (plain or .gz), for reading lines.
+    Only the first size bytes of the file are read if size is given (see StateStore.addFile()).
+    '''
+    if fileName.endswith('.gz'):
+        # GzipFile.readline() is a Python level call per line, a BufferedReader on top iterates lines in C
+        if size is None:
+            return io.BufferedReader(gzip.open(fileName, 'rb'), READ_BLOCKSIZE)
+        return io.BufferedReader(_IndexedGzipFile(fileName, 0, size=size), READ_BLOCKSIZE)
+    if size is None:
+        return open(fileName, 'rb', buffering=READ_BLOCKSIZE)
+    return io.BufferedReader(_BoundedFile(fileName, 0, size), READ_BLOCKSIZE)
+
+def openAppended(fileName, fileOffset, size=None):
+    '''
+    Buffered binary stream of the content appended to fileName behind fileOffset (a member start of a .gz file),
+    up to size if given.
+    '''
+    if fileName.endswith('.gz'):
+        return io.BufferedReader(_IndexedGzipFile(fileName, fileOffset, size=size), READ_BLOCKSIZE)
+    return io.BufferedReader(_openRaw(fileName, fileOffset, size), READ_BLOCKSIZE)
+
+def openAt(fileName, offset, gzipIndex=None):
+    ''' Return a binary stream of the uncompressed content of fileName, positioned at offset. '''
+    if not fileName.endswith('.gz'):
+        inFile = open(fileName, 'rb', buffering=READ_BLOCKSIZE)
+        inFile.seek(offset)
+        return inFile
+
+    compressedOffset = uncompressedOffset = 0
+    prefix = b''
+    if gzipIndex is not None:
+        points = gzipIndex['points']
+        i = bisect.bisect_right([p[1] for p in points], offset + 1) - 1
+        compressedOffset, uncompressedOffset, previousByte = points[i]
+        if uncompressedOffset == offset + 1:
+            # One byte in front of an access point (see LogFileExtractor), it is stored in the index
+            prefix = bytes([previousByte])
+            uncompressedOffset = offset
+    inFile = _IndexedGzipFile(fileName, compressedOffset, prefix)
+    skip = offset - uncompressedOffset
+    while skip > 0:
+        n = len(inFile.read(min(skip, READ_BLOCKSIZE)))
+        if n == 0:
+            break
+        skip -= n
+    return io.BufferedReader(inFile, READ_BLOCKSIZE)
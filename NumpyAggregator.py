@@ -0,0 +1,239 @@
+'''
+NumpyAggregator.py
+Optional vectorized aggregation of Teardown connections (requires NumPy).
+
+Lines are still parsed one by one (AsaLogParser), but the fields are neither decoded
+nor stored per line: the undecoded fields of up to batchLines lines are collected and
+converted per batch. Zones, connection types and IPs are looked up in caches of their
+undecoded values (so only distinct values are decoded and converted), ports are
+converted by map(int). The batch is then turned into NumPy columns and
+    - filtered with boolean masks (the FilterRules as vector compares)
+    - grouped by the connection (lexsort of the two 64 bit halves of the key of
+      ConnectionStore, boundaries of equal keys, reduceat): count and total bytes are summed,
+      first / last seen are min / max
+    - merged into the running aggregate, which is kept sorted by key: searchsorted finds the
+      connections of the batch, known ones are updated in place and new ones inserted
+finish() hands the aggregate to a ConnectionStore in bulk (ConnectionStore.addKeys()), so it
+is written by the same code (and merged into the same stores) as the result of the line by
+line path.
+
+Connections which cannot be stored (invalid IP or port) are returned by addFields() and
+reported to logInvalid by extractLines(), like the line by line path reports them. As the
+undecoded line is not kept, the logged line holds the fields only.
+Difference to the line by line path: ports are compared as numbers ("053" matches the
+rule port "53"), which does not occur in ASA logs.
+'''
+from array import array
+from operator import itemgetter
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH_LINES = 1000000
+# Marks an undecoded IP, which is no valid IPv4 address
+INVALID_IP = -1
+
+def available():
+    return np is not None
+
+class NumpyAggregator:
+
+    def __init__(self, rules=None, encoding='latin-1'):
+        if np is None:
+            raise RuntimeError('NumpyAggregator requires numpy')
+        self.rules = dict(FR.DEFAULT_RULES, **(rules or {}))
+        self.encdg = encoding
+        # Interning of zone / connection type names, same ids as in the store of finish()
+        self.names = CS.ConnectionStore()
+        # Undecoded name -> name id, undecoded IP -> int (or INVALID_IP)
+        self.rawNameIds = {}
+        self.rawIpValues = {}
+        self.aggregate = None
+
+    def _nameIds(self, values):
+        rawNameIds = self.rawNameIds
+        for value in set(values).difference(rawNameIds):
+            rawNameIds[value] = self.names.nameId(value.decode(self.encdg))
+        return np.fromiter(map(rawNameIds.__getitem__, values), dtype=np.uint16, count=len(values))
+
+    def _ipValues(self, values):
+        rawIpValues = self.rawIpValues
+        missing = set(values).difference(rawIpValues)
+        if len(rawIpValues) + len(missing) > CS.IP_CACHE_SIZE:
+            rawIpValues.clear()
+            missing = set(values)
+        missing = list(missing)
+        octets = b'.'.join(missing).split(b'.')
+        try:
+            if len(octets) != 4 * len(missing):
+                raise ValueError('Not all IPs have 4 octets')
+            octets = np.fromiter(map(int, octets), dtype=np.int64, count=len(octets)).reshape(-1, 4)
+        except ValueError:
+            # Odd values, converted one by one
+            for value in missing:
+                try:
+                    rawIpValues[value] = CS.ipToInt(value.decode(self.encdg, 'replace'))
+                except ValueError:
+                    rawIpValues[value] = INVALID_IP
+        else:
+            ipValues = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+            ipValues[(octets > 255).any(axis=1)] = INVALID_IP
+            rawIpValues.update(zip(missing, ipValues.tolist()))
+        return np.fromiter(map(rawIpValues.__getitem__, values), dtype=np.int64, count=len(values))
+
+    def _ids(self, values):
+        # Ids of the names in values, names not seen yet cannot match
+        nameIds = self.names.nameIds
+        return np.array([nameIds[name] for name in (values or ()) if name in nameIds], dtype=np.uint16)
+
+    def _keepMask(self, sourceZones, targetZones, ports, types, durations, connBytes):
+        rules = self.rules
+        keep = connBytes >= rules['minBytes']
+        if rules['protocols'] is not None:
+            keep &= np.isin(types, self._ids(rules['protocols']))
+        for zones, column in ((rules['sourceZones'], sourceZones), (rules['targetZones'], targetZones)):
+            if zones.get('include') is not None:
+                keep &= np.isin(column, self._ids(zones['include']))
+            if zones.get('exclude'):
+                keep &= ~np.isin(column, self._ids(zones['exclude']))
+        for rule in rules['drop']:
+            drop = durations >= (rule.get('minDuration') or 0)
+            if rule.get('maxDuration') is not None:
+                drop &= durations <= rule['maxDuration']
+            if rule.get('protocols') is not None:
+                drop &= np.isin(types, self._ids(rule['protocols']))
+            if rule.get('ports') is not None:
+                rulePorts = [int(port) for port in map(str, rule['ports']) if port.isdigit()]
+                drop &= np.isin(ports, np.array(rulePorts, dtype=np.int64))
+            keep &= ~drop
+        return keep
+
+    @staticmethod
+    def _groupBy(keyHigh, keyLow, counts, totalBytes, firstSeen, lastSeen):
+        # Returns the columns grouped by key, the key as one 16 byte value which sorts like the key
+        order = np.lexsort((keyLow, keyHigh))
+        keyHigh = keyHigh[order]
+        keyLow = keyLow[order]
+        change = np.empty(len(keyHigh), dtype=bool)
+        change[:1] = True
+        change[1:] = (keyHigh[1:] != keyHigh[:-1]) | (keyLow[1:] != keyLow[:-1])
+        starts = np.flatnonzero(change)
+        keys = np.empty((len(starts), 2), dtype='>u8')
+        keys[:, 0] = keyHigh[starts]
+        keys[:, 1] = keyLow[starts]
+        return (keys.view('V16').ravel(),
+                np.add.reduceat(counts[order], starts),
+                np.add.reduceat(totalBytes[order], starts),
+                np.minimum.reduceat(firstSeen[order], starts),
+                np.maximum.reduceat(lastSeen[order], starts))
+
+    def _merge(self, batch):
+        # Merge the grouped batch into the aggregate, both sorted by key
+        if self.aggregate is None:
+            self.aggregate = batch
+            return
+        keys, counts, totalBytes, firstSeen, lastSeen = self.aggregate
+        batchKeys, batchCounts, batchBytes, batchFirst, batchLast = batch
+        positions = np.searchsorted(keys, batchKeys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == batchKeys[found]
+        rows = positions[found]
+        counts[rows] += batchCounts[found]
+        totalBytes[rows] += batchBytes[found]
+        firstSeen[rows] = np.minimum(firstSeen[rows], batchFirst[found])
+        lastSeen[rows] = np.maximum(lastSeen[rows], batchLast[found])
+        new = ~found
+        if new.any():
+            positions = positions[new]
+            self.aggregate = tuple(np.insert(column, positions, batchColumn[new]) for column, batchColumn
+                                   in zip(self.aggregate, batch))
+
+    def addFields(self, fields, dateOrdinal):
+        '''
+        Filter and group a batch of undecoded fields (see AsaLogParser.parseTeardownRaw) seen at dateOrdinal.
+        Returns the indexes of the fields of relevant connections which cannot be stored (invalid IP or port).
+        '''
+        count = len(fields)
+        if not count:
+            return np.empty(0, dtype=np.intp)
+        column = lambda index: list(map(itemgetter(index), fields))
+        types = self._nameIds(column(0))
+        sourceZones = self._nameIds(column(1))
+        sourceIPs = self._ipValues(column(2))
+        targetZones = self._nameIds(column(3))
+        targetIPs = self._ipValues(column(4))
+        ports = np.fromiter(map(int, column(5)), dtype=np.int64, count=count)
+        durations = np.fromiter(map(itemgetter(6), fields), dtype=np.int64, count=count)
+        connBytes = np.fromiter(map(itemgetter(7), fields), dtype=np.int64, count=count)
+
+        # Filtered first, like the line by line path: only relevant connections which ConnectionStore.add() rejects are invalid
+        relevant = self._keepMask(sourceZones, targetZones, ports, types, durations, connBytes)
+        valid = (sourceIPs != INVALID_IP) & (targetIPs != INVALID_IP) & (ports <= 0xFFFF)
+        keep = relevant & valid
+        invalid = np.flatnonzero(relevant & ~valid)
+        if not keep.any():
+            return invalid
+        # The key of ConnectionStore.key() in two 64 bit halves:
+        # SourceIP | SourceZone | TargetIP high bits and TargetIP low bits | TargetZone | TargetPort | ConnectionType
+        targetIPs = targetIPs[keep].astype(np.uint64)
+        keyHigh = ((sourceIPs[keep].astype(np.uint64) << np.uint64(32)) | (sourceZones[keep].astype(np.uint64) << np.uint64(16))
+                   | (targetIPs >> np.uint64(16)))
+        keyLow = (((targetIPs & np.uint64(0xFFFF)) << np.uint64(48)) | (targetZones[keep].astype(np.uint64) << np.uint64(32))
+                  | (ports[keep].astype(np.uint64) << np.uint64(16)) | types[keep].astype(np.uint64))
+        dates = np.full(len(keyHigh), dateOrdinal, dtype=np.int32)
+        self._merge(self._groupBy(keyHigh, keyLow, np.ones(len(keyHigh), dtype=np.int64), connBytes[keep], dates, dates))
+        return invalid
+
+    def finish(self):
+        ''' Returns the aggregate as ConnectionStore and starts over. '''
+        store = CS.ConnectionStore()
+        store.names = self.names.names[:]
+        store.nameIds = self.names.nameIds.copy()
+        if self.aggregate is not None:
+            keys, counts, totalBytes, firstSeen, lastSeen = self.aggregate
+            halves = keys.view('>u8').reshape(-1, 2)
+            store.addKeys([high << 64 | low for high, low in zip(halves[:, 0].tolist(), halves[:, 1].tolist())],
+                          firstSeen.tolist(), totalBytes.tolist(), counts.tolist(), lastSeen.tolist())
+        self.aggregate = None
+        return store
+
+def _addBatch(aggregator, batch, lineNumbers, dateOrdinal, logInvalid):
+    invalid = aggregator.addFields(batch, dateOrdinal)
+    if logInvalid is not None:
+        for index in invalid.tolist():
+            logInvalid(lineNumbers[index], b' '.join(str(field).encode('ascii') if isinstance(field, int) else field
+                                                     for field in batch[index]))
+
+def extractLines(aggregator, lines, dateOrdinal, regExPattern, logMiss=None, batchLines=BATCH_LINES, logInvalid=None):
+    '''
+    Like LogFileExtractor.extractLines() for a NumpyAggregator, returns the number of lines.
+    logInvalid(lineNumber, fields) is called for relevant connections which cannot be stored,
+    with the undecoded fields joined by spaces instead of the line.
+    '''
+    searchTeardown = ALP.bytesSearchPattern.search
+    regExPattern = ALP.bytesPattern(regExPattern)
+    parse = ALP.parseTeardownRaw
+    batch = []
+    lineNumbers = array('q')
+    lineNumber = 0
+    for line in lines:
+        lineNumber += 1
+        if searchTeardown(line):
+            fields = parse(line, regExPattern)
+            if fields is None:
+                if logMiss is not None:
+                    logMiss(lineNumber, line)
+                continue
+            batch.append(fields)
+            lineNumbers.append(lineNumber)
+            if len(batch) >= batchLines:
+                _addBatch(aggregator, batch, lineNumbers, dateOrdinal, logInvalid)
+                batch = []
+                lineNumbers = array('q')
+    _addBatch(aggregator, batch, lineNumbers, dateOrdinal, logInvalid)
+    return lineNumber
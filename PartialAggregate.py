@@ -0,0 +1,168 @@
+'''
+PartialAggregate.py
+Mergeable partial aggregates for sharded runs (see shardParseSyslog.py).
+
+A partial file is gzip compressed and self-describing:
+    PARTIAL_MAGIC | header length (uint32) | header (JSON) | records
+The header holds the format version, the zone and connection type names, the rules and
+encoding the logs were parsed with and the processed files (path, size, mtime), plus
+the shard selection or the merged partials. Records are the fixed size records of the
+spilled runs (SpillingConnectionStore.RUN_RECORD), sorted by connection key.
+
+The names of the header are sorted and the name ids in the keys index into them, so the
+key order is the order of (SourceIP, SourceZone, TargetIP, TargetZone, TargetPort,
+ConnectionType) with names in alphabetical order. PartialMerge translates the ids of all
+partials into the sorted union of their names, which keeps every partial sorted, and
+streams a k-way merge over the records: counts and bytes are added, firstSeen / lastSeen
+are min / max. Only the current record of every partial is held in memory. A merge can
+be written as partial again, merging is associative.
+'''
+import os
+import gzip
+import json
+import heapq
+import struct
+import datetime
+import ConnectionStore as CS
+import SpillingConnectionStore as SCS
+
+PARTIAL_MAGIC = b'ASAPART\x00'
+PARTIAL_VERSION = 1
+HEADER_LENGTH = struct.Struct('<I')
+RECORD = SCS.RUN_RECORD
+BLOCK_RECORDS = SCS.RUN_BLOCK_RECORDS
+
+def fileInfo(fileName):
+    ''' Manifest entry of a processed log file. '''
+    stat = os.stat(fileName)
+    return {'path': os.path.abspath(fileName), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def _writeFile(fileName, header, records):
+    # records: (key, count, firstSeen, lastSeen, totalBytes) sorted by key, with the name ids of header['names']
+    # Written to a temporary file first, so other nodes never pick up a partial file half written
+    tmpFile = fileName + '.tmp'
+    headerData = json.dumps(header).encode('utf-8')
+    with gzip.open(tmpFile, 'wb', compresslevel=1) as outFile:
+        outFile.write(PARTIAL_MAGIC + HEADER_LENGTH.pack(len(headerData)) + headerData)
+        block = []
+        for key, count, first, last, totalBytes in records:
+            block.append(RECORD.pack(key >> 64, key & 0xFFFFFFFFFFFFFFFF, count, first, last, totalBytes))
+            if len(block) == BLOCK_RECORDS:
+                outFile.write(b''.join(block))
+                block = []
+        outFile.write(b''.join(block))
+    os.replace(tmpFile, fileName)
+
+def writePartial(store, fileName, files, rules, encoding, shard=None):
+    ''' Write the connections of store (a ConnectionStore) as partial file, files are fileInfo() entries. '''
+    # Names are interned in sorted order, merge() translates the ids of store
+    sortedStore = CS.ConnectionStore()
+    for name in sorted(store.names):
+        sortedStore.nameId(name)
+    sortedStore.merge(store)
+    header = {'version': PARTIAL_VERSION, 'created': datetime.datetime.now().isoformat(), 'names': sortedStore.names,
+              'rules': rules, 'encoding': encoding, 'files': files, 'shard': shard, 'partials': []}
+    rowIndex = sortedStore.rowIndex
+    records = ((key, sortedStore.counts[row], sortedStore.firstSeen[row], sortedStore.lastSeen[row],
+                sortedStore.totalBytes[row]) for key, row in sorted(rowIndex.items()))
+    _writeFile(fileName, header, records)
+    return len(rowIndex)
+
+def _openPartial(fileName):
+    inFile = gzip.open(fileName, 'rb')
+    try:
+        magic = inFile.read(len(PARTIAL_MAGIC) + HEADER_LENGTH.size)
+        if len(magic) != len(PARTIAL_MAGIC) + HEADER_LENGTH.size or not magic.startswith(PARTIAL_MAGIC):
+            raise ValueError('Not a partial aggregate: {}'.format(fileName))
+        header = json.loads(inFile.read(HEADER_LENGTH.unpack(magic[len(PARTIAL_MAGIC):])[0]).decode('utf-8'))
+        if header.get('version') != PARTIAL_VERSION:
+            raise ValueError('Unsupported partial version: {}'.format(fileName))
+    except (OSError, EOFError, ValueError):
+        inFile.close()
+        raise
+    return inFile, header
+
+def readHeader(fileName):
+    inFile, header = _openPartial(fileName)
+    inFile.close()
+    return header
+
+def readRecords(fileName, idMap=None):
+    ''' Yields the records of a partial as (key, count, firstSeen, lastSeen, totalBytes), name ids translated by idMap. '''
+    inFile, header = _openPartial(fileName)
+    with inFile:
+        if idMap == list(range(len(idMap or ()))):
+            idMap = None
+        while True:
+            data = inFile.read(RECORD.size * BLOCK_RECORDS)
+            if not data:
+                break
+            if len(data) % RECORD.size:
+                raise ValueError('Truncated partial aggregate: {}'.format(fileName))
+            for high, low, count, first, last, totalBytes in RECORD.iter_unpack(data):
+                key = high << 64 | low
+                if idMap is not None:
+                    key = ((key & ~CS.NAME_ID_MASK)
+                           | idMap[(key >> 80) & 0xFFFF] << 80
+                           | idMap[(key >> 32) & 0xFFFF] << 32
+                           | idMap[key & 0xFFFF])
+                yield key, count, first, last, totalBytes
+
+def readStore(fileName):
+    ''' The connections of a partial as ConnectionStore. '''
+    store = CS.ConnectionStore()
+    for name in readHeader(fileName)['names']:
+        store.nameId(name)
+    for key, count, first, last, totalBytes in readRecords(fileName):
+        store.addKey(key, first, totalBytes, count, last)
+    return store
+
+class PartialMerge(CS.ConnectionStore):
+    '''
+    Streaming merge of partial files. Holds no connections, rows() and records() merge the
+    partials on every call (see ConnectionWriter.writeConnections()).
+    '''
+    def __init__(self, fileNames):
+        super().__init__()
+        self.fileNames = list(fileNames)
+        self.headers = [readHeader(fileName) for fileName in self.fileNames]
+        # Partials of different rules or with overlapping files cannot be merged into a valid aggregate
+        for key in ('rules', 'encoding'):
+            if len({json.dumps(header[key], sort_keys=True) for header in self.headers}) > 1:
+                raise ValueError('Partials were built with different {}'.format(key))
+        seen = {}
+        for fileName, header in zip(self.fileNames, self.headers):
+            for info in header['files']:
+                if info['path'] in seen:
+                    raise ValueError('{} is part of {} and {}'.format(info['path'], seen[info['path']], fileName))
+                seen[info['path']] = fileName
+        for name in sorted(set().union(*(header['names'] for header in self.headers))):
+            self.nameId(name)
+
+    def mergedRecords(self):
+        ''' (key, count, firstSeen, lastSeen, totalBytes) of all partials, one per connection, sorted by key. '''
+        partials = [readRecords(fileName, [self.nameIds[name] for name in header['names']])
+                    for fileName, header in zip(self.fileNames, self.headers)]
+        return SCS.combineRecords(heapq.merge(*partials))
+
+    def rows(self):
+        isoDates = {}
+        for key, count, first, last, totalBytes in self.mergedRecords():
+            if first not in isoDates:
+                isoDates[first] = datetime.date.fromordinal(first).isoformat()
+            if last not in isoDates:
+                isoDates[last] = datetime.date.fromordinal(last).isoformat()
+            yield self.unpackKey(key) + (count, isoDates[first], isoDates[last], totalBytes)
+
+    def records(self):
+        for key, count, first, last, totalBytes in self.mergedRecords():
+            yield self.recordValues(key) + (count, first, last, totalBytes)
+
+    def writePartial(self, fileName):
+        ''' Write the merge as partial file. '''
+        header = {'version': PARTIAL_VERSION, 'created': datetime.datetime.now().isoformat(), 'names': self.names,
+                  'rules': self.headers[0]['rules'] if self.headers else None,
+                  'encoding': self.headers[0]['encoding'] if self.headers else None,
+                  'files': [info for header in self.headers for info in header['files']],
+                  'shard': None, 'partials': [os.path.abspath(fileName) for fileName in self.fileNames]}
+        _writeFile(fileName, header, self.mergedRecords())
@@ -0,0 +1,93 @@
+'''
+PartialCache.py
+Content addressed cache of the partial aggregates of single log files (--cache).
+
+The connections of a file depend on its content, its date (taken from the file name), the
+encoding, the filter rules, the parser and the --dedup settings. An entry is a partial file
+(see PartialAggregate) named by the sha256 of
+    sha256 of the file content | file date | fingerprint of encoding, rules, pattern and dedup
+so a rerun over unchanged files with the same configuration merges the cached partials
+instead of inflating and parsing the files again, while changed rules or a renamed file
+with another date miss the cache. Entries used by a run are touched, evict() removes the
+least recently used entries until the cache fits into its size limit.
+'''
+import os
+import json
+import zlib
+import hashlib
+import FilterRules as FR
+import PartialAggregate as PA
+import StateStore as SS
+
+CACHE_SUFFIX = '.partial'
+
+def fingerprint(encoding, rules, regExPattern, dedup=None):
+    ''' Fingerprint of the parser configuration, rules None are the default rules, dedup the DuplicateFilter settings. '''
+    pattern = regExPattern.pattern
+    config = {'version': PA.PARTIAL_VERSION, 'encoding': encoding, 'rules': dict(FR.DEFAULT_RULES, **(rules or {})),
+              'pattern': pattern.decode('latin-1') if isinstance(pattern, bytes) else pattern,
+              'dedup': list(dedup) if dedup else None}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+class PartialCache:
+
+    def __init__(self, directory, maxBytes, encoding, rules, regExPattern, dedup=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.encoding = encoding
+        self.rules = dict(FR.DEFAULT_RULES, **(rules or {}))
+        self.fingerprint = fingerprint(encoding, rules, regExPattern, dedup)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, fileHash, dateOrdinal):
+        ''' Cache key of a file with content hash fileHash (see StateStore.fileHash()) dated dateOrdinal. '''
+        return hashlib.sha256('{}|{}|{}'.format(fileHash, dateOrdinal, self.fingerprint).encode('ascii')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        ''' Cached ConnectionStore of key or None. '''
+        path = self._path(key)
+        try:
+            store = PA.readStore(path)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, zlib.error):
+            # Missing or broken entries (e.g. a disk ran full) are parsed again and replaced
+            self.misses += 1
+            return None
+        self.hits += 1
+        return store
+
+    def put(self, key, store, fileName):
+        ''' Add the connections of fileName as entry key. '''
+        PA.writePartial(store, self._path(key), [PA.fileInfo(fileName)], self.rules, self.encoding)
+
+    def evict(self):
+        ''' Remove the least recently used entries until the cache fits into maxBytes, returns the number removed. '''
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(CACHE_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+def cacheKeys(cache, fileNames, dateOrdinals, mapper=map):
+    ''' Cache keys of fileNames, the files are hashed with mapper (e.g. executor.map). '''
+    return [cache.key(fileHash, dateOrdinal) for fileHash, dateOrdinal in
+            zip(mapper(SS.fileHash, fileNames), dateOrdinals)]
@@ -0,0 +1,67 @@
+'''
+PartitionedStore.py
+Connections aggregated per firewall (--partition-by hostname).
+
+A PartitionedStore holds a ConnectionStore per hostname of the syslog header
+("Jan 15 14:36:09 fw01 : ..."). The parsers add every connection to partition(hostname(line))
+of its line (see LogFileExtractor.extractLines()), add() does the same with the hostname
+given in front of the arguments of ConnectionStore.add().
+Every worker fills a store of its own, merge() combines them partition by partition, and
+total() is the aggregate over all firewalls, as written without partitions.
+'''
+import re
+import hashlib
+import ConnectionStore as CS
+
+HEADER = b' : '
+FILE_NAME_CHARACTERS = re.compile(r'[^A-Za-z0-9._-]')
+
+def hostname(line):
+    ''' Hostname of the syslog header of an undecoded line ('' if there is none). '''
+    head = line[:line.find(HEADER)] if HEADER in line else b''
+    return head.rpartition(b' ')[2].decode('latin-1')
+
+def partitionFileName(outputDirectory, partition, outputFormat='csv'):
+    '''
+    AllConnections_<hostname>.<format>. Characters not allowed in file names are replaced by _
+    and a hash of the hostname is appended then, so "fw/01" and "fw_01" get files of their own.
+    '''
+    name = FILE_NAME_CHARACTERS.sub('_', partition)
+    if name != partition or not name:
+        name += '_' + hashlib.sha256(partition.encode('utf-8')).hexdigest()[:8]
+    return '{}AllConnections_{}.{}'.format(outputDirectory, name, outputFormat)
+
+class PartitionedStore:
+    # SubnetTree or None, applied to all partitions
+    subnets = None
+
+    def __init__(self):
+        self.partitions = {}
+
+    def __len__(self):
+        return sum(len(store) for store in self.partitions.values())
+
+    def partition(self, name):
+        ''' ConnectionStore of partition name, created if there is none yet. '''
+        store = self.partitions.get(name)
+        if store is None:
+            store = self.partitions[name] = CS.ConnectionStore()
+            store.subnets = self.subnets
+        return store
+
+    def add(self, name, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes):
+        ''' Count one connection of the firewall name, see ConnectionStore.add(). '''
+        self.partition(name).add(sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes)
+
+    def merge(self, other):
+        ''' Add the partitions of other (a PartitionedStore). '''
+        for name, store in other.partitions.items():
+            self.partition(name).merge(store)
+
+    def total(self):
+        ''' ConnectionStore of the connections of all partitions. '''
+        store = CS.ConnectionStore()
+        store.subnets = self.subnets
+        for name in sorted(self.partitions):
+            store.merge(self.partitions[name])
+        return store
@@ -0,0 +1,154 @@
+'''
+RollupStore.py
+Time bucketed aggregate of connections (rollup cube).
+
+Connections are counted per bucket of bucketHours hours. The time is taken from the
+syslog timestamp at the start of each line ("Jan 15 14:36:09 fw01 : ..."), which has no
+year: the year is the one of the log file date, or the previous / next year for
+timestamps more than half a year after / before the file date (files rotated around new
+year). Lines without a readable timestamp are counted at 00:00 of the file date.
+
+RollupStore is a ConnectionStore whose packed keys carry the bucket above the connection:
+    bucket (hours since 1970-01-01 of the bucket start) << 128 | ConnectionStore key
+so adding, merging and pickling work as for the connections. count and totalBytes are
+per bucket, firstSeen / lastSeen are the first / last day seen within the bucket.
+rollup() re-aggregates the store to larger buckets (e.g. 24 for days, 168 for weeks,
+which start on Monday), without going back to the log files. Stores are saved with
+save() and loaded with load(), see rollupConnections.py for queries on saved stores.
+'''
+import os
+import pickle
+import datetime
+import ConnectionStore as CS
+
+ROLLUP_VERSION = 1
+ROLLUP_FIELDS = ('bucket', 'SourceIP', 'SourceZone', 'TargetIP', 'TargetZone', 'TargetPort', 'ConnectionType',
+                 'count', 'firstSeen', 'lastSeen', 'totalBytes')
+CONNECTION_KEY_MASK = (1 << 128) - 1
+# datetime.date(1970, 1, 1).toordinal()
+EPOCH_ORDINAL = 719163
+EPOCH = datetime.datetime(1970, 1, 1)
+# Buckets of whole weeks start on Monday, 1970-01-05 00:00 is 96 hours after the epoch
+WEEK_HOURS = 168
+WEEK_OFFSET = 96
+MONTHS = {name.encode('ascii'): number for number, name in
+          enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+def bucketStart(hour, bucketHours):
+    ''' Start (hours since the epoch) of the bucket of bucketHours, in which hour lies. '''
+    offset = WEEK_OFFSET if bucketHours % WEEK_HOURS == 0 else 0
+    return (hour - offset) // bucketHours * bucketHours + offset
+
+def _stampHour(stamp, fileDate):
+    # "<month> <day> <hour>" to hours since the epoch, None if it cannot be read
+    try:
+        month, day, hour = stamp.split()
+        month = MONTHS[month]
+        hour = int(hour)
+        if hour > 23:
+            return None
+        date = datetime.date(fileDate.year, month, int(day))
+        if (date - fileDate).days > 183:
+            date = datetime.date(fileDate.year - 1, month, int(day))
+        elif (fileDate - date).days > 183:
+            date = datetime.date(fileDate.year + 1, month, int(day))
+    except (KeyError, ValueError):
+        return None
+    return (date.toordinal() - EPOCH_ORDINAL) * 24 + hour
+
+def lineClock(dateOrdinal):
+    ''' Returns hour(line): hours since the epoch of the timestamp of an undecoded line of a file dated dateOrdinal. '''
+    fileDate = datetime.date.fromordinal(dateOrdinal)
+    default = (dateOrdinal - EPOCH_ORDINAL) * 24
+    # Timestamp up to the hour ("Jan 15 14") -> hour, the same for all lines of an hour
+    hours = {}
+
+    def hour(line):
+        stamp = line[:line.find(b':')]
+        value = hours.get(stamp)
+        if value is None:
+            value = _stampHour(stamp, fileDate)
+            value = hours[stamp] = default if value is None else value
+        return value
+
+    return hour
+
+class RollupStore(CS.ConnectionStore):
+
+    def __init__(self, bucketHours=1):
+        super().__init__()
+        if bucketHours < 1:
+            raise ValueError('Buckets have to be at least one hour')
+        self.bucketHours = bucketHours
+
+    def add(self, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, hour, connBytes):
+        ''' Count one connection seen at hour (hours since the epoch, see lineClock()), raises ValueError like key(). '''
+        key = bucketStart(hour, self.bucketHours) << 128 | self.key(sourceIP, sourceZone, targetIP, targetZone,
+                                                                     targetPort, connType)
+        self.addKey(key, hour // 24 + EPOCH_ORDINAL, connBytes)
+
+    def merge(self, other):
+        ''' Add all buckets of other, which has to have the same bucketHours. '''
+        if other.bucketHours != self.bucketHours:
+            raise ValueError('Cannot merge buckets of {} hours into buckets of {} hours'.format(
+                             other.bucketHours, self.bucketHours))
+        super().merge(other)
+
+    def copy(self):
+        other = RollupStore(self.bucketHours)
+        other.subnets = self.subnets
+        other.merge(self)
+        return other
+
+    def rollup(self, bucketHours):
+        ''' New RollupStore with the connections re-aggregated into buckets of bucketHours. '''
+        if bucketHours % self.bucketHours:
+            raise ValueError('Buckets of {} hours cannot be split into buckets of {} hours'.format(
+                             self.bucketHours, bucketHours))
+        other = RollupStore(bucketHours)
+        other.names = self.names[:]
+        other.nameIds = self.nameIds.copy()
+        other.subnets = self.subnets
+        for key, row in self.rowIndex.items():
+            other.addKey(bucketStart(key >> 128, bucketHours) << 128 | key & CONNECTION_KEY_MASK,
+                         self.firstSeen[row], self.totalBytes[row], self.counts[row], self.lastSeen[row])
+        return other
+
+    def connections(self):
+        ''' The connections summed over all buckets as ConnectionStore. '''
+        store = CS.ConnectionStore()
+        store.names = self.names[:]
+        store.nameIds = self.nameIds.copy()
+        store.subnets = self.subnets
+        for key, row in self.rowIndex.items():
+            store.addKey(key & CONNECTION_KEY_MASK, self.firstSeen[row], self.totalBytes[row], self.counts[row],
+                         self.lastSeen[row])
+        return store
+
+    def unpackKeyValues(self, key):
+        ''' (bucket,) + ConnectionStore.unpackKeyValues() of the connection. '''
+        return (key >> 128,) + super().unpackKeyValues(key & CONNECTION_KEY_MASK)
+
+    def unpackKey(self, key):
+        ''' (bucket start as "YYYY-MM-DD HH:00",) + ConnectionStore.unpackKey() of the connection. '''
+        bucket = EPOCH + datetime.timedelta(hours=key >> 128)
+        # ConnectionStore.unpackKey() would call unpackKeyValues() of this class
+        sourceIP, sourceZone, targetIP, targetZone, targetPort, connType = super().unpackKeyValues(key & CONNECTION_KEY_MASK)
+        renderIp = CS.intToIp if self.subnets is None else self.subnets.render
+        return (bucket.strftime('%Y-%m-%d %H:00'), renderIp(sourceIP), sourceZone, renderIp(targetIP), targetZone,
+                str(targetPort), connType)
+
+    def save(self, fileName):
+        # Write to a temporary file first, so an aborted run does not destroy the previous rollup
+        tmpFile = fileName + '.tmp'
+        with open(tmpFile, 'wb') as outFile:
+            pickle.dump({'version': ROLLUP_VERSION, 'rollup': self}, outFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpFile, fileName)
+
+def load(fileName):
+    ''' RollupStore saved to fileName with RollupStore.save(). '''
+    with open(fileName, 'rb') as inFile:
+        rollup = pickle.load(inFile)
+    if rollup.get('version') != ROLLUP_VERSION:
+        raise ValueError('Unsupported rollup file version: {}'.format(fileName))
+    return rollup['rollup']
@@ -0,0 +1,184 @@
+'''
+RunReport.py
+Optional instrumentation of parser runs.
+
+extractLinesTimed() is the parsing loop of LogFileExtractor.extractLines() with
+counters and timers per stage, it is only used when a report is requested:
+    read       reading (and for .gz inflating) the undecoded lines
+    prefilter  bytesSearchPattern test of every line
+    parse      regex of the prefilter hits, including decoding of their fields
+    store      filters and ConnectionStore updates
+Counters: lines, prefilter hits, parse misses, lines filtered per check of FilterRules
+(bytes, protocol, zone, drop rule), rejected connections (not storable) and new /
+updated connections.
+
+RunReport collects the FileStats of all files (of workers as well, FileStats are
+picklable and merged per file) and writes them as JSON. profileCall() runs a function
+under cProfile and returns the profile data in a picklable form, so the profiles of
+worker processes can be combined by RunReport as well.
+'''
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import datetime
+import AsaLogParser as ALP
+import FilterRules as FR
+import PartitionedStore as PS
+
+COUNTERS = ('lines', 'bytes', 'prefilterHits', 'parseMisses', 'filteredBytes', 'filteredProtocol', 'filteredZone',
+            'filteredDropRule', 'rejected', 'newConnections', 'updatedConnections')
+STAGES = ('read', 'prefilter', 'parse', 'store')
+
+class FileStats:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def merge(self, other):
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, value in other.seconds.items():
+            self.seconds[name] += value
+
+    def asDict(self):
+        seconds = sum(self.seconds.values())
+        return dict(file=self.fileName, size=os.path.getsize(self.fileName) if os.path.exists(self.fileName) else None,
+                    linesPerSecond=round(self.counters['lines'] / seconds) if seconds else None,
+                    seconds={name: round(value, 4) for name, value in self.seconds.items()}, **self.counters)
+
+def extractLinesTimed(connections, rawLines, encoding, dateOrdinal, regExPattern, stats, logMiss=None, rules=None,
+                      sketches=None):
+    ''' extractLines() with counters and stage timers added to stats (FileStats). '''
+    clock = time.perf_counter
+    searchTeardown = ALP.bytesSearchPattern.search
+    regExPattern = ALP.bytesPattern(regExPattern)
+    reject = FR.compileRules(rules)
+    partitioned = isinstance(connections, PS.PartitionedStore)
+    store = connections
+    counters = stats.counters
+    lines = prefilterHits = parseMisses = filtered = rejected = newConnections = 0
+    size = 0
+    readTime = prefilterTime = parseTime = storeTime = 0.0
+    rawLines = iter(rawLines)
+
+    start = clock()
+    for line in rawLines:
+        t2 = clock()
+        hit = searchTeardown(line)
+        t3 = clock()
+        readTime += t2 - start
+        prefilterTime += t3 - t2
+        lines += 1
+        size += len(line)
+        if hit:
+            prefilterHits += 1
+            fields = ALP.parseTeardownBytes(line, encoding, regExPattern)
+            t4 = clock()
+            parseTime += t4 - t3
+            if fields is None:
+                parseMisses += 1
+                if logMiss is not None:
+                    logMiss(lines, line)
+                start = clock()
+                continue
+            connType, connSourceZone, connSourceIP, connTargetZone, connTargetIP, connTargetPort, duration, connBytes = fields
+            # Same filters as extractLines()
+            reason = reject(connType, connSourceZone, connTargetZone, connTargetPort, duration, connBytes)
+            if reason is not None:
+                counters[reason] += 1
+                filtered += 1
+            else:
+                if partitioned:
+                    store = connections.partition(PS.hostname(line))
+                before = len(store.rowIndex)
+                try:
+                    store.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                              dateOrdinal, connBytes)
+                    # A SpillingConnectionStore may have been spilled (cleared) by add()
+                    newConnections += max(len(store.rowIndex) - before, 0)
+                except ValueError:
+                    rejected += 1
+                else:
+                    if sketches is not None:
+                        sketches.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort,
+                                     connType, dateOrdinal, connBytes)
+            start = clock()
+            storeTime += start - t4
+        else:
+            start = t3
+
+    counters['lines'] += lines
+    counters['bytes'] += size
+    counters['prefilterHits'] += prefilterHits
+    counters['parseMisses'] += parseMisses
+    counters['rejected'] += rejected
+    counters['newConnections'] += newConnections
+    counters['updatedConnections'] += prefilterHits - parseMisses - filtered - rejected - newConnections
+    for name, value in zip(STAGES, (readTime, prefilterTime, parseTime, storeTime)):
+        stats.seconds[name] += value
+    return lines
+
+class _ProfileData:
+    # Stand-in for a Profile object, pstats.Stats only needs create_stats() and stats
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def profileCall(function, *args):
+    ''' Returns (result of function(*args), picklable profile data). '''
+    profile = cProfile.Profile()
+    result = profile.runcall(function, *args)
+    profile.create_stats()
+    return result, profile.stats
+
+class RunReport:
+
+    def __init__(self, entryPoint):
+        self.entryPoint = entryPoint
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.files = {}
+        self.profileStats = None
+
+    def fileStats(self, fileName):
+        stats = self.files.get(fileName)
+        if stats is None:
+            stats = self.files[fileName] = FileStats(fileName)
+        return stats
+
+    def addFileStats(self, stats):
+        ''' Merge the stats of a worker (e.g. of one range of a file). '''
+        self.fileStats(stats.fileName).merge(stats)
+
+    def addProfile(self, profileData):
+        if self.profileStats is None:
+            self.profileStats = pstats.Stats(_ProfileData(profileData))
+        else:
+            self.profileStats.add(_ProfileData(profileData))
+
+    def writeProfile(self, profileFile):
+        if self.profileStats is not None:
+            self.profileStats.dump_stats(profileFile)
+
+    def asDict(self, **extra):
+        totals = FileStats('')
+        for stats in self.files.values():
+            totals.merge(stats)
+        seconds = time.perf_counter() - self.start
+        totalsDict = totals.asDict()
+        del totalsDict['file'], totalsDict['size'], totalsDict['linesPerSecond']
+        return dict(entryPoint=self.entryPoint, arguments=sys.argv[1:], started=self.started.isoformat(),
+                    seconds=round(seconds, 3), linesPerSecond=round(totals.counters['lines'] / seconds) if seconds else None,
+                    totals=totalsDict, files=[self.files[fileName].asDict() for fileName in sorted(self.files)], **extra)
+
+    def write(self, reportFile, **extra):
+        ''' Write the report as JSON, extra items are added at the top level. '''
+        with open(reportFile, 'wt') as outFile:
+            json.dump(self.asDict(**extra), outFile, indent=2)
@@ -0,0 +1,327 @@
+'''
+Sketches.py
+Heavy hitters and distinct counts of fixed size (--sketches), for dashboards which need
+"top talkers", "top target ports" or "distinct sources of a target" without the full
+AllConnections file.
+
+SpaceSaving keeps the capacity items with the largest (weighted) counts. An item which is
+not tracked replaces the one with the smallest count and takes over its count as error, so
+counts are overestimated by at most error, and every item with more than total / capacity
+is tracked. CountMin counts all items in depth rows of width counters and overestimates
+an item by the collisions in its least loaded row. HeavyHitters pairs both, an item is
+reported with the smaller of the two estimates. HyperLogLog estimates the number of
+distinct values from 2**precision registers (standard error about 1.04 / sqrt(2**precision)).
+
+ConnectionSketches combines them for the connections:
+    sourcesByBytes, sourcesByCount   HeavyHitters of the SourceIPs by totalBytes / count
+    portsByCount, portsByBytes       HeavyHitters of the TargetPorts
+    targetsByCount                   HeavyHitters of the targets (TargetIP << 16 | TargetPort),
+                                     each tracked target with a HyperLogLog of its SourceIPs
+    sources, targets                 HyperLogLog of all SourceIPs / targets
+The parsers update the sketches per parsed connection with add() (same arguments as
+ConnectionStore.add()), in the pass which builds the exact aggregate, so their size is
+fixed but they do not replace the aggregate. Up to PENDING_LIMIT (source, target) pairs are
+summed up first, repeated connections then update the sketches once, weighted. Aggregated connections (cached files) are added
+with addRecords(), weighted by count and totalBytes. Every worker sketches its own lines and
+the sketches of all workers are merged with merge(); the counts of the SpaceSavings are
+overestimated by at most count (totalBytes) / capacity. Distinct sources of a target are counted
+from the time it is tracked on, and are lower bounds for targets tracked late.
+'''
+import json
+import heapq
+from array import array
+import hashlib
+import math
+import ConnectionStore as CS
+
+CAPACITY = 1000
+PRECISION = 14
+TARGET_PRECISION = 8
+COUNT_MIN_DEPTH = 4
+# CountMin counters per row for each tracked item of a SpaceSaving
+COUNT_MIN_WIDTH_FACTOR = 4
+# Parsed connections summed up per (source, target) before they are added to the sketches
+PENDING_LIMIT = 10000
+TOP = 20
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+def hash64(value):
+    ''' 64 bit hash of an int (splitmix64 finalizer) or of the text of other values. '''
+    if not isinstance(value, int):
+        return int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'little')
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+class HyperLogLog:
+
+    def __init__(self, precision=PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError('HyperLogLog precision has to be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        self.addHash(hash64(value))
+
+    def addHash(self, hashValue):
+        rest = 64 - self.precision
+        index = hashValue >> rest
+        rank = rest - (hashValue & ((1 << rest) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLogs of different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+class SpaceSaving:
+
+    def __init__(self, capacity=CAPACITY):
+        if capacity < 1:
+            raise ValueError('The capacity has to be at least 1')
+        self.capacity = capacity
+        # item -> [count, error]
+        self.counters = {}
+        # (count, item) candidates for the minimum, entries with an outdated count are skipped
+        self.heap = []
+
+    def _minimum(self):
+        heap = self.heap
+        while True:
+            count, item = heap[0]
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                return count, item
+            heapq.heappop(heap)
+
+    def add(self, item, weight=1):
+        ''' Count item weight times, returns the evicted item or None. '''
+        counters = self.counters
+        counter = counters.get(item)
+        evicted = None
+        if counter is not None:
+            counter[0] += weight
+        elif len(counters) < self.capacity:
+            counter = counters[item] = [weight, 0]
+        else:
+            minimum, evicted = self._minimum()
+            del counters[evicted]
+            counter = counters[item] = [minimum + weight, minimum]
+        heapq.heappush(self.heap, (counter[0], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(counter[0], key) for key, counter in counters.items()]
+            heapq.heapify(self.heap)
+        return evicted
+
+    def merge(self, other):
+        ''' Add the counts of other (mergeable summaries: untracked items count as the minimum of a full summary). '''
+        selfMinimum = min(counter[0] for counter in self.counters.values()) if len(self.counters) >= self.capacity else 0
+        otherMinimum = min(counter[0] for counter in other.counters.values()) if len(other.counters) >= other.capacity else 0
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, (selfMinimum, selfMinimum))
+            otherCount, otherError = other.counters.get(item, (otherMinimum, otherMinimum))
+            merged[item] = [count + otherCount, error + otherError]
+        kept = heapq.nlargest(self.capacity, merged.items(), key=lambda entry: entry[1][0])
+        self.counters = dict(kept)
+        self.heap = [(counter[0], item) for item, counter in kept]
+        heapq.heapify(self.heap)
+
+    def top(self, n=TOP):
+        ''' Up to n (item, count, error) with the largest counts. '''
+        return [(item, counter[0], counter[1]) for item, counter in
+                heapq.nlargest(n, self.counters.items(), key=lambda entry: entry[1][0])]
+
+class CountMin:
+
+    def __init__(self, width, depth=COUNT_MIN_DEPTH):
+        if width < 1 or depth < 1:
+            raise ValueError('CountMin width and depth have to be at least 1')
+        self.width = width
+        self.depth = depth
+        self.table = array('q', bytes(8 * width * depth))
+        self.rows = range(depth)
+
+    def _cells(self, hashValue):
+        # Row i uses the hash h1 + i * h2 (Kirsch-Mitzenmacher)
+        h1 = hashValue & 0xFFFFFFFF
+        h2 = (hashValue >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in self.rows]
+
+    def add(self, hashValue, weight=1):
+        table = self.table
+        for cell in self._cells(hashValue):
+            table[cell] += weight
+
+    def estimate(self, hashValue):
+        table = self.table
+        return min(table[cell] for cell in self._cells(hashValue))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Cannot merge CountMins of different size')
+        self.table = array('q', map(int.__add__, self.table, other.table))
+
+class HeavyHitters:
+    ''' SpaceSaving of the items with a CountMin of the same counts, which bounds the counts of late tracked items. '''
+
+    def __init__(self, capacity=CAPACITY, depth=COUNT_MIN_DEPTH):
+        self.spaceSaving = SpaceSaving(capacity)
+        self.countMin = CountMin(COUNT_MIN_WIDTH_FACTOR * capacity, depth)
+
+    def add(self, item, weight=1, hashValue=None):
+        ''' Count item weight times, returns the evicted item or None. '''
+        self.countMin.add(hash64(item) if hashValue is None else hashValue, weight)
+        return self.spaceSaving.add(item, weight)
+
+    def merge(self, other):
+        self.spaceSaving.merge(other.spaceSaving)
+        self.countMin.merge(other.countMin)
+
+    @property
+    def counters(self):
+        return self.spaceSaving.counters
+
+    def top(self, n=TOP):
+        ''' Up to n (item, count, error), count is the smaller overestimate, count - error a lower bound. '''
+        result = []
+        for item, (count, error) in self.spaceSaving.counters.items():
+            bound = min(count, self.countMin.estimate(hash64(item)))
+            result.append((item, bound, bound - (count - error)))
+        return heapq.nlargest(n, result, key=lambda entry: entry[1])
+
+class ConnectionSketches:
+
+    def __init__(self, capacity=CAPACITY, precision=PRECISION, targetPrecision=TARGET_PRECISION):
+        self.sourcesByBytes = HeavyHitters(capacity)
+        self.sourcesByCount = HeavyHitters(capacity)
+        self.portsByCount = HeavyHitters(capacity)
+        self.portsByBytes = HeavyHitters(capacity)
+        self.targetsByCount = HeavyHitters(capacity)
+        self.sources = HyperLogLog(precision)
+        self.targets = HyperLogLog(precision)
+        self.targetPrecision = targetPrecision
+        # Target (TargetIP << 16 | TargetPort) of targetsByCount -> HyperLogLog of the SourceIPs
+        self.targetSources = {}
+        # Exact totals, the bound of the errors of the SpaceSavings
+        self.count = 0
+        self.totalBytes = 0
+        # (SourceIP, target) -> [count, totalBytes] of parsed connections not yet added, see flush()
+        self.pending = {}
+        self.ipValues = {}
+
+    def add(self, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes):
+        ''' Add one parsed connection, arguments like ConnectionStore.add() (raises ValueError like it). '''
+        ipValues = self.ipValues
+        sourceValue = ipValues.get(sourceIP)
+        if sourceValue is None:
+            sourceValue = ipValues[sourceIP] = CS.ipToInt(sourceIP)
+        targetValue = ipValues.get(targetIP)
+        if targetValue is None:
+            targetValue = ipValues[targetIP] = CS.ipToInt(targetIP)
+        key = (sourceValue, targetValue << 16 | int(targetPort))
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [1, int(connBytes)]
+            if len(self.pending) >= PENDING_LIMIT:
+                self.flush()
+        else:
+            entry[0] += 1
+            entry[1] += int(connBytes)
+
+    def flush(self):
+        ''' Add the pending parsed connections to the sketches. '''
+        for (sourceIP, target), (count, totalBytes) in self.pending.items():
+            self.addConnection(sourceIP, target >> 16, target & 0xFFFF, count, totalBytes)
+        self.pending = {}
+        self.ipValues = {}
+
+    def addRecords(self, records):
+        ''' Add the connections of records (see ConnectionStore.records()). '''
+        for sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, count, first, last, totalBytes in records:
+            self.addConnection(sourceIP, targetIP, targetPort, count, totalBytes)
+
+    def addConnection(self, sourceIP, targetIP, targetPort, count, totalBytes):
+        ''' Add count connections of int sourceIP to int targetIP / targetPort with totalBytes. '''
+        target = targetIP << 16 | targetPort
+        sourceHash = hash64(sourceIP)
+        portHash = hash64(targetPort)
+        targetHash = hash64(target)
+        self.sourcesByBytes.add(sourceIP, totalBytes, sourceHash)
+        self.sourcesByCount.add(sourceIP, count, sourceHash)
+        self.portsByCount.add(targetPort, count, portHash)
+        self.portsByBytes.add(targetPort, totalBytes, portHash)
+        evicted = self.targetsByCount.add(target, count, targetHash)
+        if evicted is not None:
+            self.targetSources.pop(evicted, None)
+        targetSources = self.targetSources.get(target)
+        if targetSources is None:
+            targetSources = self.targetSources[target] = HyperLogLog(self.targetPrecision)
+        targetSources.addHash(sourceHash)
+        self.sources.addHash(sourceHash)
+        self.targets.addHash(targetHash)
+        self.count += count
+        self.totalBytes += totalBytes
+
+    def merge(self, other):
+        ''' Add the sketches of other (same capacity and precisions). '''
+        self.flush()
+        other.flush()
+        for name in ('sourcesByBytes', 'sourcesByCount', 'portsByCount', 'portsByBytes', 'targetsByCount',
+                     'sources', 'targets'):
+            getattr(self, name).merge(getattr(other, name))
+        targetSources = {}
+        for target in self.targetsByCount.counters:
+            sketch = self.targetSources.get(target)
+            otherSketch = other.targetSources.get(target)
+            if sketch is None:
+                sketch = HyperLogLog(self.targetPrecision)
+            if otherSketch is not None:
+                sketch.merge(otherSketch)
+            targetSources[target] = sketch
+        self.targetSources = targetSources
+        self.count += other.count
+        self.totalBytes += other.totalBytes
+
+    def report(self, top=TOP):
+        ''' Compact summary of the sketches as dict, IPs rendered as text. '''
+        self.flush()
+        def render(ip):
+            return CS.intToIp(ip) if isinstance(ip, int) else ip
+
+        return {
+            'count': self.count,
+            'totalBytes': self.totalBytes,
+            'distinctSources': self.sources.estimate(),
+            'distinctTargets': self.targets.estimate(),
+            'topSourcesByBytes': [{'SourceIP': render(ip), 'totalBytes': count, 'error': error}
+                                  for ip, count, error in self.sourcesByBytes.top(top)],
+            'topSourcesByCount': [{'SourceIP': render(ip), 'count': count, 'error': error}
+                                  for ip, count, error in self.sourcesByCount.top(top)],
+            'topTargetPortsByCount': [{'TargetPort': port, 'count': count, 'error': error}
+                                      for port, count, error in self.portsByCount.top(top)],
+            'topTargetPortsByBytes': [{'TargetPort': port, 'totalBytes': count, 'error': error}
+                                      for port, count, error in self.portsByBytes.top(top)],
+            'topTargetsByCount': [{'TargetIP': render(target >> 16), 'TargetPort': target & 0xFFFF, 'count': count, 'error': error,
+                                   'distinctSources': self.targetSources[target].estimate()}
+                                  for target, count, error in self.targetsByCount.top(top)],
+        }
+
+    def write(self, fileName, top=TOP):
+        with open(fileName, 'wt') as outFile:
+            json.dump(self.report(top), outFile, indent=1)
+            outFile.write('\n')
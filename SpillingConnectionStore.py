@@ -0,0 +1,140 @@
+'''
+SpillingConnectionStore.py
+ConnectionStore with bounded memory.
+
+When the estimated memory of the stored connections, the IP cache and the name table
+exceeds the memory limit, the store is written as a run file sorted by connection key
+(gzip compressed fixed size records) and cleared along with the IP cache. The name table
+is kept, so keys stay comparable between runs.
+rows() / records() then stream a k-way merge over all run files and the remaining
+in-memory rows, adding counts and bytes and taking min/max of firstSeen/lastSeen for keys
+which appear in several runs.
+'''
+import os
+import gzip
+import heapq
+import struct
+import datetime
+import tempfile
+import ConnectionStore as CS
+
+# Estimated memory per stored connection (dict entry, packed key, row number, value arrays)
+BYTES_PER_ROW = 160
+# Per entry of ConnectionStore.ipCache (IP string, int value, dict entry), up to CS.IP_CACHE_SIZE entries
+BYTES_PER_CACHED_IP = 130
+# Per interned zone / connection type name (string, list and dict entry)
+BYTES_PER_NAME = 140
+# key high/low 64 bits, count, firstSeen, lastSeen, totalBytes
+RUN_RECORD = struct.Struct('<QQqiiq')
+RUN_BLOCK_RECORDS = 65536
+
+def combineRecords(records):
+    ''' Combine (key, count, firstSeen, lastSeen, totalBytes) records sorted by key into one record per key. '''
+    current = None
+    for key, count, first, last, totalBytes in records:
+        if current is not None and current[0] == key:
+            current[1] += count
+            current[2] = min(current[2], first)
+            current[3] = max(current[3], last)
+            current[4] += totalBytes
+        else:
+            if current is not None:
+                yield current
+            current = [key, count, first, last, totalBytes]
+    if current is not None:
+        yield current
+
+class SpillingConnectionStore(CS.ConnectionStore):
+
+    def __init__(self, memoryLimit, spillDirectory=None):
+        super().__init__()
+        self.memoryLimit = memoryLimit
+        self.spillDirectory = spillDirectory
+        self.runFiles = []
+
+    def estimatedBytes(self):
+        ''' Estimated memory of the rows, the IP cache and the name table. '''
+        return (len(self.rowIndex) * BYTES_PER_ROW + len(self.ipCache) * BYTES_PER_CACHED_IP
+                + len(self.names) * BYTES_PER_NAME)
+
+    def add(self, sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes):
+        super().add(sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, dateOrdinal, connBytes)
+        if self.estimatedBytes() > self.memoryLimit:
+            self.spill()
+
+    def merge(self, other):
+        super().merge(other)
+        if self.estimatedBytes() > self.memoryLimit:
+            self.spill()
+
+    def _sortedRecords(self):
+        for key in sorted(self.rowIndex):
+            row = self.rowIndex[key]
+            yield (key >> 64, key & 0xFFFFFFFFFFFFFFFF, self.counts[row],
+                   self.firstSeen[row], self.lastSeen[row], self.totalBytes[row])
+
+    def spill(self):
+        ''' Write the in-memory connections as sorted run file and clear them and the IP cache. '''
+        self.ipCache = {}
+        if not self.rowIndex:
+            # Only the IP cache was over the limit
+            return
+        fd, runFile = tempfile.mkstemp(prefix='connections-', suffix='.run.gz', dir=self.spillDirectory)
+        with gzip.open(os.fdopen(fd, 'wb'), 'wb', compresslevel=1) as outFile:
+            block = []
+            for record in self._sortedRecords():
+                block.append(RUN_RECORD.pack(*record))
+                if len(block) == RUN_BLOCK_RECORDS:
+                    outFile.write(b''.join(block))
+                    block = []
+            outFile.write(b''.join(block))
+        self.runFiles.append(runFile)
+
+        self.clear()
+
+    def _readRun(self, runFile):
+        with gzip.open(runFile, 'rb') as inFile:
+            while True:
+                data = inFile.read(RUN_RECORD.size * RUN_BLOCK_RECORDS)
+                if not data:
+                    break
+                yield from RUN_RECORD.iter_unpack(data)
+
+    def _mergedRecords(self):
+        # (key, count, firstSeen, lastSeen, totalBytes) merged over all runs, ordered by key
+        runs = [self._readRun(runFile) for runFile in self.runFiles]
+        runs.append(self._sortedRecords())
+        return combineRecords((high << 64 | low, count, first, last, totalBytes)
+                              for high, low, count, first, last, totalBytes in heapq.merge(*runs))
+
+    def rows(self):
+        ''' Same as ConnectionStore.rows(), merged over all runs, ordered by connection key. '''
+        if not self.runFiles:
+            yield from super().rows()
+            return
+
+        isoDates = {}
+        for key, count, first, last, totalBytes in self._mergedRecords():
+            if first not in isoDates:
+                isoDates[first] = datetime.date.fromordinal(first).isoformat()
+            if last not in isoDates:
+                isoDates[last] = datetime.date.fromordinal(last).isoformat()
+            yield self.unpackKey(key) + (count, isoDates[first], isoDates[last], totalBytes)
+
+    def records(self):
+        ''' Same as ConnectionStore.records(), merged over all runs, ordered by connection key. '''
+        if not self.runFiles:
+            yield from super().records()
+            return
+
+        for key, count, first, last, totalBytes in self._mergedRecords():
+            yield self.recordValues(key) + (count, first, last, totalBytes)
+
+    def close(self):
+        ''' Remove the run files. '''
+        for runFile in self.runFiles:
+            try:
+                os.remove(runFile)
+            except OSError:
+                pass
+        self.runFiles = []
@@ -0,0 +1,165 @@
+'''
+SqliteStore.py
+Accumulated connections in a SQLite database.
+
+The database holds the same aggregate as AllConnections.csv (table connections, IPs
+and ports as integers, dates as ISO strings) plus the manifest of processed files
+(table files), so it serves as output and as state for incremental runs at once.
+Connections of a file are collected in memory (ConnectionStore) and upserted with
+executemany in one transaction together with the manifest entry of the file: after an
+abort, rerunning continues with the files which are not yet committed.
+'''
+import os
+import sqlite3
+import urllib.parse
+import datetime
+import ConnectionStore as CS
+import StateStore as SS
+
+SCHEMA_VERSION = 1
+UPSERT_BATCH = 10000
+CONNECTION_FIELDS = ('SourceIP', 'SourceZone', 'TargetIP', 'TargetZone', 'TargetPort', 'ConnectionType',
+                     'count', 'firstSeen', 'lastSeen', 'totalBytes')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS connections (
+    SourceIP INTEGER NOT NULL,
+    SourceZone TEXT NOT NULL,
+    TargetIP INTEGER NOT NULL,
+    TargetZone TEXT NOT NULL,
+    TargetPort INTEGER NOT NULL,
+    ConnectionType TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    firstSeen TEXT NOT NULL,
+    lastSeen TEXT NOT NULL,
+    totalBytes INTEGER NOT NULL,
+    PRIMARY KEY (SourceIP, SourceZone, TargetIP, TargetZone, TargetPort, ConnectionType)
+) WITHOUT ROWID;
+-- Lookups by SourceIP use the primary key
+CREATE INDEX IF NOT EXISTS connections_TargetIP ON connections (TargetIP);
+CREATE INDEX IF NOT EXISTS connections_TargetPort ON connections (TargetPort);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+'''
+
+UPSERT = '''
+INSERT INTO connections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (SourceIP, SourceZone, TargetIP, TargetZone, TargetPort, ConnectionType) DO UPDATE SET
+    count = count + excluded.count,
+    firstSeen = min(firstSeen, excluded.firstSeen),
+    lastSeen = max(lastSeen, excluded.lastSeen),
+    totalBytes = totalBytes + excluded.totalBytes
+'''
+
+def connect(dbFile):
+    ''' Open (and create) the database in WAL mode. '''
+    db = sqlite3.connect(dbFile)
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        db.close()
+        raise ValueError('Unsupported database version: {}'.format(dbFile))
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.executescript(SCHEMA)
+    db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+    return db
+
+def connectReadOnly(dbFile):
+    ''' Open an existing database read-only (nothing is created or written). '''
+    db = sqlite3.connect('file:{}?mode=ro'.format(urllib.parse.quote(dbFile)), uri=True)
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION:
+        db.close()
+        raise ValueError('Not a connections database of version {}: {}'.format(SCHEMA_VERSION, dbFile))
+    return db
+
+def renderRow(row):
+    ''' Database row (integer IPs) to the fields of AllConnections.csv. '''
+    sourceIP, sourceZone, targetIP, targetZone, targetPort, connType, count, first, last, totalBytes = row
+    return (CS.intToIp(sourceIP), sourceZone, CS.intToIp(targetIP), targetZone, str(targetPort), connType,
+            count, first, last, totalBytes)
+
+class SqliteStore(SS.StateStore):
+    ''' StateStore with the connections and the manifest kept in a SQLite database. '''
+
+    def __init__(self, dbFile):
+        # Unlike StateStore, the database is not reset here: reset() deletes all stored data
+        self.stateFile = dbFile
+        self.db = connect(dbFile)
+        # Pending connections of the current file
+        self.connections = CS.ConnectionStore()
+        self.manifest = {}
+
+    def reset(self):
+        self.connections = CS.ConnectionStore()
+        self.manifest = {}
+        with self.db:
+            self.db.execute('DELETE FROM connections')
+            self.db.execute('DELETE FROM files')
+
+    def load(self):
+        ''' Load the manifest, returns False if no file has been processed yet. '''
+        self.manifest = {path: (size, mtime, contentHash)
+                         for path, size, mtime, contentHash in self.db.execute('SELECT * FROM files')}
+        return bool(self.manifest)
+
+    def flush(self):
+        ''' Upsert the pending connections, the transaction is committed by addFile(). '''
+        isoDates = {}
+        batch = []
+        store = self.connections
+        for key, row in store.rowIndex.items():
+            first = store.firstSeen[row]
+            last = store.lastSeen[row]
+            if first not in isoDates:
+                isoDates[first] = datetime.date.fromordinal(first).isoformat()
+            if last not in isoDates:
+                isoDates[last] = datetime.date.fromordinal(last).isoformat()
+            batch.append(store.unpackKeyValues(key)
+                         + (store.counts[row], isoDates[first], isoDates[last], store.totalBytes[row]))
+            if len(batch) == UPSERT_BATCH:
+                self.db.executemany(UPSERT, batch)
+                batch = []
+        self.db.executemany(UPSERT, batch)
+        store.clear()
+
+    def addFile(self, fileName, stat):
+        ''' Store the pending connections and record fileName as processed (see StateStore.addFile()) in one transaction. '''
+        super().addFile(fileName, stat)
+        size, mtime, contentHash = self.manifest[os.path.abspath(fileName)]
+        with self.db:
+            self.flush()
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                            (os.path.abspath(fileName), size, mtime, contentHash))
+
+    def save(self):
+        # Manifest entries updated by compare() (touched files), connections are committed per file
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                [(path,) + entry for path, entry in self.manifest.items()])
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM connections').fetchone()[0]
+
+    def rows(self):
+        ''' Same as ConnectionStore.rows(), for all connections in the database. '''
+        for row in self.db.execute('SELECT * FROM connections'):
+            yield renderRow(row)
+
+    def records(self):
+        ''' Same as ConnectionStore.records(), for all connections in the database. '''
+        ordinals = {}
+        for row in self.db.execute('SELECT * FROM connections'):
+            first, last = row[7], row[8]
+            if first not in ordinals:
+                ordinals[first] = datetime.date.fromisoformat(first).toordinal()
+            if last not in ordinals:
+                ordinals[last] = datetime.date.fromisoformat(last).toordinal()
+            yield row[:7] + (ordinals[first], ordinals[last], row[9])
+
+    def close(self):
+        self.db.close()
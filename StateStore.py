@@ -0,0 +1,113 @@
+'''
+StateStore.py
+Persistent state for incremental runs.
+
+The state file holds the accumulated connections (ConnectionStore) together with a
+manifest of the processed input files: absolute path -> (size, mtime, sha256 of the content).
+A rerun only needs to parse files which are not in the manifest, and the tail of files
+which were appended to since (the processed content is unchanged in front of it, complete
+lines or gzip members were added). Files whose content changed otherwise cannot be taken
+out of the aggregate again, in that case the state has to be rebuilt from all files.
+'''
+import os
+import pickle
+import hashlib
+import ConnectionStore as CS
+
+STATE_VERSION = 1
+HASH_BLOCKSIZE = 1024 * 1024
+
+def fileHash(fileName, size=None):
+    ''' sha256 of the content of fileName, of the first size bytes only if size is given. '''
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as inFile:
+        rest = size
+        block = inFile.read(HASH_BLOCKSIZE if rest is None else min(rest, HASH_BLOCKSIZE))
+        while block:
+            digest.update(block)
+            if rest is not None:
+                rest -= len(block)
+                if rest == 0:
+                    break
+            block = inFile.read(HASH_BLOCKSIZE if rest is None else min(rest, HASH_BLOCKSIZE))
+    return digest.hexdigest()
+
+def isAppended(fileName, size, contentHash):
+    ''' True if fileName still starts with the processed content (size, contentHash) and only grew behind it. '''
+    with open(fileName, 'rb') as inFile:
+        if size > 0:
+            inFile.seek(size - 1)
+            boundary = inFile.read(3)
+        else:
+            boundary = b'\n' + inFile.read(2)
+    if fileName.endswith('.gz'):
+        # The tail has to be a gzip member of its own
+        if boundary[1:3] != b'\x1f\x8b':
+            return False
+    elif boundary[:1] != b'\n':
+        # The last line was still being written when it was processed
+        return False
+    return fileHash(fileName, size) == contentHash
+
+class StateStore:
+
+    def __init__(self, stateFile):
+        self.stateFile = stateFile
+        self.reset()
+
+    def reset(self):
+        self.connections = CS.ConnectionStore()
+        self.manifest = {}
+
+    def load(self):
+        ''' Load the state file, returns False if there is none yet. '''
+        if not os.path.exists(self.stateFile):
+            return False
+        with open(self.stateFile, 'rb') as inFile:
+            state = pickle.load(inFile)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError('Unsupported state file version: {}'.format(self.stateFile))
+        self.connections = state['connections']
+        self.manifest = state['manifest']
+        return True
+
+    def save(self):
+        # Write to a temporary file first, so an aborted run does not destroy the previous state
+        tmpFile = self.stateFile + '.tmp'
+        with open(tmpFile, 'wb') as outFile:
+            pickle.dump({'version': STATE_VERSION, 'connections': self.connections, 'manifest': self.manifest},
+                        outFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpFile, self.stateFile)
+
+    def compare(self, fileList):
+        '''
+        Returns (newFiles, appendedFiles, changedFiles) of fileList compared to the manifest,
+        appendedFiles is a dict fileName -> size of the processed content.
+        '''
+        newFiles = []
+        appendedFiles = {}
+        changedFiles = []
+        for fileName in fileList:
+            entry = self.manifest.get(os.path.abspath(fileName))
+            if entry is None:
+                newFiles.append(fileName)
+                continue
+            stat = os.stat(fileName)
+            size, mtime, contentHash = entry
+            if stat.st_size == size and stat.st_mtime == mtime:
+                continue
+            # Only touched (e.g. copied) files keep their content hash
+            if stat.st_size == size and fileHash(fileName) == contentHash:
+                self.manifest[os.path.abspath(fileName)] = (size, stat.st_mtime, contentHash)
+            elif stat.st_size > size and isAppended(fileName, size, contentHash):
+                appendedFiles[fileName] = size
+            else:
+                changedFiles.append(fileName)
+        return newFiles, appendedFiles, changedFiles
+
+    def addFile(self, fileName, stat):
+        '''
+        Record fileName as processed. stat is taken before it was read and only its first stat.st_size
+        bytes were parsed (see LogFileSplitter.openBinary()), content appended meanwhile is left to the next run.
+        '''
+        self.manifest[os.path.abspath(fileName)] = (stat.st_size, stat.st_mtime, fileHash(fileName, stat.st_size))
@@ -0,0 +1,140 @@
+'''
+SubnetTree.py
+Aggregation of IPs by subnets (--subnets / --prefix-length).
+
+The configured subnets (a file with one CIDR per line, # starts a comment) are kept in a
+binary radix tree over the 32 bits of the address, match() returns the longest prefix
+containing an IP. IPs outside of all configured subnets fall into networks of the fixed
+--prefix-length, if given, and are kept as they are otherwise.
+
+map() replaces an IP by a representative of its subnet, so the packed keys of
+ConnectionStore stay unchanged: the lowest address which belongs to the subnet itself
+(and not to a more specific subnet inside of it). Unlike the network address this is
+unique, also for nested subnets with the same network address (10.0.0.0/8 and
+10.0.0.0/16). render() turns a representative back into "<network>/<length>".
+Results are cached per IP, ConnectionStore caches the mapped value per IP string as well.
+'''
+import ipaddress
+import ConnectionStore as CS
+
+# Tree nodes are lists [child for bit 0, child for bit 1, subnet], subnets [network, length, representative]
+SUBNET = 2
+
+def parseCidr(text):
+    ''' (network, prefix length) of "a.b.c.d/n" or "a.b.c.d", raises ValueError for host bits set. '''
+    network = ipaddress.IPv4Network(text.strip())
+    return int(network.network_address), network.prefixlen
+
+def subnetRange(network, length):
+    ''' First and last address of a subnet. '''
+    return network, network | ((1 << (32 - length)) - 1)
+
+def loadSubnets(fileName):
+    ''' CIDRs of a subnet file, raises ValueError with the line number for invalid entries. '''
+    cidrs = []
+    with open(fileName, 'rt') as inFile:
+        for lineNumber, line in enumerate(inFile, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                parseCidr(line)
+            except ValueError as error:
+                raise ValueError('{} line {}: {}'.format(fileName, lineNumber, error))
+            cidrs.append(line)
+    return cidrs
+
+def settings(tree):
+    ''' Configuration of a SubnetTree (or None), two trees with the same settings map all IPs alike. '''
+    if tree is None:
+        return None
+    return sorted(set(map(parseCidr, tree.cidrs))), tree.prefixLength
+
+class SubnetTree:
+
+    def __init__(self, cidrs=(), prefixLength=None):
+        if prefixLength is not None and not 0 <= prefixLength <= 32:
+            raise ValueError('Prefix length has to be between 0 and 32')
+        self.cidrs = list(cidrs)
+        self.prefixLength = prefixLength
+        self.root = [None, None, None]
+        for cidr in self.cidrs:
+            self.insert(*parseCidr(cidr))
+        self.mapCache = {}
+        self.renderCache = {}
+
+    def __getstate__(self):
+        # Caches are rebuilt on demand
+        state = self.__dict__.copy()
+        state['mapCache'] = {}
+        state['renderCache'] = {}
+        return state
+
+    def insert(self, network, length):
+        node = self.root
+        for bit in range(31, 31 - length, -1):
+            branch = (network >> bit) & 1
+            if node[branch] is None:
+                node[branch] = [None, None, None]
+            node = node[branch]
+        if node[SUBNET] is None:
+            node[SUBNET] = [network, length, None]
+
+    def match(self, ip):
+        ''' Longest configured subnet [network, length, representative] containing ip, or None. '''
+        node = self.root
+        subnet = node[SUBNET]
+        for bit in range(31, -1, -1):
+            node = node[(ip >> bit) & 1]
+            if node is None:
+                break
+            if node[SUBNET] is not None:
+                subnet = node[SUBNET]
+        return subnet
+
+    def _firstAddress(self, start, end, subnet):
+        # Lowest address in start..end whose longest match is subnet, more specific subnets are skipped
+        address = start
+        while address <= end:
+            found = self.match(address)
+            if found is subnet:
+                return address
+            address = subnetRange(found[0], found[1])[1] + 1
+        return None
+
+    def map(self, ip):
+        ''' Representative of the subnet of ip (see module description). '''
+        value = self.mapCache.get(ip)
+        if value is not None:
+            return value
+        subnet = self.match(ip)
+        if subnet is not None:
+            if subnet[2] is None:
+                subnet[2] = self._firstAddress(subnet[0], subnetRange(subnet[0], subnet[1])[1], subnet)
+            value = subnet[2]
+        elif self.prefixLength is not None:
+            start, end = subnetRange(ip & ~((1 << (32 - self.prefixLength)) - 1) & 0xFFFFFFFF, self.prefixLength)
+            value = self._firstAddress(start, end, None)
+        else:
+            value = ip
+        if len(self.mapCache) >= CS.IP_CACHE_SIZE:
+            self.mapCache.clear()
+        self.mapCache[ip] = value
+        return value
+
+    def render(self, value):
+        ''' "<network>/<length>" of the subnet of a representative, the IP itself for unmapped IPs. '''
+        text = self.renderCache.get(value)
+        if text is None:
+            subnet = self.match(value)
+            if subnet is not None:
+                text = '{}/{}'.format(CS.intToIp(subnet[0]), subnet[1])
+            elif self.prefixLength is not None:
+                network = value & ~((1 << (32 - self.prefixLength)) - 1) & 0xFFFFFFFF
+                text = '{}/{}'.format(CS.intToIp(network), self.prefixLength)
+            else:
+                text = CS.intToIp(value)
+            if len(self.renderCache) >= CS.IP_CACHE_SIZE:
+                self.renderCache.clear()
+            self.renderCache[value] = text
+        return text
@@ -0,0 +1,139 @@
+'''
+benchmark.py
+Benchmark of the parser entry points on generated logs
+
+Generates a corpus with generateAsaLogs.py (see there for the options), runs
+parseSyslog.py, parseSyslogNew.py and threadedParseSyslog.py on it and reports per run
+the wall time, lines/s and MB/s (uncompressed input) and the peak RSS of the largest
+process. The sorted AllConnections.csv of all implementations are compared as well,
+threadedParseSyslog.py does not write totalBytes, so only the common columns are compared.
+
+Example:
+    python benchmark.py --lines 1000000 --files 2 --gzip --repeat 3
+    python benchmark.py --input /data/logs --implementations parseSyslogNew threaded
+'''
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import generateAsaLogs as GEN
+import LogFileSplitter as LFS
+
+IMPLEMENTATIONS = {
+    'parseSyslog': lambda inputDirectory, outputDirectory, workers: ['parseSyslog.py', inputDirectory, outputDirectory],
+    'parseSyslogNew': lambda inputDirectory, outputDirectory, workers: ['parseSyslogNew.py', inputDirectory, outputDirectory],
+    'threaded': lambda inputDirectory, outputDirectory, workers: ['threadedParseSyslog.py', '-i', inputDirectory, '-o', outputDirectory]
+                + (['-w', str(workers)] if workers else []),
+}
+# Columns of AllConnections.csv written by all implementations
+COMMON_COLUMNS = 9
+
+def run(command, outputDirectory):
+    ''' Run command, returns (seconds, peak RSS in bytes). '''
+    scriptDirectory = os.path.dirname(os.path.abspath(__file__))
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.chdir(scriptDirectory)
+            with open(os.path.join(outputDirectory, 'benchmark-stdout.log'), 'wb') as outFile:
+                os.dup2(outFile.fileno(), 1)
+            os.execv(sys.executable, [sys.executable] + command)
+        finally:
+            os._exit(127)
+    # wait4() reports the resources of this child (including its waited for worker processes) only
+    _, status, usage = os.wait4(pid, 0)
+    seconds = time.time() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError('{} failed with exit code {}'.format(' '.join(command), os.waitstatus_to_exitcode(status)))
+    # ru_maxrss is in kB on Linux
+    return seconds, usage.ru_maxrss * 1024
+
+def outputDigest(connectionFile):
+    ''' sha256 of the sorted rows of connectionFile, reduced to the common columns. '''
+    with open(connectionFile, 'rt') as inFile:
+        next(inFile)
+        rows = sorted(';'.join(line.rstrip('\n').split(';')[:COMMON_COLUMNS]) for line in inFile)
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(row.encode('utf-8') + b'\n')
+    return digest.hexdigest(), len(rows)
+
+def inputSize(fileList):
+    ''' (lines, uncompressed bytes) of the input files. '''
+    lines = 0
+    size = 0
+    for fileName in fileList:
+        opener = gzip.open if fileName.endswith('.gz') else open
+        with opener(fileName, 'rb') as inFile:
+            for block in iter(lambda: inFile.read(1024 * 1024), b''):
+                lines += block.count(b'\n')
+                size += len(block)
+    return lines, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parser entry points on generated (or given) logs.")
+    GEN.addGeneratorArguments(parser)
+    parser.add_argument("-i", "--input", help="use the log files in this directory instead of generated ones.")
+    parser.add_argument("--work-directory", help="directory for the generated logs and the outputs. Defaults to a temporary directory, which is removed afterwards.")
+    parser.add_argument("--implementations", help="implementations to run. Defaults to all", nargs="+", choices=sorted(IMPLEMENTATIONS), default=sorted(IMPLEMENTATIONS))
+    parser.add_argument("-r", "--repeat", help="runs per implementation, the fastest run is reported. Defaults to 1", type=int, default=1)
+    parser.add_argument("-w", "--workers", help="workers for threadedParseSyslog.py. Defaults to its default", type=int)
+    parser.add_argument("--json", help="write the results to this JSON file as well.")
+    args = parser.parse_args()
+
+    workDirectory = args.work_directory or tempfile.mkdtemp(prefix='benchmark-')
+    equal = False
+    try:
+        if args.input:
+            inputDirectory = args.input
+        else:
+            inputDirectory = os.path.join(workDirectory, 'input')
+            if os.path.isdir(inputDirectory):
+                shutil.rmtree(inputDirectory)
+            print('Generating {} x {} lines in {}'.format(args.files, args.lines, inputDirectory))
+            GEN.generateFromArguments(inputDirectory, args)
+        inputDirectory = os.path.abspath(inputDirectory)
+        fileList = [f for f in sorted(glob.glob(os.path.join(inputDirectory, '*'))) if not f.endswith(LFS.GZIP_INDEX_SUFFIX)]
+        lines, size = inputSize(fileList)
+
+        results = []
+        for name in args.implementations:
+            outputDirectory = os.path.abspath(os.path.join(workDirectory, 'output-' + name))
+            runs = []
+            for _ in range(args.repeat):
+                if os.path.isdir(outputDirectory):
+                    shutil.rmtree(outputDirectory)
+                os.makedirs(outputDirectory)
+                runs.append(run(IMPLEMENTATIONS[name](inputDirectory, outputDirectory, args.workers), outputDirectory))
+            seconds = min(seconds for seconds, _ in runs)
+            digest, rowCount = outputDigest(os.path.join(outputDirectory, 'AllConnections.csv'))
+            results.append({'implementation': name, 'seconds': round(seconds, 3),
+                            'linesPerSecond': round(lines / seconds), 'mbPerSecond': round(size / seconds / 1024 / 1024, 2),
+                            'peakRssMB': round(max(rss for _, rss in runs) / 1024 / 1024, 1),
+                            'connections': rowCount, 'outputDigest': digest})
+
+        equal = len(set(result['outputDigest'] for result in results)) <= 1
+        print('Input: {} lines, {:.1f} MB uncompressed'.format(lines, size / 1024 / 1024))
+        print('{:<16}{:>10}{:>12}{:>9}{:>10}{:>13}'.format('implementation', 'seconds', 'lines/s', 'MB/s', 'RSS MB', 'connections'))
+        for result in results:
+            print('{implementation:<16}{seconds:>10.2f}{linesPerSecond:>12}{mbPerSecond:>9.2f}{peakRssMB:>10.1f}{connections:>13}'.format(**result))
+        print('Outputs equal: {}'.format('yes' if equal else 'NO'))
+
+        if args.json:
+            with open(args.json, 'wt') as outFile:
+                json.dump({'input': {'directory': inputDirectory, 'lines': lines, 'bytes': size},
+                           'results': results, 'outputsEqual': equal}, outFile, indent=2)
+    finally:
+        if not args.work_directory:
+            shutil.rmtree(workDirectory)
+    if not equal:
+        sys.exit(1)
+
+if __name__ == "__main__": main()
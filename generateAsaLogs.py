@@ -0,0 +1,154 @@
+'''
+generateAsaLogs.py
+Deterministic generator of synthetic CISCO ASA syslog files
+
+Writes --files log files named <hostname>_<date>.log[.gz] (one per day, the date is
+taken from the file name like for real logs). The same arguments always produce the
+same files. Teardown lines are drawn from a fixed set of --flows connections with a
+skewed distribution, so a few connections are very frequent and many are rare.
+Shares of the lines can be set for the cases the parsers filter:
+    --teardown-share     Teardown TCP/UDP lines, the rest are other ASA messages
+    --udp-timeout-share  Teardown lines of UDP 53/137/138/161 with a duration > 2:00
+    --zero-byte-share    Teardown lines with 0 bytes
+
+Example:
+    python generateAsaLogs.py /tmp/asa --lines 1000000 --files 3 --gzip
+'''
+import os
+import gzip
+import random
+import argparse
+import datetime
+
+ZONES = ('inside', 'outside', 'dmz', 'mgmt', 'guest', 'voice')
+TCP_PORTS = ('443', '80', '22', '25', '445', '3389', '8080', '1433', '389', '636')
+UDP_PORTS = ('53', '123', '514', '161', '137', '138', '500', '4500')
+UDP_TIMEOUT_PORTS = ('53', '137', '138', '161')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+TEARDOWN_REASONS = ('TCP FINs', 'TCP Reset-I', 'TCP Reset-O', 'SYN Timeout', 'Conn-timeout', 'Flow closed by inspection')
+# Skew of the flow distribution, higher values concentrate the lines on fewer flows
+FLOW_SKEW = 3
+
+def randomIP(rng, prefix):
+    return '{}.{}.{}.{}'.format(prefix, rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+def makeFlows(rng, count):
+    ''' count distinct connections (SourceZone, SourceIP, TargetZone, TargetIP, TargetPort, ConnectionType). '''
+    flows = set()
+    while len(flows) < count:
+        sourceZone, targetZone = rng.sample(ZONES, 2)
+        connType = 'UDP' if rng.random() < 0.3 else 'TCP'
+        targetPort = rng.choice(UDP_PORTS if connType == 'UDP' else TCP_PORTS)
+        if rng.random() < 0.05:
+            targetPort = str(rng.randint(1024, 65535))
+        flows.add((sourceZone, randomIP(rng, 10), targetZone, randomIP(rng, rng.choice((10, 172, 192))),
+                   targetPort, connType))
+    return sorted(flows)
+
+def syslogHeader(rng, fileDate, hostname):
+    clock = '{:02d}:{:02d}:{:02d}'.format(rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+    day = '{} {:2d}'.format(MONTHS[fileDate.month - 1], fileDate.day)
+    return '{} {} {} : {} {} CET: '.format(day, clock, hostname, day.replace('  ', ' '), clock)
+
+def teardownLine(rng, header, connectionId, flow, duration, connBytes):
+    sourceZone, sourceIP, targetZone, targetIP, targetPort, connType = flow
+    anyPort = '(any)' if rng.random() < 0.02 else ''
+    if connType == 'TCP':
+        return '{}%ASA-6-302014: Teardown TCP connection {} for {}:{}/{}{} to {}:{}/{} duration {} bytes {} {}\n'.format(
+            header, connectionId, sourceZone, sourceIP, rng.randint(1024, 65535), anyPort, targetZone, targetIP,
+            targetPort, duration, connBytes, rng.choice(TEARDOWN_REASONS))
+    return '{}%ASA-6-302016: Teardown UDP connection {} for {}:{}/{}{} to {}:{}/{} duration {} bytes {}\n'.format(
+        header, connectionId, sourceZone, sourceIP, rng.randint(1024, 65535), anyPort, targetZone, targetIP,
+        targetPort, duration, connBytes)
+
+def otherLine(rng, header, connectionId, flow):
+    sourceZone, sourceIP, targetZone, targetIP, targetPort, connType = flow
+    choice = rng.random()
+    if choice < 0.6:
+        return '{}%ASA-6-30201{}: Built outbound {} connection {} for {}:{}/{} ({}/{}) to {}:{}/{} ({}/{})\n'.format(
+            header, '3' if connType == 'TCP' else '5', connType, connectionId, targetZone, targetIP, targetPort,
+            targetIP, targetPort, sourceZone, sourceIP, rng.randint(1024, 65535), sourceIP, rng.randint(1024, 65535))
+    if choice < 0.8:
+        return '{}%ASA-4-106023: Deny {} src {}:{}/{} dst {}:{}/{} by access-group "{}_access_in" [0x0, 0x0]\n'.format(
+            header, connType.lower(), sourceZone, sourceIP, rng.randint(1024, 65535), targetZone, targetIP,
+            targetPort, sourceZone)
+    if choice < 0.9:
+        return '{}%ASA-6-302020: Built inbound ICMP connection for faddr {}/0 gaddr {}/0 laddr {}/0\n'.format(
+            header, sourceIP, targetIP, targetIP)
+    return '{}%ASA-6-302021: Teardown ICMP connection for faddr {}/0 gaddr {}/0 laddr {}/0\n'.format(
+        header, sourceIP, targetIP, targetIP)
+
+def generateFile(fileName, lines, flows, fileDate, hostname, seed,
+                 teardownShare=0.4, udpTimeoutShare=0.05, zeroByteShare=0.05):
+    ''' Write lines log lines to fileName (.gz is compressed), returns the number of bytes (uncompressed). '''
+    rng = random.Random(seed)
+    size = 0
+    opener = gzip.open if fileName.endswith('.gz') else open
+    with opener(fileName, 'wt', encoding='latin-1') as outFile:
+        block = []
+        for connectionId in range(1, lines + 1):
+            header = syslogHeader(rng, fileDate, hostname)
+            flow = flows[int(len(flows) * rng.random() ** FLOW_SKEW)]
+            if rng.random() < teardownShare:
+                duration = '0:{:02d}:{:02d}'.format(rng.randint(0, 1), rng.randint(0, 59))
+                connBytes = rng.choice((rng.randint(1, 1500), rng.randint(1500, 100000), rng.randint(100000, 10 ** 9)))
+                choice = rng.random()
+                if choice < udpTimeoutShare:
+                    flow = flow[:4] + (rng.choice(UDP_TIMEOUT_PORTS), 'UDP')
+                    duration = '0:{:02d}:{:02d}'.format(rng.randint(2, 59), rng.randint(0, 59))
+                elif choice < udpTimeoutShare + zeroByteShare:
+                    connBytes = 0
+                line = teardownLine(rng, header, connectionId, flow, duration, connBytes)
+            else:
+                line = otherLine(rng, header, connectionId, flow)
+            block.append(line)
+            size += len(line)
+            if len(block) == 10000:
+                outFile.write(''.join(block))
+                block = []
+        outFile.write(''.join(block))
+    return size
+
+def generate(outputDirectory, lines=100000, files=1, flows=10000, teardownShare=0.4, udpTimeoutShare=0.05,
+             zeroByteShare=0.05, compress=False, seed=1, startDate=datetime.date(2017, 1, 15), hostnames=('fw01',)):
+    ''' Write the log files, returns [(fileName, lines, uncompressed bytes)]. '''
+    os.makedirs(outputDirectory, exist_ok=True)
+    flowList = makeFlows(random.Random(seed), flows)
+    result = []
+    for fileNumber in range(files):
+        hostname = hostnames[fileNumber % len(hostnames)]
+        fileDate = startDate + datetime.timedelta(days=fileNumber // len(hostnames))
+        fileName = os.path.join(outputDirectory, '{}_{}.log{}'.format(hostname, fileDate.isoformat(), '.gz' if compress else ''))
+        size = generateFile(fileName, lines, flowList, fileDate, hostname, seed * 1000003 + fileNumber,
+                            teardownShare, udpTimeoutShare, zeroByteShare)
+        result.append((fileName, lines, size))
+    return result
+
+def addGeneratorArguments(parser):
+    parser.add_argument("-l", "--lines", help="lines per file. Defaults to 100000", type=int, default=100000)
+    parser.add_argument("-f", "--files", help="number of files. Defaults to 1", type=int, default=1)
+    parser.add_argument("--flows", help="number of distinct connections. Defaults to 10000", type=int, default=10000)
+    parser.add_argument("--teardown-share", help="share of Teardown TCP/UDP lines. Defaults to 0.4", type=float, default=0.4)
+    parser.add_argument("--udp-timeout-share", help="share of Teardown lines which are UDP 53/137/138/161 timeouts. Defaults to 0.05", type=float, default=0.05)
+    parser.add_argument("--zero-byte-share", help="share of Teardown lines with 0 bytes. Defaults to 0.05", type=float, default=0.05)
+    parser.add_argument("--gzip", help="write .gz files instead of plain text.", action="store_true")
+    parser.add_argument("--hosts", help="number of firewalls, files are distributed over them. Defaults to 1", type=int, default=1)
+    parser.add_argument("--seed", help="random seed. Defaults to 1", type=int, default=1)
+
+def generateFromArguments(outputDirectory, args):
+    return generate(outputDirectory, args.lines, args.files, args.flows, args.teardown_share, args.udp_timeout_share,
+                    args.zero_byte_share, args.gzip, args.seed,
+                    hostnames=['fw{:02d}'.format(host + 1) for host in range(args.hosts)])
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic CISCO ASA syslog files.")
+    parser.add_argument("outputDirectory", help="directory in which the log files will be written.")
+    addGeneratorArguments(parser)
+    args = parser.parse_args()
+    if args.flows < 1 or args.udp_timeout_share + args.zero_byte_share > 1:
+        parser.error("--flows has to be positive and --udp-timeout-share plus --zero-byte-share at most 1")
+
+    for fileName, lines, size in generateFromArguments(args.outputDirectory, args):
+        print('{}: {} lines, {:.1f} MB'.format(fileName, lines, size / 1024 / 1024))
+
+if __name__ == "__main__": main()
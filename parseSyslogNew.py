@@ -17,32 +17,58 @@ v1.04    22.02.2017    FirstSeen, lastSeen for every connection according to dat
 v1.05    26.11.2017    Cleanup of unused or outdated fuctionality (removed splunk option)
                        Included total bytes transferred
 v1.10    26.11.2017    Optimized dictionaries
+v1.20    18.10.2026    Compact ConnectionStore (int keys, date ordinals) instead of string keyed dictionary
+v1.21    18.10.2026    --memory-limit: spill sorted runs to disk and merge them for the output
+v1.22    18.10.2026    --state: incremental runs, only new files are parsed
+v1.23    18.10.2026    --sqlite: connections and state in a SQLite database (see queryConnections.py)
+v1.24    18.10.2026    --report: counters and stage timers as JSON, --profile: cProfile data
+v1.25    18.10.2026    Lines are read undecoded, only the fields of Teardown lines are decoded
+v1.26    18.10.2026    --rules: filter rules from a JSON file (see FilterRules), defaults as in v1.02
+v1.27    18.10.2026    --engine numpy: filters and aggregation of batches in NumPy (see NumpyAggregator)
+v1.28    18.10.2026    --output-format: buffered csv, csv.gz, npz or parquet output (see ConnectionWriter)
+v1.29    18.10.2026    --rollup: connections per hour of the line timestamps (see RollupStore, rollupConnections.py)
+v1.30    18.10.2026    --subnets, --prefix-length: aggregation of IPs by subnets (see SubnetTree)
+v1.31    18.10.2026    --dedup: duplicate Teardown events are dropped (see DuplicateFilter)
+v1.32    18.10.2026    -r, --include, --exclude, --from, --to: selection of the input files (see LogFileFinder)
+                       Files without date in the name are skipped instead of ending the run
+v1.33    18.10.2026    Buffered log, bad lines are counted, sampled (--sample-lines) and logged up to --log-lines per file
+v1.34    18.10.2026    --sketches: top sources, target ports and targets and distinct source counts in fixed memory (see Sketches)
+                       Sketches are updated per parsed line and cover the lines of the run (not a loaded --state)
 
 '''
-import gzip
-import glob
-import re
+import os
 import datetime
 import argparse
 import sys
+import time
+import cProfile
+import AsaLogParser as ALP
+import LogFileSplitter as LFS
+import ConnectionStore as CS
+import SpillingConnectionStore as SCS
+import StateStore as SS
+import SqliteStore as SQ
+import RunReport as RR
+import FilterRules as FR
+import NumpyAggregator as NA
+import ConnectionWriter as CW
+import RollupStore as RS
+import SubnetTree as ST
+import DuplicateFilter as DF
+import LogFileFinder as LFF
+import Diagnostics as DG
+import Sketches as SK
 
 def logOutput(logMessage, logfile, logType="INFO"):
+    # One buffered handle per log file for the whole run, see Diagnostics
     try:
-        outlog = open(logfile,"at")
-        print('{}: {} - {}'.format(str(datetime.datetime.now()), logType, logMessage), file=outlog)
-        outlog.close()
+        print(DG.logLine(logMessage, logType), file=DG.logHandle(logfile))
     except:
         print("Error writing to logfile: {}\n".format(logfile), sys.exc_info()[0])
 
-def writeDictToFile(d, outDir):
-    outFile = open(outDir,'wt')
-    # CSV header
-    # connSourceIP + ';' + connSourceZone +';' + connTargetIP + ';' + connTargetZone + ';' + connTargetPort + ';' + connType
-    print('SourceIP;SourceZone;TargetIP;TargetZone;TargetPort;ConnectionType;count;firstSeen;lastSeen;totalBytes', file=outFile)
-    for x in d:
-        # Output key and the number of registered connections
-        print(x + ';' + str(d[x][0]) + ";" + str(d[x][1]) + ";" + str(d[x][2]) + ";" + str(d[x][3]), file=outFile,)
-    outFile.close()
+def writeDictToFile(store, outDir, outputFormat='csv'):
+    # CSV header and rows as before: SourceIP;SourceZone;TargetIP;TargetZone;TargetPort;ConnectionType;count;firstSeen;lastSeen;totalBytes
+    CW.writeConnections(store, outDir, outputFormat)
 
 def main():
     # Parse command line arguments
@@ -51,7 +77,77 @@ def main():
     parser.add_argument("outputDirectory", help="output directory, where generated files will be stored.")
     parser.add_argument("-e", "--encoding", help="encoding option, with which the inputDirectory files will be parsed. Defaults to 'latin-1'", choices=["latin-1", "utf-8"], default="latin-1")
     parser.add_argument("-v", "--verbose", help="generate console output during program execution.", action="store_true") # implement!
+    parser.add_argument("-r", "--recursive", help="process the files in subdirectories of the inputDirectory as well.", action="store_true")
+    parser.add_argument("--include", help="only files whose name matches this glob pattern (e.g. '*.gz'), may be repeated.", action="append")
+    parser.add_argument("--exclude", help="skip files and directories whose name matches this glob pattern, may be repeated.", action="append")
+    parser.add_argument("--from", dest="date_from", help="only files dated (date in the file name) on or after YYYY-MM-DD.", type=LFF.dateArgument)
+    parser.add_argument("--to", dest="date_to", help="only files dated (date in the file name) on or before YYYY-MM-DD.", type=LFF.dateArgument)
+    parser.add_argument("-s", "--state", help="state file for incremental runs. Only files, which are not yet in the state, are parsed and added to it.")
+    parser.add_argument("--sqlite", help="SQLite database for connections and state, instead of --state. Like with --state, only new files are parsed.")
+    parser.add_argument("--rebuild", help="ignore an existing --state file or --sqlite database and process all files again.", action="store_true")
+    parser.add_argument("-m", "--memory-limit", help="memory in MB for accumulated connections. Beyond that, sorted runs are spilled to disk and merged at the end.", type=int)
+    parser.add_argument("--spill-directory", help="directory for spilled runs. Defaults to the outputDirectory.")
+    parser.add_argument("--report", help="write counters and stage timers per file to this JSON file.")
+    parser.add_argument("--profile", help="write cProfile data of the run to this file (see pstats).")
+    parser.add_argument("--sample-lines", help="bad lines (unmatched Teardown lines, invalid connections) per file sampled to parseSyslogSamples.log. Defaults to 20", type=int, default=20)
+    parser.add_argument("--log-lines", help="bad lines per file written to the log, later ones are counted only. Defaults to 10", type=int, default=10)
+    parser.add_argument("--rules", help="JSON file with the filter rules for connections (see FilterRules).")
+    parser.add_argument("--sketches", help="write the top sources, target ports and targets and distinct source counts of the lines parsed in this run (approximated in fixed memory, see Sketches) to this JSON file.")
+    parser.add_argument("--top", help="number of entries per top list of --sketches. Defaults to 20", type=int, default=SK.TOP)
+    parser.add_argument("--sketch-capacity", help="items tracked per top list of --sketches, counts are exact for items above 1/capacity of the total. Defaults to 1000", type=int, default=SK.CAPACITY)
+    parser.add_argument("--dedup", help="drop duplicate Teardown events (same hostname, firewall timestamp, connection id and bytes, see DuplicateFilter).", action="store_true")
+    parser.add_argument("--dedup-memory", help="MB for the --dedup filter. Defaults to 16", type=int, default=16)
+    parser.add_argument("--dedup-fp-rate", help="false positive rate of the --dedup filter (distinct events taken for duplicates). Defaults to 0.001", type=float, default=0.001)
+    parser.add_argument("--dedup-window", help="seconds within which copies of an event are recognized by --dedup. Defaults to 60", type=int, default=60)
+    parser.add_argument("--output-format", help="format of AllConnections: csv, gzip compressed csv or typed columns as NumPy archive (npz, requires numpy) or Parquet (parquet, requires pyarrow). Defaults to 'csv'", choices=CW.FORMATS, default="csv")
+    parser.add_argument("--subnets", help="aggregate IPs by the subnets in this file (one CIDR per line, the longest prefix wins, see SubnetTree).")
+    parser.add_argument("--prefix-length", help="aggregate IPs outside of the --subnets by networks of this prefix length (e.g. 24).", type=int)
+    parser.add_argument("--rollup", help="save the connections per bucket of the line timestamps to this file (see rollupConnections.py). Extended by incremental runs.")
+    parser.add_argument("--rollup-hours", help="hours per --rollup bucket, has to match the buckets of a --rollup file which is extended. Defaults to 1", type=int, default=1)
+    parser.add_argument("--engine", help="aggregate line by line (python) or in batches with NumPy (numpy). Defaults to 'python'", choices=["python", "numpy"], default="python")
     args = parser.parse_args()
+    if args.memory_limit and (args.state or args.sqlite):
+        parser.error("--memory-limit cannot be combined with --state or --sqlite")
+    if args.state and args.sqlite:
+        parser.error("--state cannot be combined with --sqlite")
+    try:
+        rules = FR.loadRules(args.rules) if args.rules else None
+    except (OSError, ValueError) as error:
+        parser.error("--rules: {}".format(error))
+    reject = FR.compileRules(rules)
+    subnets = None
+    if args.subnets or args.prefix_length is not None:
+        try:
+            subnets = ST.SubnetTree(ST.loadSubnets(args.subnets) if args.subnets else (), args.prefix_length)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        if args.sqlite:
+            parser.error("--subnets and --prefix-length cannot be combined with --sqlite")
+    if not CW.available(args.output_format):
+        parser.error("--output-format {} requires {}".format(args.output_format, "numpy" if args.output_format == "npz" else "pyarrow"))
+    dedup = None
+    if args.dedup:
+        try:
+            dedup = DF.DuplicateFilter(args.dedup_memory * 1024 * 1024, args.dedup_fp_rate, args.dedup_window)
+        except ValueError as error:
+            parser.error("--dedup: {}".format(error))
+    if args.engine == "numpy":
+        if not NA.available():
+            parser.error("--engine numpy requires the numpy package")
+        if args.report:
+            parser.error("--report cannot be combined with --engine numpy")
+        aggregator = NA.NumpyAggregator(rules, args.encoding)
+    if args.rollup and (args.report or args.engine == "numpy"):
+        parser.error("--rollup cannot be combined with --report or --engine numpy")
+    if args.sketch_capacity < 1 or args.top < 1:
+        parser.error("--sketch-capacity and --top have to be at least 1")
+    if args.rollup_hours < 1:
+        parser.error("--rollup-hours has to be at least 1")
+
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    report = RR.RunReport('parseSyslogNew.py')
 
     encdg = args.encoding
     verbose = args.verbose
@@ -66,41 +162,94 @@ def main():
     logf = outputDirectory + "parseSyslogOutput.log"
     logOutput("*" * 40, logf)
     logOutput('Started dataExtraction.py', logf)
+    # Counters, samples and a limited number of log lines for bad input lines
+    diagnostics = DG.Diagnostics(logf, outputDirectory + "parseSyslogSamples.log", args.encoding, args.sample_lines, args.log_lines)
 
     if verbose:
         print("Input Directory:    {}\n" \
               "Output Directory:    {}".format(inputDirectory, outputDirectory))
 
 
-    # Declare dictionary which will store accumulated connections
-    connections = {}
-
-    # -------- Following secion is valid for CISCO ASA Log Format
-    # Regular expression for syslog elements matching.
-    # Compile here only once to avoid pattern interpretation for every further use.
-    regExPattern = re.compile(r'^(?P<DateTime>\w+\s+\d+\s+(\d+):(\d+):(\d+))\s(?P<Hostname>\S+)'\
-                            '\s:\s\w+\s\d+\s(\d+):(\d+):(\d+)\s\w+:\s(?P<ASA_Session>\S+)\s(?:Teardown)'\
-                            '\s(?P<ConnectionType>\S+)\s(\S+)\s(?P<ConnectionID>\d+)' \
-                            '\sfor\s(?P<SourceZone>\S+):(?P<SourceIP>\d+.\d+.\d+.\d+)/(?P<SourcePort>\d+)(\(any\))*'\
-                            '\sto\s(?P<TargetZone>\S+):(?P<TargetIP>\d+.\d+.\d+.\d+)/(?P<TargetPort>\d+)(\(any\))*\s'\
-                            '(duration)\s(?P<Duration>\d+:\d+:\d+)\s(bytes)\s(?P<Bytes>\d+)'\
-                            '\s*(?P<Result>.*)'
-                          )
-
-    regExFileDatePattern = re.compile(r'.*(\d{4})-(\d{2})-(\d{2}).*')
+    # Declare store which will accumulate connections
+    if args.memory_limit:
+        connections = SCS.SpillingConnectionStore(args.memory_limit * 1024 * 1024, args.spill_directory or outputDirectory)
+    else:
+        connections = CS.ConnectionStore()
+    connections.subnets = subnets
 
-    searchItems = ('Teardown TCP', 'Teardown UDP')
-    # -------- End of CISCO ASA specific log Format
+    # -------- CISCO ASA Log Format, see AsaLogParser
+    # Files are read undecoded (bytes), only the extracted fields are decoded with encdg
+    regExPattern = ALP.bytesRegExPattern
+    regExFileDatePattern = ALP.regExFileDatePattern
+    searchTeardown = ALP.bytesSearchPattern.search
 
-    fileList = glob.glob(inputDirectory + '*')
+    fileList = LFF.findFiles(inputDirectory, args.include, args.exclude, args.recursive, args.date_from, args.date_to)
     # Use the following syntax for a single file only.
     # fileList = ['/Volumes/home/TSY/Logfiles/DE_MBH_MUCALL_GW11/Uploaded/de-mbh-mucall-gw-11_2016-10-10.gz']
 
+    state = None
+    incremental = False
+    # Processed files which grew since, fileName -> size of the processed content
+    appendedFiles = {}
+    if args.state or args.sqlite:
+        # Incremental run: continue with the stored connections and parse new files only
+        if args.sqlite:
+            # Connections are upserted into the database after each file
+            state = SQ.SqliteStore(args.sqlite)
+        else:
+            state = SS.StateStore(args.state)
+        if args.rebuild:
+            state.reset()
+        elif state.load():
+            newFiles, appendedFiles, changedFiles = state.compare(fileList)
+            if changedFiles:
+                logOutput('Files changed since last run, rebuilding state: {}'.format(', '.join(changedFiles)), logf)
+                state.reset()
+                appendedFiles = {}
+            elif ST.settings(state.connections.subnets) != ST.settings(subnets):
+                logOutput('Subnets changed since last run, rebuilding state', logf)
+                state.reset()
+                appendedFiles = {}
+            else:
+                logOutput('Loaded state {} with {} files, {} new files, {} appended files'.format(args.state or args.sqlite, len(state.manifest), len(newFiles), len(appendedFiles)), logf)
+                fileList = newFiles + list(appendedFiles)
+                incremental = True
+        connections = state.connections
+        connections.subnets = subnets
+    output = state if args.sqlite else connections
+
+    # Connections per bucket of the line timestamps, extended like the state in incremental runs
+    rollup = None
+    if args.rollup:
+        if incremental and os.path.exists(args.rollup):
+            try:
+                rollup = RS.load(args.rollup)
+            except (OSError, ValueError) as error:
+                parser.error(str(error))
+            if rollup.bucketHours != args.rollup_hours:
+                # Buckets cannot be extended with lines of a different bucket size, see rollupConnections.py to convert
+                parser.error('--rollup {} has buckets of {} hours, not --rollup-hours {}'.format(args.rollup, rollup.bucketHours, args.rollup_hours))
+            logOutput('Loaded rollup {} with {} rows in buckets of {} hours'.format(args.rollup, len(rollup), rollup.bucketHours), logf)
+        else:
+            rollup = RS.RollupStore(args.rollup_hours)
+            rollup.subnets = subnets
+
+    # Sketches of the connections parsed in this run (IPs of the hosts), updated per line
+    sketches = SK.ConnectionSketches(args.sketch_capacity) if args.sketches else None
+
+    logMiss = diagnostics.miss
+
     for fileName in sorted(fileList):
-        if fileName.endswith('.gz'):
-            inFile = gzip.open(fileName, 'rt', encoding=encdg)
+        fileStat = fileSize = None
+        if state is not None:
+            # Only the content present now is parsed and recorded, lines appended meanwhile are left to the next run
+            fileStat = os.stat(fileName)
+            fileSize = fileStat.st_size
+        if fileName in appendedFiles:
+            # Only the tail behind the processed content is parsed
+            inFile = LFS.openAppended(fileName, appendedFiles[fileName], fileSize)
         else:
-            open(fileName, 'rt', encoding=encdg)
+            inFile = LFS.openBinary(fileName, fileSize)
 
         # outFile = gzip.open(outputDirectory + 'NewTeardown_' + fileName[fileName.rfind('/')+1:] + '.csv.gz','wt', encoding='utf-8')
 
@@ -111,99 +260,78 @@ def main():
             fileMonth = matchObj.group(2)
             fileDay = matchObj.group(3)
             fileDate = datetime.date(int(fileYear), int(fileMonth), int(fileDay))
+            fileOrdinal = fileDate.toordinal()
         else:
-            print("Could not determine logfile date from filename!")
-            logOutput('Could not determine logfile date from filename:{}'.format(fileName), logf)
-            sys.exit()
+            # Skipped instead of ending the run, files without date cannot be accounted to a day
+            print("Could not determine logfile date from filename, skipped: {}".format(fileName))
+            logOutput('Could not determine logfile date from filename, skipped: {}'.format(fileName), logf, 'ERROR')
+            inFile.close()
+            continue
 
         logOutput('Input Filename: ' + fileName, logf)
+        if fileName in appendedFiles:
+            logOutput('Appended since last run, parsing from byte {}'.format(appendedFiles[fileName]), logf)
+        diagnostics.startFile(fileName)
         if verbose: print("Processing file: {}".format(fileName))
 
         lineNumber = 0
-
-        for line in inFile:
+        lines = inFile
+        if dedup is not None:
+            # Duplicate Teardown lines are dropped before they are counted and parsed
+            duplicates = dedup.duplicates
+            lines = dedup.lines(inFile, fileOrdinal)
+        if rollup is not None:
+            lineHour = RS.lineClock(fileOrdinal)
+        if args.report:
+            # Counters and stage timers (without the progress output), nothing left for the loop below
+            lineNumber = RR.extractLinesTimed(connections, lines, encdg, fileOrdinal, regExPattern,
+                                              report.fileStats(fileName), logMiss, rules, sketches)
+            lines = ()
+        elif args.engine == "numpy":
+            # Batches are filtered and aggregated by NumPy, the aggregate of the file is merged like a partial result
+            lineNumber = NA.extractLines(aggregator, lines, fileOrdinal, regExPattern, logMiss,
+                                         logInvalid=diagnostics.invalid)
+            fileConnections = aggregator.finish()
+            connections.merge(fileConnections)
+            if sketches is not None:
+                # No parsed connections leave NumPy, the aggregate of the file is sketched instead
+                sketches.addRecords(fileConnections.records())
+            lines = ()
+
+        for line in lines:
             lineNumber += 1
             if verbose:
                 if (lineNumber % 10000) == 0:
                     print("*" * (int(lineNumber/100000)), end="")
                     print(" - {:,}".format(lineNumber), end="\r")
 
-            # Restrict to relevant Teardown events, for which the regex is optimized.
-            if any(s in line for s in searchItems):
-                matchObj = regExPattern.match(line)
-                if matchObj:
-                    connDateTime    = matchObj.group('DateTime')
-                    # print(matchObj.group('Hostname'))
-                    # print(matchObj.group('ASA_Session'))
-                    connType        = matchObj.group('ConnectionType')
-                    # connID          = int(matchObj.group('ConnectionID'))
-                    connSourceZone  = matchObj.group('SourceZone')
-                    connSourceIP    = matchObj.group('SourceIP')
-                    connSourcePort  = matchObj.group('SourcePort')
-                    connTargetZone  = matchObj.group('TargetZone')
-                    connTargetIP    = matchObj.group('TargetIP')
-                    connTargetPort  = matchObj.group('TargetPort')
-                    connDuration    = matchObj.group('Duration')
-                    connBytes       = matchObj.group('Bytes')
-                    connResult      = matchObj.group('Result')
-                else:
-                    logOutput("Regex did not catch relevant line: {}!".format(lineNumber), logf, 'ERROR')
-                    logOutput(line, logf)
-
-
-                # Check for relevance of log entry
-                valid = True
-
-                '''
-                Workaround - duration can be more than 23 hours causing datetime to raise an exception
-                to-do: clean exception handling
-                '''
-                hours = int(connDuration.split(':')[0])
-                if (hours > 23):
-                    hours=23
-                    # logOutput('hours > 23: {} : {}/{}-{} bytes'.format(connDuration, connTargetPort, connType, connBytes), logf)
-
-                duration = datetime.time( hours,
-                                          int(connDuration.split(':')[1]),
-                                          int(connDuration.split(':')[2]))
-                # Ignore 0 byte entries
-                if (int(connBytes) < 1):
-                    valid = False
-                else:
-                    # Skip UDP Port 53, 137, 138 requests with timeouts (UDP does not supply TCP return values)
-                    if (connType=="UDP") and (connTargetPort in ["53", "137", "138", "161"]) and (duration > datetime.time(0,1,59)):
-                        valid = False
-
-                if valid:
-
-                    # Store unique connections with number of occurences in dictionary
-                    key = ";".join([connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType])
-                    if key in connections:
-                        connections[key][0] += 1
-                        # In case log files are not in sequential order, test dates
-                        firstCompareDate = datetime.date(int(connections[key][1][0:4]),
-                                                         int(connections[key][1][5:7]),
-                                                         int(connections[key][1][8:10]))
-                        lastCompareDate = datetime.date(int(connections[key][2][0:4]),
-                                                        int(connections[key][2][5:7]),
-                                                        int(connections[key][2][8:10]))
-                        if firstCompareDate > fileDate:
-                            connections[key][1] = fileDate.isoformat()
-                        if lastCompareDate < fileDate:
-                            connections[key][2] = fileDate.isoformat()
-
-
-
-                        # firstSeen has already been set during initialization
-                        connections[key][2] = fileDate.isoformat()
-                        connections[key][3] += int(connBytes)
-                    else:
-                        # If no nonnections exist, then initialize
-                        connections[key]= [1, fileDate.isoformat(),fileDate.isoformat(), int(connBytes)]   # numConnects, firstSeen, lastSeen, totalBytes
+            # Restrict to relevant Teardown events, for which the parser is optimized.
+            if searchTeardown(line):
+                fields = ALP.parseTeardownBytes(line, encdg, regExPattern)
+                if fields is None:
+                    logMiss(lineNumber, line)
+                    continue
+                connType, connSourceZone, connSourceIP, connTargetZone, connTargetIP, connTargetPort, duration, connBytes = fields
+
+                # Check for relevance of log entry (0 bytes, UDP timeouts, ... see FilterRules)
+                if reject(connType, connSourceZone, connTargetZone, connTargetPort, duration, connBytes) is None:
+                    # Store unique connections with number of occurences, first/last seen date and total bytes
+                    try:
+                        connections.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                                        fileOrdinal, connBytes)
+                    except ValueError:
+                        diagnostics.invalid(lineNumber, line)
+                        continue
+                    if rollup is not None:
+                        rollup.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                                   lineHour(line), connBytes)
+                    if sketches is not None:
+                        sketches.add(connSourceIP, connSourceZone, connTargetIP, connTargetZone, connTargetPort, connType,
+                                     fileOrdinal, connBytes)
 
                 else:
                     # Frequency of these cases is too high - removing logging // JV 13.02.2017
-                    # if (int(connBytes) > 0): # This is the case, if presumably valid results failed the subsequent tests, e.g. DNS timeout.
+                    # if (connBytes > 0): # This is the case, if presumably valid results failed the subsequent tests, e.g. DNS timeout.
                     #    logOutput('Ignoring: Port-{}, Duration-{}, Bytes-{}, Result-{}'.format(connTargetPort, connDuration, connBytes, connResult), logf)
                     pass
 
@@ -212,14 +340,47 @@ def main():
             print(" - {:,}".format(lineNumber))
 
         inFile.close()
+        if state is not None:
+            state.addFile(fileName, fileStat)
         logOutput('Read {} lines.'.format(lineNumber), logf)
-        logOutput('{} dictionary entries.'.format(len(connections)), logf)
+        diagnostics.endFile()
+        if dedup is not None:
+            logOutput('Dropped {} duplicate Teardown lines.'.format(dedup.duplicates - duplicates), logf)
+        logOutput('{} dictionary entries.'.format(len(output)), logf)
 
     # Output connection dictionary to target file
-    # No further conversion necessary, since dictionary keys are in CSV format
-    connectionFile = outputDirectory + 'AllConnections.csv'
+    # Connection keys and dates are rendered to CSV by the store
+    connectionFile = CW.connectionFileName(outputDirectory, args.output_format)
     logOutput('Writing connections to file {}'.format(connectionFile), logf)
-    writeDictToFile(connections, connectionFile)
+    writeStart = time.time()
+    writeDictToFile(output, connectionFile, args.output_format)
+    reportExtra = {}
+    if dedup is not None:
+        logOutput('Dropped {} duplicate Teardown lines in total ({} filter generations)'.format(dedup.duplicates, dedup.generations), logf)
+        if dedup.shortGenerations:
+            logOutput('{} --dedup filter generations covered less than --dedup-window, raise --dedup-memory'.format(dedup.shortGenerations), logf, 'WARNING')
+        reportExtra = dict(duplicates=dedup.duplicates)
+    if sketches is not None:
+        sketches.write(args.sketches, args.top)
+        logOutput('Sketches written to {}'.format(args.sketches), logf)
+    if args.report:
+        report.write(args.report, connections=len(output), writeSeconds=round(time.time() - writeStart, 3), **reportExtra)
+    if args.memory_limit:
+        logOutput('Merged {} spilled runs'.format(len(connections.runFiles)), logf)
+        connections.close()
+    if rollup is not None:
+        logOutput('Saving rollup {} with {} rows'.format(args.rollup, len(rollup)), logf)
+        rollup.save(args.rollup)
+    if state is not None:
+        logOutput('Saving state {}'.format(args.state or args.sqlite), logf)
+        state.save()
+    if args.sqlite:
+        state.close()
+    if args.profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if any(diagnostics.totals.values()):
+        logOutput('Bad lines in total: {}'.format(', '.join('{} {}'.format(count, kind) for kind, count in diagnostics.totals.items())), logf, 'ERROR')
     logOutput('Completed', logf)
     logOutput(("*" * 40) + "\n" , logf)
 
@@ -0,0 +1,89 @@
+'''
+queryConnections.py
+Query the connections database written with --sqlite.
+
+Examples:
+    python queryConnections.py connections.db --target-port 445
+    python queryConnections.py connections.db --source-ip 10.1.2.3 --type TCP
+    python queryConnections.py connections.db --source-net 10.1.0.0/16 --target-port 443
+    python queryConnections.py connections.db --sql "SELECT TargetPort, sum(count) FROM connections GROUP BY 1"
+
+Rows are printed in the format of AllConnections.csv. The database is opened read-only.
+'''
+import os
+import sys
+import sqlite3
+import argparse
+import ConnectionStore as CS
+import SqliteStore as SQ
+import SubnetTree as ST
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the connections database written with --sqlite.")
+    parser.add_argument("database", help="SQLite database file.")
+    parser.add_argument("--source-ip", help="source IP address.")
+    parser.add_argument("--target-ip", help="target IP address.")
+    parser.add_argument("--source-net", help="source subnet (CIDR), looked up as range of the primary key.")
+    parser.add_argument("--target-net", help="target subnet (CIDR), looked up as range of the TargetIP index.")
+    parser.add_argument("--target-port", help="target port.", type=int)
+    parser.add_argument("--source-zone", help="source zone.")
+    parser.add_argument("--target-zone", help="target zone.")
+    parser.add_argument("--type", help="connection type.", choices=["TCP", "UDP"])
+    parser.add_argument("--limit", help="maximum number of rows.", type=int)
+    parser.add_argument("--sql", help="run a SQL statement instead, rows are printed as they are returned.")
+    args = parser.parse_args()
+
+    # Opened read-only, a mistyped path must not create an empty database
+    if not os.path.isfile(args.database):
+        parser.error("database not found: {}".format(args.database))
+    try:
+        db = SQ.connectReadOnly(args.database)
+    except (sqlite3.Error, ValueError) as error:
+        parser.error("{}: {}".format(args.database, error))
+    if args.sql:
+        try:
+            cursor = db.execute(args.sql)
+        except sqlite3.Error as error:
+            parser.error("--sql: {}".format(error))
+        if cursor.description:
+            print(';'.join(column[0] for column in cursor.description))
+        for row in cursor:
+            print(';'.join(map(str, row)))
+        db.close()
+        return
+
+    conditions = []
+    parameters = []
+    try:
+        for column, value in (('SourceIP', args.source_ip and CS.ipToInt(args.source_ip)),
+                              ('TargetIP', args.target_ip and CS.ipToInt(args.target_ip)),
+                              ('TargetPort', args.target_port),
+                              ('SourceZone', args.source_zone),
+                              ('TargetZone', args.target_zone),
+                              ('ConnectionType', args.type)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                parameters.append(value)
+        for column, value in (('SourceIP', args.source_net), ('TargetIP', args.target_net)):
+            if value is not None:
+                conditions.append('{} BETWEEN ? AND ?'.format(column))
+                parameters.extend(ST.subnetRange(*ST.parseCidr(value)))
+    except ValueError as error:
+        parser.error(str(error))
+
+    query = 'SELECT * FROM connections'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    if args.limit:
+        query += ' LIMIT {}'.format(args.limit)
+
+    print(';'.join(SQ.CONNECTION_FIELDS))
+    try:
+        for row in db.execute(query, parameters):
+            print(';'.join(map(str, SQ.renderRow(row))))
+    except BrokenPipeError:
+        # Output piped into head and the like
+        sys.stderr.close()
+    db.close()
+
+if __name__ == "__main__": main()
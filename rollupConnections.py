@@ -0,0 +1,43 @@
+'''
+rollupConnections.py
+Re-aggregate a rollup saved with parseSyslogNew.py --rollup.
+
+Examples:
+    python rollupConnections.py rollup.pkl daily.csv --bucket-hours 24
+    python rollupConnections.py rollup.pkl weekly.parquet --bucket-hours 168 --output-format parquet
+    python rollupConnections.py rollup.pkl AllConnections.csv --total
+
+Rows are written like AllConnections.csv with the start of the bucket in front
+(see RollupStore), --total writes the connections summed over all buckets.
+'''
+import argparse
+import ConnectionWriter as CW
+import RollupStore as RS
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-aggregate a rollup saved with parseSyslogNew.py --rollup into larger buckets.")
+    parser.add_argument("rollupFile", help="rollup file written by --rollup.")
+    parser.add_argument("outputFile", help="file to write the buckets to.")
+    parser.add_argument("-b", "--bucket-hours", help="hours per bucket, a multiple of the hours of the rollup file (24: days, 168: weeks starting on Monday). Defaults to the hours of the rollup file", type=int)
+    parser.add_argument("--total", help="write the connections summed over all buckets instead.", action="store_true")
+    parser.add_argument("--output-format", help="format of the outputFile (see ConnectionWriter). Defaults to 'csv'", choices=CW.FORMATS, default="csv")
+    args = parser.parse_args()
+    if not CW.available(args.output_format):
+        parser.error("--output-format {} requires {}".format(args.output_format, "numpy" if args.output_format == "npz" else "pyarrow"))
+
+    try:
+        rollup = RS.load(args.rollupFile)
+        if args.bucket_hours and args.bucket_hours != rollup.bucketHours:
+            rollup = rollup.rollup(args.bucket_hours)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if args.total:
+        connections = rollup.connections()
+        CW.writeConnections(connections, args.outputFile, args.output_format)
+        print('{} connections written to {}'.format(len(connections), args.outputFile))
+    else:
+        CW.writeConnections(rollup, args.outputFile, args.output_format, RS.ROLLUP_FIELDS)
+        print('{} rows in buckets of {} hours written to {}'.format(len(rollup), rollup.bucketHours, args.outputFile))
+
+if __name__ == "__main__": main()
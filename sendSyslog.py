@@ -0,0 +1,67 @@
+'''
+sendSyslog.py
+Replay log files to syslogServer.py
+
+Every line of the files is sent as one syslog message, via UDP (one datagram per line)
+or TCP (newline separated), optionally limited to --rate messages per second.
+The number of sent lines can be compared with the lines received by the server.
+'''
+import sys
+import time
+import gzip
+import socket
+import argparse
+
+RATE_STEPS = 100
+
+def readLines(fileNames):
+    for fileName in fileNames:
+        if fileName.endswith('.gz'):
+            inFile = gzip.open(fileName, 'rb')
+        else:
+            inFile = open(fileName, 'rb')
+        with inFile:
+            for line in inFile:
+                yield line.rstrip(b'\r\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Send the lines of log files as syslog messages to syslogServer.py.")
+    parser.add_argument("files", help="log files (plain or .gz) to be sent.", nargs="+")
+    parser.add_argument("--host", help="server address. Defaults to 127.0.0.1", default="127.0.0.1")
+    parser.add_argument("-p", "--port", help="server port. Defaults to 514", type=int, default=514)
+    parser.add_argument("--tcp", help="send via TCP instead of UDP.", action="store_true")
+    parser.add_argument("-r", "--rate", help="messages per second, 0 sends as fast as possible. Defaults to 0", type=int, default=0)
+    parser.add_argument("--repeat", help="send the files this many times. Defaults to 1", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.tcp:
+        sock = socket.create_connection((args.host, args.port))
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((args.host, args.port))
+
+    # Rate limit: a share of the messages per second is sent every 1/RATE_STEPS second
+    stepLines = max(args.rate // RATE_STEPS, 1)
+    sent = 0
+    start = time.time()
+    try:
+        for _ in range(args.repeat):
+            for line in readLines(args.files):
+                if args.tcp:
+                    sock.sendall(line + b'\n')
+                else:
+                    sock.send(line)
+                sent += 1
+                if args.rate and sent % stepLines == 0:
+                    delay = start + sent / args.rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+    except ConnectionError as error:
+        sys.exit('Sending failed after {} lines: {}'.format(sent, error))
+    finally:
+        sock.close()
+
+    elapsed = time.time() - start
+    print('Sent {} lines in {:.2f}s ({:.0f} lines/s)'.format(sent, elapsed, sent / elapsed if elapsed else 0))
+
+if __name__ == "__main__": main()
@@ -0,0 +1,142 @@
+'''
+shardParseSyslog.py
+Sharded runs: parse a part of the log files into a partial aggregate, merge the partials.
+
+    partial  parses the files of a shard into a partial file (see PartialAggregate). The files
+             are selected by name (-r, --include, --exclude, see LogFileFinder), by --shard I/N
+             (files whose name hashes to I modulo N) and by the date in their name (--from / --to).
+             The largest files are parsed first.
+    merge    merges any number of partial files into AllConnections.<format>, or into a single
+             partial file again (--partial), so partials can be merged in stages.
+
+Every shard can run on a different host or as a local process, e.g. four shards:
+    for i in 0 1 2 3; do python shardParseSyslog.py partial -i logs -o shard$i.partial --shard $i/4 & done; wait
+    python shardParseSyslog.py merge shard*.partial -o out
+The result is the same as the one of a single run over all files. Partials of different
+--rules / --encoding or with the same file in two partials are refused by merge.
+Subnets (--subnets) and rollups (--rollup) are not part of the partials.
+'''
+import os
+import time
+import zlib
+import datetime
+import argparse
+import concurrent.futures
+import LogFileExtractor as LFE
+import LogFileFinder as LFF
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+import ConnectionWriter as CW
+import PartialAggregate as PA
+
+def shardOf(fileName, shards):
+    ''' Shard of a file, from the hash of its name, so the files of a shard do not depend on the host. '''
+    return zlib.crc32(fileName.rsplit('/', 1)[-1].encode('utf-8')) % shards
+
+def parseShard(value):
+    try:
+        shard, shards = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected I/N, e.g. 0/4")
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError("expected 0 <= I < N")
+    return shard, shards
+
+def processFile(fileName, encdg, rules):
+    # Runs inside a worker process, result has to be picklable
+    return LFE.LogFileExtractor(fileName, encdg, ALP.bytesRegExPattern, ALP.regExFileDatePattern,
+                                rules=rules).extractData()
+
+def partial(args, parser):
+    try:
+        rules = FR.loadRules(args.rules) if args.rules else None
+    except (OSError, ValueError) as error:
+        parser.error("--rules: {}".format(error))
+
+    inputDirectory = args.inputDirectory
+    if not inputDirectory.endswith('/'):
+        inputDirectory = inputDirectory + "/"
+
+    fileList = LFF.findFiles(inputDirectory, args.include, args.exclude, args.recursive, args.date_from, args.date_to)
+    # Skipped like by parseSyslog.py, instead of dating them 1970-01-01
+    fileList, undated = LFF.splitUndated(fileList)
+    for fileName in undated:
+        print("Could not determine logfile date from filename, skipped: {}".format(fileName))
+    if args.shard:
+        fileList = [f for f in fileList if shardOf(f, args.shard[1]) == args.shard[0]]
+    fileList.sort(key=lambda fileName: -os.path.getsize(fileName))
+
+    start = time.time()
+    sumConnections = CS.ConnectionStore()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(processFile, fileName, args.encoding, rules): fileName for fileName in fileList}
+        for future in concurrent.futures.as_completed(futures):
+            connections = future.result()
+            sumConnections.merge(connections)
+            print ('File Done: {}\n - {} dictionary entries\n - {} total dictionary entries.'.format(
+                   futures[future], len(connections), len(sumConnections)))
+
+    shard = {'include': args.include, 'exclude': args.exclude, 'recursive': args.recursive,
+             'shard': '{}/{}'.format(*args.shard) if args.shard else None,
+             'from': datetime.date.fromordinal(args.date_from).isoformat() if args.date_from else None,
+             'to': datetime.date.fromordinal(args.date_to).isoformat() if args.date_to else None}
+    # Rules are stored complete, so default rules given explicitly match the defaults
+    rows = PA.writePartial(sumConnections, args.outputFile, [PA.fileInfo(f) for f in fileList],
+                           dict(FR.DEFAULT_RULES, **(rules or {})), args.encoding, shard)
+    print('{} files, {} connections written to {}'.format(len(fileList), rows, args.outputFile))
+    print('Total job execution time: ', time.time() - start)
+
+def merge(args, parser):
+    if not CW.available(args.output_format):
+        parser.error("--output-format {} requires {}".format(args.output_format, "numpy" if args.output_format == "npz" else "pyarrow"))
+    start = time.time()
+    try:
+        merged = PA.PartialMerge(args.partials)
+    except (OSError, EOFError, ValueError) as error:
+        parser.error(str(error))
+
+    if args.partial:
+        merged.writePartial(args.partial)
+        print('{} partials merged into {}'.format(len(args.partials), args.partial))
+    if args.outputDirectory:
+        outputDirectory = args.outputDirectory
+        if not outputDirectory.endswith('/'):
+            outputDirectory = outputDirectory + "/"
+        connectionFile = CW.connectionFileName(outputDirectory, args.output_format)
+        CW.writeConnections(merged, connectionFile, args.output_format)
+        print('{} partials merged into {}'.format(len(args.partials), connectionFile))
+    print('Total job execution time: ', time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse shards of a logfile directory into partial aggregates and merge them into the accumulated connections.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    partialParser = subparsers.add_parser("partial", help="parse the files of a shard into a partial aggregate.")
+    partialParser.add_argument("-i", "--inputDirectory", help="directory in which source files to be processed are located.", required=True)
+    partialParser.add_argument("-o", "--outputFile", help="partial file to write.", required=True)
+    partialParser.add_argument("-r", "--recursive", help="process the files in subdirectories of the inputDirectory as well.", action="store_true")
+    partialParser.add_argument("--include", help="only files whose name matches this glob pattern (e.g. '*.gz'), may be repeated.", action="append")
+    partialParser.add_argument("--exclude", help="skip files and directories whose name matches this glob pattern, may be repeated.", action="append")
+    partialParser.add_argument("-s", "--shard", help="only files of shard I of N (I/N, by hash of the file name).", type=parseShard)
+    partialParser.add_argument("--from", dest="date_from", help="only files dated (date in the file name) on or after YYYY-MM-DD.", type=LFF.dateArgument)
+    partialParser.add_argument("--to", dest="date_to", help="only files dated (date in the file name) on or before YYYY-MM-DD.", type=LFF.dateArgument)
+    partialParser.add_argument("-w", "--workers", help="number of worker processes. Defaults to the number of CPUs.", type=LFF.positiveInt)
+    partialParser.add_argument("-e", "--encoding", help="encoding option with which the files will be parsed. Defaults to 'latin-1'", choices=["latin-1", "utf-8"], default="latin-1")
+    partialParser.add_argument("--rules", help="JSON file with the filter rules for connections (see FilterRules).")
+
+    mergeParser = subparsers.add_parser("merge", help="merge partial aggregates.")
+    mergeParser.add_argument("partials", help="partial files to merge.", nargs="+")
+    mergeParser.add_argument("-o", "--outputDirectory", help="directory in which AllConnections will be placed.")
+    mergeParser.add_argument("--output-format", help="format of AllConnections (see ConnectionWriter). Defaults to 'csv'", choices=CW.FORMATS, default="csv")
+    mergeParser.add_argument("--partial", help="write the merge as partial file as well.")
+
+    args = parser.parse_args()
+    if args.command == "partial":
+        partial(args, partialParser)
+    else:
+        if not args.outputDirectory and not args.partial:
+            mergeParser.error("one of -o/--outputDirectory or --partial is required")
+        merge(args, mergeParser)
+
+if __name__ == "__main__": main()
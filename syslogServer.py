@@ -0,0 +1,309 @@
+'''
+syslogServer.py
+Live syslog receiver to generate accumulated connections
+
+Listens for syslog messages of the firewalls on UDP and TCP (one message per datagram,
+newline separated messages on TCP). Received lines are collected in batches and parsed
+and filtered like log files (LogFileExtractor.extractLines), the connections are dated
+with the day of reception. The aggregate is written to AllConnections.csv (or in the
+--output-format, see ConnectionWriter, and to the --state file, which is loaded again
+on start) every --snapshot-interval seconds and on shutdown (SIGINT/SIGTERM).
+
+Messages are taken as sent by the firewalls or as lines of the relay log files:
+    <166>%ASA-6-302014: Teardown ...
+    <166>Jan 15 13:30:36 CET: %ASA-6-302014: Teardown ...
+    Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown ...
+The <PRI> is stripped and messages of the firewalls get the relay header of the log
+files (time of reception and sender address), see normalizeMessage(). Teardown messages
+the parser does not match anyway are counted and reported with every snapshot.
+
+With --workers, batches are parsed by worker processes and their partial aggregates
+are merged by the receiver, so receiving is not held up by parsing. At most
+--max-pending batches are parsed at a time: TCP connections are not read meanwhile,
+UDP batches beyond that are dropped and counted. The UDP receive buffer
+(--receive-buffer) has to absorb bursts while a batch is handled, the kernel may cap
+it (net.core.rmem_max).
+Connections received since the last snapshot are kept in a store of their own, which
+is swapped for an empty one and merged into the aggregate by the snapshot thread.
+
+Use sendSyslog.py to replay log files to the server.
+'''
+import os
+import re
+import sys
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import datetime
+import concurrent.futures
+import LogFileExtractor as LFE
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+import StateStore as SS
+import ConnectionWriter as CW
+
+BATCH_MESSAGES = 5000
+BATCH_INTERVAL = 0.5
+TCP_READ_SIZE = 256 * 1024
+ASA_TAG = b'%ASA-'
+HEADER = b' : '
+PRIORITY = re.compile(rb'<\d{1,3}>')
+# Device timestamp as expected by the parser (see AsaLogParser.regExPattern)
+DEVICE_TIMESTAMP = re.compile(rb'\w+\s\d+\s\d+:\d+:\d+\s\w+:\s')
+
+def writeDictToFile(store, outDir, outputFormat='csv'):
+    # Written to a temporary file first, so readers never see a partial snapshot
+    tmpFile = outDir + '.tmp'
+    CW.writeConnections(store, tmpFile, outputFormat)
+    os.replace(tmpFile, outDir)
+
+def normalizeMessage(line, sender, received):
+    '''
+    A syslog message (without <PRI>) in the line format of the relay log files
+    "<received> <hostname> : <device timestamp>: %ASA-...". Messages of the firewalls get
+    the hostname of their own header or the sender address, and received as device
+    timestamp if they have none in the expected format. Other lines are returned as they are.
+    '''
+    asa = line.find(ASA_TAG)
+    if asa < 0:
+        return line
+    before, sep, device = line[:asa].rpartition(HEADER)
+    if sep and DEVICE_TIMESTAMP.fullmatch(device):
+        return line
+    if not DEVICE_TIMESTAMP.fullmatch(device):
+        device = received + b' UTC: '
+    hostname = before.rpartition(b' ')[2] if sep else b''
+    return received + b' ' + (hostname or sender) + HEADER + device + line[asa:]
+
+def messageLines(batch, received):
+    ''' Lines of the (sender, data) of a batch, see normalizeMessage(). '''
+    for sender, data in batch:
+        for line in data.splitlines():
+            match = PRIORITY.match(line)
+            if match:
+                line = line[match.end():]
+            yield normalizeMessage(line, sender, received)
+
+def processBatch(batch, received, dateOrdinal, regExPattern, encoding, rules=None):
+    # Runs inside a worker process, result has to be picklable
+    connections = CS.ConnectionStore()
+    unmatched = []
+    lineCount = LFE.extractLines(connections, messageLines(batch, received), dateOrdinal, regExPattern, encoding, rules,
+                                 lambda lineNumber, line: unmatched.append(line))
+    return connections, lineCount, len(unmatched), unmatched[:1]
+
+class SyslogUdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.receive(data, addr[0].encode('ascii'))
+
+class SyslogServer:
+
+    def __init__(self, connections, encoding, workers=0, rules=None, maxPending=None):
+        # Connections received since the last snapshot, see takeConnections()
+        self.connections = connections
+        self.encdg = encoding
+        self.rules = rules
+        self.regExPattern = ALP.bytesRegExPattern
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.maxPending = maxPending or 2 * max(workers, 1)
+        self.pending = set()
+        self.batch = []
+        self.processedLines = 0
+        self.unmatchedLines = 0
+        self.unmatchedExample = None
+        self.droppedMessages = 0
+
+    def receive(self, data, sender):
+        # Per datagram path, messages are only split per batch (and decoded by the parser)
+        self.batch.append((sender, data))
+        if len(self.batch) >= BATCH_MESSAGES:
+            self.processBatch()
+
+    def processBatch(self):
+        if not self.batch:
+            return
+        if self.executor is not None and len(self.pending) >= self.maxPending:
+            # Workers are behind: collect up to a full batch, drop full batches
+            if len(self.batch) < BATCH_MESSAGES:
+                return
+            self.droppedMessages += len(self.batch)
+            self.batch = []
+            return
+        batch = self.batch
+        self.batch = []
+        received = datetime.datetime.now(datetime.timezone.utc).strftime('%b %d %H:%M:%S').encode('ascii')
+        dateOrdinal = datetime.date.today().toordinal()
+        if self.executor is None:
+            unmatched = []
+            self.processedLines += LFE.extractLines(self.connections, messageLines(batch, received), dateOrdinal,
+                                                    self.regExPattern, self.encdg, self.rules,
+                                                    lambda lineNumber, line: unmatched.append(line))
+            self.countUnmatched(len(unmatched), unmatched[:1])
+        else:
+            future = self.executor.submit(processBatch, batch, received, dateOrdinal, self.regExPattern, self.encdg,
+                                          self.rules)
+            task = asyncio.ensure_future(self.mergeBatch(future))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    def countUnmatched(self, count, examples):
+        self.unmatchedLines += count
+        if examples and self.unmatchedExample is None:
+            self.unmatchedExample = examples[0]
+
+    async def mergeBatch(self, future):
+        # Partial results are merged in the event loop only, so no locking is required
+        connections, lineCount, unmatchedCount, examples = await asyncio.wrap_future(future)
+        self.connections.merge(connections)
+        self.processedLines += lineCount
+        self.countUnmatched(unmatchedCount, examples)
+
+    async def waitForWorkers(self):
+        ''' Backpressure for TCP: wait while --max-pending batches are parsed. '''
+        while self.executor is not None and len(self.pending) >= self.maxPending:
+            await asyncio.wait(set(self.pending), return_when=asyncio.FIRST_COMPLETED)
+
+    def takeConnections(self):
+        ''' Connections received since the last call, receiving goes on into an empty store. '''
+        connections = self.connections
+        self.connections = CS.ConnectionStore()
+        return connections
+
+    def status(self):
+        return '{} lines processed, {} unmatched Teardown lines, {} messages dropped'.format(
+               self.processedLines, self.unmatchedLines, self.droppedMessages)
+
+    async def handleTcp(self, reader, writer):
+        sender = writer.get_extra_info('peername')[0].encode('ascii')
+        rest = b''
+        while True:
+            await self.waitForWorkers()
+            data = await reader.read(TCP_READ_SIZE)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            if end:
+                self.receive(data[:end - 1], sender)
+        if rest:
+            self.receive(rest, sender)
+        writer.close()
+
+    async def drain(self):
+        ''' Parse the current batch and wait for the batches in the workers. '''
+        self.processBatch()
+        await asyncio.gather(*self.pending)
+
+    async def batchTimer(self):
+        # Lines of a slow trickle are parsed after BATCH_INTERVAL, not only once a batch is full
+        while True:
+            await asyncio.sleep(BATCH_INTERVAL)
+            self.processBatch()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+def snapshot(connections, received, connectionFile, state, outputFormat='csv'):
+    # Runs in a thread, the event loop does not touch connections (the aggregate)
+    connections.merge(received)
+    writeDictToFile(connections, connectionFile, outputFormat)
+    if state is not None:
+        state.connections = connections
+        state.save()
+
+async def serve(args, connections, state):
+    loop = asyncio.get_running_loop()
+    server = SyslogServer(CS.ConnectionStore(), args.encoding, args.workers, args.rules, args.max_pending)
+
+    udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.receive_buffer * 1024 * 1024)
+    udpSocket.bind((args.host, args.port))
+    udpTransport, _ = await loop.create_datagram_endpoint(lambda: SyslogUdpProtocol(server), sock=udpSocket)
+    tcpServer = await asyncio.start_server(server.handleTcp, args.host, args.tcp_port or args.port)
+    print('Listening on {} UDP/{} TCP/{}, receive buffer {} bytes'.format(
+        args.host, args.port, args.tcp_port or args.port, udpSocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    batchTimer = asyncio.ensure_future(server.batchTimer())
+
+    connectionFile = CW.connectionFileName(args.outputDirectory, args.output_format)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), args.snapshot_interval)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            break
+        start = time.time()
+        # Receiving goes on into an empty store while the aggregate is merged and written
+        await loop.run_in_executor(None, snapshot, connections, server.takeConnections(), connectionFile, state,
+                                   args.output_format)
+        print('{}: {}, {} connections, snapshot {:.2f}s'.format(
+            datetime.datetime.now(), server.status(), len(connections), time.time() - start))
+        if server.unmatchedExample is not None:
+            print('Unmatched Teardown line, e.g.: {}'.format(server.unmatchedExample.decode(args.encoding, 'replace')))
+            server.unmatchedExample = None
+
+    udpTransport.close()
+    tcpServer.close()
+    await tcpServer.wait_closed()
+    batchTimer.cancel()
+    await server.drain()
+    server.close()
+    snapshot(connections, server.takeConnections(), connectionFile, state, args.output_format)
+    print('{}: {}, {} connections, stopped'.format(datetime.datetime.now(), server.status(), len(connections)))
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description="Receive syslog messages of the firewalls and accumulate connections, which are written to the outputDirectory periodically.")
+    parser.add_argument("-o", "--outputDirectory", help="directory in which AllConnections.csv will be placed.", required=True)
+    parser.add_argument("-e", "--encoding", help="encoding of the received messages. Defaults to 'latin-1'", choices=["latin-1", "utf-8"], default="latin-1")
+    parser.add_argument("--host", help="address to listen on. Defaults to 0.0.0.0", default="0.0.0.0")
+    parser.add_argument("-p", "--port", help="UDP port (and TCP port, unless --tcp-port is given). Defaults to 514", type=int, default=514)
+    parser.add_argument("--tcp-port", help="TCP port.", type=int)
+    parser.add_argument("-w", "--workers", help="number of worker processes for parsing. 0 parses in the receiving process. Defaults to the number of CPUs - 1", type=int,
+                        default=max((os.cpu_count() or 1) - 1, 0))
+    parser.add_argument("--max-pending", help="batches parsed by the workers at a time, beyond that TCP is not read and UDP batches are dropped. Defaults to 2 per worker", type=int)
+    parser.add_argument("--receive-buffer", help="UDP receive buffer in MB. Defaults to 64", type=int, default=64)
+    parser.add_argument("--snapshot-interval", help="seconds between snapshots. Defaults to 60", type=float, default=60)
+    parser.add_argument("-s", "--state", help="state file, connections are saved to it with every snapshot and loaded again on start.")
+    parser.add_argument("--rules", help="JSON file with the filter rules for connections (see FilterRules).")
+    parser.add_argument("--output-format", help="format of AllConnections: csv, gzip compressed csv or typed columns as NumPy archive (npz, requires numpy) or Parquet (parquet, requires pyarrow). Defaults to 'csv'", choices=CW.FORMATS, default="csv")
+    args = parser.parse_args()
+    try:
+        args.rules = FR.loadRules(args.rules) if args.rules else None
+    except (OSError, ValueError) as error:
+        parser.error("--rules: {}".format(error))
+    if args.workers < 0 or (args.max_pending is not None and args.max_pending < 1):
+        parser.error("--workers has to be at least 0 and --max-pending at least 1")
+    if not CW.available(args.output_format):
+        parser.error("--output-format {} requires {}".format(args.output_format, "numpy" if args.output_format == "npz" else "pyarrow"))
+
+    if not args.outputDirectory.endswith('/'):
+        args.outputDirectory = args.outputDirectory + "/"
+
+    state = None
+    connections = CS.ConnectionStore()
+    if args.state:
+        state = SS.StateStore(args.state)
+        if state.load():
+            print('Loaded state {} with {} connections'.format(args.state, len(state.connections)))
+        connections = state.connections
+
+    try:
+        asyncio.run(serve(args, connections, state))
+    except PermissionError as error:
+        sys.exit('Cannot listen on port {}: {}'.format(args.port, error))
+
+if __name__ == "__main__": main()
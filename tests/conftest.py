@@ -0,0 +1,22 @@
+'''
+Shared fixtures of the tests, the modules are imported from the repository directory.
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generateAsaLogs as GAL
+
+@pytest.fixture(scope="session")
+def logDirectory(tmp_path_factory):
+    ''' Two days of two firewalls (plain text), generated once per test run. '''
+    directory = tmp_path_factory.mktemp("logs")
+    GAL.generate(str(directory), lines=20000, files=4, flows=2000, hostnames=('fw01', 'fw02'))
+    return directory
+
+@pytest.fixture(scope="session")
+def logFiles(logDirectory):
+    return sorted(str(path) for path in logDirectory.iterdir())
@@ -0,0 +1,65 @@
+'''
+The Teardown parsing of AsaLogParser against the per group extraction of the original scripts.
+'''
+import AsaLogParser as ALP
+
+# Lines at the edges of the pattern, each with the expected match result
+VERIFY_LINES = (
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234 TCP FINs\n', True),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302016: Teardown UDP connection 4712 for inside:10.0.16.16/53122 to outside:10.1.11.3/53 duration 0:02:01 bytes 0\n', True),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504(any) to outside:10.1.11.2/443(any) duration 1:52:31 bytes 1234\n', True),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for in:side:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', True),
+    (b'Jan  5 13:30:36 fw01 : Jan 5 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', True),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 123:52:31 bytes 99999999999\n', True),
+    (b'garbage : x Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 2017 13:30:36: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10..16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for in side:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52 bytes 1234\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 4711 for inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 1:52:31 bytes\n', False),
+    (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302020: Built inbound ICMP connection for faddr 10.0.0.1/0 gaddr 10.0.0.2/0 laddr 10.0.0.2/0\n', False),
+)
+
+def referenceParse(line, regExPattern=ALP.regExPattern):
+    ''' Field extraction of the original parseSyslog.py, one group() per field and the duration split. '''
+    matchObj = regExPattern.match(line)
+    if not matchObj:
+        return None
+    hours, minutes, seconds = matchObj.group('Duration').split(':' if isinstance(line, str) else b':')
+    return (matchObj.group('ConnectionType'), matchObj.group('SourceZone'), matchObj.group('SourceIP'),
+            matchObj.group('TargetZone'), matchObj.group('TargetIP'), matchObj.group('TargetPort'),
+            int(hours) * 3600 + int(minutes) * 60 + int(seconds), int(matchObj.group('Bytes')))
+
+def decoded(fields, encoding='latin-1'):
+    if fields is None:
+        return None
+    return tuple(field.decode(encoding) if isinstance(field, bytes) else field for field in fields)
+
+def checkLine(rawLine):
+    line = rawLine.decode('latin-1')
+    expected = referenceParse(line)
+    assert ALP.parseTeardown(line) == expected, line
+    assert ALP.parseTeardownBytes(rawLine) == expected, line
+    rawFields = ALP.parseTeardownRaw(rawLine)
+    assert rawFields == referenceParse(rawLine, ALP.bytesRegExPattern), line
+    assert decoded(rawFields) == expected, line
+    return expected
+
+def test_verifyLines():
+    for rawLine, matches in VERIFY_LINES:
+        assert (checkLine(rawLine) is not None) == matches, rawLine
+
+def test_generatedCorpus(logFiles):
+    parsed = unmatched = 0
+    for fileName in logFiles:
+        with open(fileName, 'rb') as inFile:
+            for rawLine in inFile:
+                if not ALP.bytesSearchPattern.search(rawLine):
+                    continue
+                if checkLine(rawLine) is None:
+                    unmatched += 1
+                else:
+                    parsed += 1
+    assert parsed > 10000
+    assert unmatched == 0
@@ -0,0 +1,92 @@
+'''
+Merging of ConnectionStores with different name ids, against a plain dict aggregate.
+'''
+import random
+import ConnectionStore as CS
+import SubnetTree as ST
+
+ZONES = ('inside', 'outside', 'dmz', 'guest', 'voice')
+TYPES = ('TCP', 'UDP')
+
+def randomConnections(rng, count):
+    ips = ['10.{}.{}.{}'.format(rng.randint(0, 3), rng.randint(0, 255), rng.randint(1, 254)) for i in range(40)]
+    result = []
+    for number in range(count):
+        result.append((rng.choice(ips), rng.choice(ZONES), rng.choice(ips), rng.choice(ZONES),
+                       rng.choice(('53', '80', '443', '65535')), rng.choice(TYPES),
+                       736000 + rng.randint(0, 30), rng.randint(1, 10 ** 6)))
+    return result
+
+def referenceRows(connections, mapConnection=lambda connection: connection):
+    ''' (connection fields, count, firstSeen, lastSeen, totalBytes) aggregated in a dict. '''
+    aggregate = {}
+    for connection in connections:
+        fields = mapConnection(connection[:6])
+        dateOrdinal, connBytes = connection[6:]
+        if fields in aggregate:
+            count, first, last, totalBytes = aggregate[fields]
+            aggregate[fields] = (count + 1, min(first, dateOrdinal), max(last, dateOrdinal), totalBytes + connBytes)
+        else:
+            aggregate[fields] = (1, dateOrdinal, dateOrdinal, connBytes)
+    return sorted(fields + values for fields, values in aggregate.items())
+
+def storeRows(store):
+    return sorted(store.unpackKey(key) + (store.counts[row], store.firstSeen[row], store.lastSeen[row],
+                                          store.totalBytes[row])
+                  for key, row in store.rowIndex.items())
+
+def shuffledStore(rng):
+    ''' Empty store with the names interned in random order, so its name ids differ from the others. '''
+    store = CS.ConnectionStore()
+    names = list(ZONES + TYPES)
+    rng.shuffle(names)
+    for name in names[:rng.randint(0, len(names))]:
+        store.nameId(name)
+    return store
+
+def test_mergeTranslatesNameIds():
+    rng = random.Random(2)
+    connections = randomConnections(rng, 3000)
+    merged = CS.ConnectionStore()
+    for part in range(4):
+        store = shuffledStore(rng)
+        for connection in connections[part::4]:
+            store.add(*connection)
+        merged.merge(store)
+    assert storeRows(merged) == referenceRows(connections)
+    assert len(merged.names) == len(set(merged.names))
+
+def test_mergeIntoStoreWithSameNames():
+    rng = random.Random(3)
+    connections = randomConnections(rng, 500)
+    first = CS.ConnectionStore()
+    second = CS.ConnectionStore()
+    for connection in connections[:250]:
+        first.add(*connection)
+    for name in first.names:
+        second.nameId(name)
+    for connection in connections[250:]:
+        second.add(*connection)
+    first.merge(second)
+    assert storeRows(first) == referenceRows(connections)
+
+def test_mergeMapsSubnets():
+    rng = random.Random(4)
+    connections = randomConnections(rng, 2000)
+    subnets = ST.SubnetTree(['10.0.0.0/8', '10.1.0.0/16'])
+    merged = CS.ConnectionStore()
+    merged.subnets = subnets
+    for part in range(2):
+        # Partial results of workers hold the IPs of the hosts
+        store = shuffledStore(rng)
+        for connection in connections[part::2]:
+            store.add(*connection)
+        merged.merge(store)
+
+    def toSubnets(fields):
+        sourceIP, sourceZone, targetIP, targetZone, targetPort, connType = fields
+        render = lambda ip: subnets.render(subnets.map(CS.ipToInt(ip)))
+        return (render(sourceIP), sourceZone, render(targetIP), targetZone, targetPort, connType)
+
+    assert storeRows(merged) == referenceRows(connections, toSubnets)
+    assert {row[0] for row in storeRows(merged)} == {'10.0.0.0/8', '10.1.0.0/16'}
@@ -0,0 +1,116 @@
+'''
+compileRules() against a direct reading of the rules, and the validation of checkRules().
+'''
+import random
+import itertools
+import pytest
+import FilterRules as FR
+
+PROTOCOLS = ('TCP', 'UDP', 'ICMP')
+ZONES = ('inside', 'outside', 'dmz', 'guest')
+PORTS = ('53', '80', '137', '161', '443', '8080')
+DURATIONS = (0, 59, 119, 120, 121, 3600, 90000)
+BYTES = (0, 1, 2, 1500)
+
+def referenceReject(rules, connType, sourceZone, targetZone, targetPort, duration, connBytes):
+    ''' The rules as described in FilterRules, evaluated without any compilation. '''
+    rules = dict(FR.DEFAULT_RULES, **rules)
+    if connBytes < rules['minBytes']:
+        return 'filteredBytes'
+    if rules['protocols'] is not None and connType not in rules['protocols']:
+        return 'filteredProtocol'
+    for zones, zone in ((rules['sourceZones'], sourceZone), (rules['targetZones'], targetZone)):
+        if zone in (zones.get('exclude') or []):
+            return 'filteredZone'
+        if zones.get('include') is not None and zone not in zones['include']:
+            return 'filteredZone'
+    for rule in rules['drop']:
+        if ((rule.get('protocols') is None or connType in rule['protocols'])
+                and (rule.get('ports') is None or targetPort in [str(port) for port in rule['ports']])
+                and duration >= (rule.get('minDuration') or 0)
+                and (rule.get('maxDuration') is None or duration <= rule['maxDuration'])):
+            return 'filteredDropRule'
+    return None
+
+def baselineValid(connType, targetPort, duration, connBytes):
+    ''' The hard-coded filter of the original parseSyslog.py, durations in seconds. '''
+    if connBytes < 1:
+        return False
+    return not (connType == 'UDP' and targetPort in ['53', '137', '138', '161'] and duration > 119)
+
+def randomSubset(rng, values):
+    return rng.sample(values, rng.randint(1, len(values)))
+
+def randomRules(rng):
+    rules = {}
+    if rng.random() < 0.5:
+        rules['minBytes'] = rng.choice((0, 1, 2))
+    if rng.random() < 0.3:
+        rules['protocols'] = randomSubset(rng, PROTOCOLS)
+    for zones in ('sourceZones', 'targetZones'):
+        if rng.random() < 0.4:
+            rules[zones] = {'include': randomSubset(rng, ZONES) if rng.random() < 0.5 else None,
+                            'exclude': randomSubset(rng, ZONES) if rng.random() < 0.5 else []}
+    if rng.random() < 0.8:
+        rules['drop'] = []
+        for number in range(rng.randint(0, 4)):
+            rule = {}
+            if rng.random() < 0.6:
+                rule['protocols'] = randomSubset(rng, PROTOCOLS)
+            if rng.random() < 0.6:
+                # Ports may be given as numbers as well
+                rule['ports'] = [int(port) if rng.random() < 0.3 else port for port in randomSubset(rng, PORTS)]
+            if rng.random() < 0.5:
+                rule['minDuration'] = rng.choice(DURATIONS)
+            if rng.random() < 0.4:
+                rule['maxDuration'] = rng.choice(DURATIONS)
+            rules['drop'].append(rule)
+    return rules
+
+def connections():
+    return itertools.product(PROTOCOLS, ZONES[:3], ZONES[1:], PORTS, DURATIONS, BYTES)
+
+def test_defaultRulesMatchBaseline():
+    reject = FR.compileRules()
+    for connType, sourceZone, targetZone, targetPort, duration, connBytes in connections():
+        assert (reject(connType, sourceZone, targetZone, targetPort, duration, connBytes) is None) == \
+            baselineValid(connType, targetPort, duration, connBytes)
+
+def test_compiledRulesMatchReference():
+    rng = random.Random(1)
+    for number in range(200):
+        rules = randomRules(rng)
+        FR.checkRules(rules)
+        reject = FR.compileRules(rules)
+        for fields in connections():
+            assert reject(*fields) == referenceReject(rules, *fields), (rules, fields)
+
+@pytest.mark.parametrize('rules', [
+    [],
+    {'minByte': 1},
+    {'minBytes': '1'},
+    {'protocols': 'TCP'},
+    {'protocols': [['TCP']]},
+    {'sourceZones': ['inside']},
+    {'targetZones': {'include': ['inside'], 'only': ['dmz']}},
+    {'targetZones': {'exclude': 'dmz'}},
+    {'drop': {'ports': ['53']}},
+    {'drop': [{'port': ['53']}]},
+    {'drop': [{'ports': '53'}]},
+    {'drop': [{'minDuration': -1}]},
+    {'drop': [{'maxDuration': 1.5}]},
+    {'drop': [{'minDuration': True}]},
+])
+def test_checkRulesRefusesInvalidRules(rules):
+    with pytest.raises(ValueError):
+        FR.checkRules(rules)
+
+def test_loadRulesCompletesDefaults(tmp_path):
+    rulesFile = tmp_path / 'rules.json'
+    rulesFile.write_text('{"minBytes": 100}')
+    rules = FR.loadRules(str(rulesFile))
+    assert rules == dict(FR.DEFAULT_RULES, minBytes=100)
+    reject = FR.compileRules(rules)
+    assert reject('TCP', 'inside', 'outside', '443', 10, 99) == 'filteredBytes'
+    assert reject('UDP', 'inside', 'outside', '53', 120, 100) == 'filteredDropRule'
+    assert reject('TCP', 'inside', 'outside', '443', 10, 100) is None
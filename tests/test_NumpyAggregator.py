@@ -0,0 +1,71 @@
+'''
+The NumPy engine against the line by line aggregation of LogFileExtractor.
+'''
+import pytest
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import LogFileExtractor as LFE
+import LogFileSplitter as LFS
+
+np = pytest.importorskip('numpy')
+import NumpyAggregator as NA
+
+RULES = {
+    'minBytes': 1000,
+    'sourceZones': {'include': None, 'exclude': ['guest']},
+    'targetZones': {'include': ['inside', 'outside', 'dmz', 'voice'], 'exclude': []},
+    'drop': [
+        {'protocols': ['UDP'], 'ports': ['53', '137', '138', '161'], 'minDuration': 120},
+        {'protocols': ['TCP'], 'ports': [22, '3389'], 'maxDuration': 30},
+        {'ports': ['443'], 'minDuration': 60, 'maxDuration': 90},
+        {'protocols': ['UDP'], 'minDuration': 100},
+    ],
+}
+
+def pythonStore(logFiles, rules):
+    store = CS.ConnectionStore()
+    for fileName in logFiles:
+        with LFS.openBinary(fileName) as lines:
+            LFE.extractLines(store, lines, LFE.fileDateOrdinal(fileName, ALP.regExFileDatePattern),
+                             ALP.bytesRegExPattern, rules=rules)
+    return store
+
+def numpyStore(logFiles, rules, batchLines):
+    # As parseSyslogNew.py --engine numpy: one aggregate per file, merged into the store
+    store = CS.ConnectionStore()
+    aggregator = NA.NumpyAggregator(rules)
+    for fileName in logFiles:
+        with LFS.openBinary(fileName) as lines:
+            NA.extractLines(aggregator, lines, LFE.fileDateOrdinal(fileName, ALP.regExFileDatePattern),
+                            ALP.bytesRegExPattern, batchLines=batchLines)
+        store.merge(aggregator.finish())
+    return store
+
+@pytest.mark.parametrize('rules', [None, RULES], ids=['defaultRules', 'customRules'])
+@pytest.mark.parametrize('batchLines', [NA.BATCH_LINES, 997])
+def test_numpyMatchesLineByLine(logFiles, rules, batchLines):
+    expected = sorted(pythonStore(logFiles, rules).records())
+    assert len(expected) > 1000
+    assert sorted(numpyStore(logFiles, rules, batchLines).records()) == expected
+
+def test_invalidConnectionsAreReported():
+    valid = (b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302014: Teardown TCP connection 1 for '
+             b'inside:10.0.16.16/22504 to outside:10.1.11.2/443 duration 0:00:31 bytes 1234 TCP FINs\n')
+    lines = [valid,
+             valid.replace(b'10.1.11.2/443', b'10.1.11.2/70000'),
+             b'Jan 15 13:30:36 fw01 : Jan 15 13:30:36 CET: %ASA-6-302020: Built inbound ICMP connection\n',
+             valid.replace(b'10.0.16.16', b'10.0.16.999'),
+             # Filtered (0 bytes) before it is checked, like ConnectionStore.add() is never called for it
+             valid.replace(b'10.0.16.16', b'10.0.16.999').replace(b'bytes 1234', b'bytes 0'),
+             valid]
+    invalid = []
+    aggregator = NA.NumpyAggregator()
+    count = NA.extractLines(aggregator, lines, 736344, ALP.bytesRegExPattern, batchLines=2,
+                            logInvalid=lambda lineNumber, fields: invalid.append(lineNumber))
+    assert count == len(lines)
+    assert invalid == [2, 4]
+    store = aggregator.finish()
+    expected = CS.ConnectionStore()
+    LFE.extractLines(expected, lines, 736344, ALP.bytesRegExPattern)
+    assert sorted(store.records()) == sorted(expected.records())
+    assert [record[6:] for record in store.records()] == [(2, 736344, 736344, 2468)]
@@ -0,0 +1,88 @@
+'''
+Partial aggregates of parts of the files, merged, against a single run over all files.
+'''
+import os
+import sys
+import subprocess
+import pytest
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+import LogFileExtractor as LFE
+import PartialAggregate as PA
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def fileStore(fileName):
+    return LFE.LogFileExtractor(fileName, 'latin-1', ALP.bytesRegExPattern, ALP.regExFileDatePattern).extractData()
+
+def writePartial(fileNames, partialFile, rules=FR.DEFAULT_RULES):
+    store = CS.ConnectionStore()
+    for fileName in fileNames:
+        store.merge(fileStore(fileName))
+    PA.writePartial(store, partialFile, [PA.fileInfo(fileName) for fileName in fileNames], rules, 'latin-1')
+    return partialFile
+
+@pytest.fixture(scope="module")
+def singleRun(logFiles):
+    store = CS.ConnectionStore()
+    for fileName in logFiles:
+        store.merge(fileStore(fileName))
+    return sorted(store.rows())
+
+@pytest.fixture(scope="module")
+def partials(logFiles, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("partials")
+    parts = (logFiles[:1], logFiles[1:3], logFiles[3:])
+    return [writePartial(part, str(directory / 'part{}.partial'.format(number))) for number, part in enumerate(parts)]
+
+def test_mergeMatchesSingleRun(partials, singleRun):
+    assert len(singleRun) > 1000
+    assert sorted(PA.PartialMerge(partials).rows()) == singleRun
+    # The order of the partials does not matter
+    assert sorted(PA.PartialMerge(partials[::-1]).rows()) == singleRun
+
+def test_mergeIsAssociative(partials, singleRun, tmp_path):
+    first = str(tmp_path / 'first.partial')
+    PA.PartialMerge(partials[:2]).writePartial(first)
+    assert sorted(PA.PartialMerge([first, partials[2]]).rows()) == singleRun
+    last = str(tmp_path / 'last.partial')
+    PA.PartialMerge(partials[1:]).writePartial(last)
+    assert sorted(PA.PartialMerge([partials[0], last]).rows()) == singleRun
+
+def test_readStoreRoundTrip(logFiles, partials):
+    expected = CS.ConnectionStore()
+    for fileName in logFiles[1:3]:
+        expected.merge(fileStore(fileName))
+    assert sorted(PA.readStore(partials[1]).rows()) == sorted(expected.rows())
+
+def test_mergeRefusesOverlapsAndOtherRules(logFiles, partials, tmp_path):
+    overlapping = writePartial(logFiles[:1], str(tmp_path / 'overlapping.partial'))
+    with pytest.raises(ValueError):
+        PA.PartialMerge(partials + [overlapping])
+    otherRules = writePartial(logFiles[:1], str(tmp_path / 'rules.partial'), dict(FR.DEFAULT_RULES, minBytes=10))
+    with pytest.raises(ValueError):
+        PA.PartialMerge(partials[1:] + [otherRules])
+
+def run(*arguments):
+    subprocess.run([sys.executable] + list(arguments), cwd=REPOSITORY, check=True, stdout=subprocess.DEVNULL)
+
+def test_shardProcessesMatchSingleRun(logDirectory, tmp_path):
+    # As on several nodes: every shard parsed by its own process, merged by another one
+    shards = 3
+    for shard in range(shards):
+        run('shardParseSyslog.py', 'partial', '-i', str(logDirectory), '-o', str(tmp_path / 'shard{}.partial'.format(shard)),
+            '--shard', '{}/{}'.format(shard, shards), '-w', '1')
+    merged = tmp_path / 'merged'
+    merged.mkdir()
+    run('shardParseSyslog.py', 'merge', *[str(tmp_path / 'shard{}.partial'.format(shard)) for shard in range(shards)],
+        '-o', str(merged))
+    single = tmp_path / 'single'
+    single.mkdir()
+    run('parseSyslogNew.py', str(logDirectory) + '/', str(single) + '/')
+    with open(str(merged / 'AllConnections.csv')) as mergedFile, open(str(single / 'AllConnections.csv')) as singleFile:
+        mergedLines = mergedFile.readlines()
+        singleLines = singleFile.readlines()
+    assert mergedLines[0] == singleLines[0]
+    assert sorted(mergedLines[1:]) == sorted(singleLines[1:])
+    assert len(mergedLines) > 1000
@@ -1,147 +1,301 @@
 '''
 threadedParseSyslog.py
 Syslog parser to generate accumulated connections
+
+Files are handed to a pool of workers. Each worker returns the partial aggregate
+of its file (a ConnectionStore), which is merged in the parent.
+--mode process uses worker processes so parsing is not serialized by the GIL,
+--mode thread keeps the previous threaded behaviour.
+Files larger than --chunk-size are split into byte ranges (see LogFileSplitter),
+which are parsed by separate workers as well. Gzip files are only split at the starts
+of their members (bgzip or concatenated files), others are parsed as one range.
+--report writes counters and stage timers per file as JSON (see RunReport),
+--profile the combined cProfile data of all workers.
+--pipeline inflates the files in a separate stage (pigz / gzip -dc if on PATH) and hands
+newline aligned chunks to the workers instead of files (see LogFilePipeline).
+--output-format writes AllConnections as csv, csv.gz, npz or parquet (see ConnectionWriter).
+--subnets / --prefix-length aggregate IPs by subnets (see SubnetTree), the workers return
+the IPs and the subnets are applied when their results are merged.
+--cache keeps the connections of every file in a content addressed cache (see PartialCache),
+reruns merge the cached connections of unchanged files instead of parsing them again.
+--dedup drops duplicate Teardown events (see DuplicateFilter), each worker filters its file
+or range of a file.
+Files are selected with -r, --include, --exclude, --from and --to (see LogFileFinder) and
+handed to the workers largest first, so no large file is left for the end of the run.
+--partition-by hostname aggregates the connections per firewall (see PartitionedStore) and
+writes AllConnections_<hostname> per firewall in parallel, besides AllConnections of all.
+--sketches writes top sources / target ports / targets by count and bytes and distinct
+source counts of fixed memory (see Sketches). Every worker sketches the connections it parses
+besides aggregating them, the parent merges the sketches; cached files are sketched from their
+aggregate. The IPs are the ones of the hosts, --subnets do not apply.
 '''
+import os
 import time
 import argparse
-import glob
-import re
-import datetime
-import threading
-from queue import Queue
+import concurrent.futures
 import LogFileExtractor as LFE
-         
-def writeDictToFile(d, firstSeen, lastSeen, outDir):
-    outFile = open(outDir,'wt')
-    # CSV header
-    # connSourceIP + ';' + connSourceZone +';' + connTargetIP + ';' + connTargetZone + ';' + connTargetPort + ';' + connType
-    print('SourceIP;SourceZone;TargetIP;TargetZone;TargetPort;ConnectionType;count;firstSeen;lastSeen', file=outFile)
-    for x in d:
-        # Output key and the number of registered connections
-        print(x + ';' + str(d[x]) + ";" + firstSeen[x] + ";" + lastSeen[x], file=outFile,)
-    outFile.close()
-    
-def processFile(fileName):
-    with print_lock:
-        print('{}\n{}'.format(fileName, threading.current_thread().name))
-        
-    parsefile = LFE.LogFileExtractor(fileName, encdg, regExPattern, regExFileDatePattern)
-    connections, firstSeen, lastSeen = parsefile.extractData()
-    with dict_lock:
-        for k in connections.keys():
-            if k in sumConnections.keys():
-                sumConnections[k] += connections[k]
-            else:
-                sumConnections[k] = connections[k] 
-    
-        for k in firstSeen.keys():
-            if k in sumFirstSeen.keys():
-                # get iso formatted date and convert to datetime
-                firstCompareDate = datetime.date(int(sumFirstSeen[k][0:4]), 
-                                                 int(sumFirstSeen[k][5:7]), 
-                                                 int(sumFirstSeen[k][8:10]))
-                curDate = datetime.date(int(firstSeen[k][0:4]), 
-                                                 int(firstSeen[k][5:7]), 
-                                                 int(firstSeen[k][8:10]))
-                if curDate < firstCompareDate:
-                    sumFirstSeen[k] = firstSeen[k]
-            else:
-                sumFirstSeen[k] = firstSeen[k]
-                    
-        for k in lastSeen.keys():  
-            if k in sumLastSeen.keys():
-                # get iso formatted date and convert to datetime
-                lastCompareDate = datetime.date(int(sumLastSeen[k][0:4]), 
-                                                 int(sumLastSeen[k][5:7]), 
-                                                 int(sumLastSeen[k][8:10]))
-                curDate = datetime.date(int(firstSeen[k][0:4]), 
-                                                 int(lastSeen[k][5:7]), 
-                                                 int(lastSeen[k][8:10]))
-                if curDate > lastCompareDate:
-                    sumLastSeen[k] = lastSeen[k]
-            else:
-                sumLastSeen[k] = lastSeen[k]
-                          
-    with print_lock:
-        print ('File Done: {}\n - {} dictionary entries\n - {} total dictionary entries.'.format(fileName, len(connections), len(sumConnections)))
-               
-# The threader thread pulls a worker from the queue and processes it
-def threader():
-    while True:
-        # gets an worker from the queue
-        worker = q.get()
-        # Run the example job with the avail worker in queue (thread)
-        processFile(worker)
-        # completed with the job
-        q.task_done()
-
-# ------------------------  Start of execution routine ----------------
-# Parse command line arguments
-parser = argparse.ArgumentParser(description="Browse through a specified logfile directory (inputDirectory) and extract only relevant lines from logs to a target directory (outputDirectory).")
-parser.add_argument("-i", "--inputDirectory", help="directory in which source files to be processed are located. Watch out not to have any further subdirectories in this dir.", required=True)
-parser.add_argument("-o", "--outputDirectory", help="directory in which all generated output files will be placed.", required=True)
-parser.add_argument("-e", "--encoding", help="encoding option with which the inputDirectory files will be parsed. Defaults to 'latin-1'", choices=["latin-1", "utf-8"], default="latin-1")
-parser.add_argument("-t", "--threads", help="specify number of threads which shall be executed in parallel.", type=int, default=2, choices=range(1,11))
- # implement!
-args = parser.parse_args()
-    
-encdg = args.encoding
-# Setup Directories for in- and output ----------------------
-inputDirectory = args.inputDirectory
-outputDirectory = args.outputDirectory
-if not inputDirectory.endswith('/'):
-    inputDirectory = inputDirectory + "/"
-
-if not outputDirectory.endswith('/'):
-    outputDirectory = outputDirectory + "/"
-
-connectionFile = outputDirectory + 'AllConnections.csv'
-
-# Create the queue and threader 
-q = Queue()
-
-# Prepare locks----------------------------------------------
-print_lock = threading.Lock()
-dict_lock = threading.Lock()
-
-# Receiving dictionaries for thread results ------------------
-sumConnections = {}
-sumLastSeen = {}
-sumFirstSeen = {}
-
-
-# Regular expression for syslog elements matching.
-# Compile here only once to avoid pattern interpretation for every further use.
-regExPattern = re.compile(r'^(?P<DateTime>\w+\s+\d+\s+(\d+):(\d+):(\d+))\s(?P<Hostname>\S+)'\
-                        '\s:\s\w+\s\d+\s(\d+):(\d+):(\d+)\s\w+:\s(?P<ASA_Session>\S+)\s(?:Teardown)'\
-                        '\s(?P<ConnectionType>\S+)\s(\S+)\s(?P<ConnectionID>\d+)' \
-                        '\sfor\s(?P<SourceZone>\S+):(?P<SourceIP>\d+.\d+.\d+.\d+)/(?P<SourcePort>\d+)(\(any\))*'\
-                        '\sto\s(?P<TargetZone>\S+):(?P<TargetIP>\d+.\d+.\d+.\d+)/(?P<TargetPort>\d+)(\(any\))*\s'\
-                        '(duration)\s(?P<Duration>\d+:\d+:\d+)\s(bytes)\s(?P<Bytes>\d+)'\
-                        '\s*(?P<Result>.*)' 
-                      ) 
-
-regExFileDatePattern = re.compile(r'.*(\d{4})-(\d{2})-(\d{2}).*')
-   
-# how many threads are we going to allow for
-for x in range(args.threads):
-     t = threading.Thread(target=threader)
-     # classifying as a daemon, so they will die when the main dies
-     t.daemon = True
-     # begins, must come after daemon definition
-     t.start()
-start = time.time()
-# ------ This is where the music is playing ------------
-fileList = glob.glob(inputDirectory + '*')
-      
-for fileName in sorted(fileList):
-    q.put(fileName)
-
-
-# wait until the thread terminates.
-q.join()
-
-writeDictToFile(sumConnections, sumFirstSeen, sumLastSeen, connectionFile)
-
-print('Total job execution time: ',time.time() - start)
+import LogFileSplitter as LFS
+import LogFileFinder as LFF
+import LogFilePipeline as LFP
+import AsaLogParser as ALP
+import ConnectionStore as CS
+import FilterRules as FR
+import RunReport as RR
+import ConnectionWriter as CW
+import SubnetTree as ST
+import PartialCache as PC
+import DuplicateFilter as DF
+import PartitionedStore as PS
+import Sketches as SK
+
+def writeDictToFile(store, outDir, outputFormat='csv'):
+    # SourceIP;SourceZone;TargetIP;TargetZone;TargetPort;ConnectionType;count;firstSeen;lastSeen
+    # totalBytes is not part of this output
+    CW.writeConnections(store, outDir, outputFormat, CW.FIELDS[:9])
+
+def processFile(fileName, encdg, regExPattern, regExFileDatePattern, startOffset=0, endOffset=None, gzipIndex=None,
+                report=False, profile=False, rules=None, dedup=None, partitionBy=None, sketchCapacity=None):
+    # Runs inside a worker (thread or process), result has to be picklable
+    stats = RR.FileStats(fileName) if report else None
+    parsefile = LFE.LogFileExtractor(fileName, encdg, regExPattern, regExFileDatePattern,
+                                     startOffset, endOffset, gzipIndex, stats, rules, dedup, partitionBy,
+                                     sketchCapacity)
+    if profile:
+        connections, profileData = RR.profileCall(parsefile.extractData)
+    else:
+        connections, profileData = parsefile.extractData(), None
+    return fileName, connections, stats, profileData, parsefile.duplicates, parsefile.sketches
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description="Browse through a specified logfile directory (inputDirectory) and extract only relevant lines from logs to a target directory (outputDirectory).")
+    parser.add_argument("-i", "--inputDirectory", help="directory in which source files to be processed are located. Subdirectories are skipped unless --recursive is given.", required=True)
+    parser.add_argument("-o", "--outputDirectory", help="directory in which all generated output files will be placed.", required=True)
+    parser.add_argument("-r", "--recursive", help="process the files in subdirectories of the inputDirectory as well.", action="store_true")
+    parser.add_argument("--include", help="only files whose name matches this glob pattern (e.g. '*.gz'), may be repeated.", action="append")
+    parser.add_argument("--exclude", help="skip files and directories whose name matches this glob pattern, may be repeated.", action="append")
+    parser.add_argument("--from", dest="date_from", help="only files dated (date in the file name) on or after YYYY-MM-DD.", type=LFF.dateArgument)
+    parser.add_argument("--to", dest="date_to", help="only files dated (date in the file name) on or before YYYY-MM-DD.", type=LFF.dateArgument)
+    parser.add_argument("-e", "--encoding", help="encoding option with which the inputDirectory files will be parsed. Defaults to 'latin-1'", choices=["latin-1", "utf-8"], default="latin-1")
+    parser.add_argument("-t", "--threads", help="specify number of threads which shall be executed in parallel (--mode thread).", type=int, default=2, choices=range(1,11))
+    parser.add_argument("-w", "--workers", help="number of parallel workers. Defaults to the number of CPUs for --mode process and to --threads for --mode thread.", type=LFF.positiveInt)
+    parser.add_argument("-m", "--mode", help="run workers as processes (uses all cores) or as threads. Defaults to 'process'", choices=["process", "thread"], default="process")
+    parser.add_argument("-c", "--chunk-size", help="split files larger than this many MB (uncompressed) into ranges parsed by separate workers. 0 disables splitting. Defaults to 256", type=int, default=256)
+    parser.add_argument("--gzip-index", help="build a missing access point index (<file>.gz.idx) for .gz files, so multi member files (bgzip, concatenated) can be split as well.", action="store_true")
+    parser.add_argument("--pipeline", help="inflate/read the files in a separate stage, which feeds chunks of lines to the workers.", action="store_true")
+    parser.add_argument("--inflater", help="inflater of .gz files for --pipeline: an external pigz or gzip -dc if found on PATH (auto) or Python's zlib (python). Defaults to 'auto'", choices=["auto", "python"], default="auto")
+    parser.add_argument("--pipeline-chunk-size", help="MB per chunk handed to a worker by --pipeline. Defaults to 16", type=int, default=16)
+    parser.add_argument("--rules", help="JSON file with the filter rules for connections (see FilterRules).")
+    parser.add_argument("--output-format", help="format of AllConnections: csv, gzip compressed csv or typed columns as NumPy archive (npz, requires numpy) or Parquet (parquet, requires pyarrow). Defaults to 'csv'", choices=CW.FORMATS, default="csv")
+    parser.add_argument("--subnets", help="aggregate IPs by the subnets in this file (one CIDR per line, the longest prefix wins, see SubnetTree).")
+    parser.add_argument("--prefix-length", help="aggregate IPs outside of the --subnets by networks of this prefix length (e.g. 24).", type=int)
+    parser.add_argument("--dedup", help="drop duplicate Teardown events (same hostname, firewall timestamp, connection id and bytes, see DuplicateFilter).", action="store_true")
+    parser.add_argument("--dedup-memory", help="MB for the --dedup filter of each worker. Defaults to 16", type=int, default=16)
+    parser.add_argument("--dedup-fp-rate", help="false positive rate of the --dedup filter (distinct events taken for duplicates). Defaults to 0.001", type=float, default=0.001)
+    parser.add_argument("--dedup-window", help="seconds within which copies of an event are recognized by --dedup. Defaults to 60", type=int, default=60)
+    parser.add_argument("--partition-by", help="aggregate and write the connections per firewall (hostname of the syslog header) as well.", choices=["hostname"])
+    parser.add_argument("--cache", help="directory of the cache of the connections per file (see PartialCache).")
+    parser.add_argument("--cache-size", help="MB the --cache may use, least recently used files are removed first. Defaults to 1024", type=int, default=1024)
+    parser.add_argument("--sketches", help="write the top sources, target ports and targets and distinct source counts (approximated in fixed memory, see Sketches) to this JSON file.")
+    parser.add_argument("--top", help="number of entries per top list of --sketches. Defaults to 20", type=int, default=SK.TOP)
+    parser.add_argument("--sketch-capacity", help="items tracked per top list of --sketches, counts are exact for items above 1/capacity of the total. Defaults to 1000", type=int, default=SK.CAPACITY)
+    parser.add_argument("--report", help="write counters and stage timers per file to this JSON file.")
+    parser.add_argument("--profile", help="write the cProfile data of the workers to this file (see pstats).")
+    args = parser.parse_args()
+    try:
+        rules = FR.loadRules(args.rules) if args.rules else None
+    except (OSError, ValueError) as error:
+        parser.error("--rules: {}".format(error))
+    subnets = None
+    if args.subnets or args.prefix_length is not None:
+        try:
+            subnets = ST.SubnetTree(ST.loadSubnets(args.subnets) if args.subnets else (), args.prefix_length)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    if not CW.available(args.output_format):
+        parser.error("--output-format {} requires {}".format(args.output_format, "numpy" if args.output_format == "npz" else "pyarrow"))
+    dedup = None
+    if args.dedup:
+        if args.pipeline:
+            parser.error("--dedup cannot be combined with --pipeline")
+        dedup = (args.dedup_memory * 1024 * 1024, args.dedup_fp_rate, args.dedup_window)
+        try:
+            DF.DuplicateFilter(1, *dedup[1:])
+        except ValueError as error:
+            parser.error("--dedup: {}".format(error))
+    if args.partition_by and (args.pipeline or args.cache):
+        parser.error("--partition-by cannot be combined with --pipeline or --cache")
+    if args.sketch_capacity < 1 or args.top < 1:
+        parser.error("--sketch-capacity and --top have to be at least 1")
+    sketchCapacity = args.sketch_capacity if args.sketches else None
+    sketches = SK.ConnectionSketches(sketchCapacity) if sketchCapacity else None
+
+    encdg = args.encoding
+    # Setup Directories for in- and output ----------------------
+    inputDirectory = args.inputDirectory
+    outputDirectory = args.outputDirectory
+    if not inputDirectory.endswith('/'):
+        inputDirectory = inputDirectory + "/"
+
+    if not outputDirectory.endswith('/'):
+        outputDirectory = outputDirectory + "/"
+
+    connectionFile = CW.connectionFileName(outputDirectory, args.output_format)
+
+    workers = args.workers
+    if workers is None:
+        workers = args.threads if args.mode == "thread" else (os.cpu_count() or 1)
+
+    # Receiving store for worker results ------------------
+    sumConnections = PS.PartitionedStore() if args.partition_by else CS.ConnectionStore()
+    sumConnections.subnets = subnets
+
+    # CISCO ASA Log Format, see AsaLogParser
+    regExPattern = ALP.bytesRegExPattern
+    regExFileDatePattern = ALP.regExFileDatePattern
+
+    if args.mode == "process":
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    start = time.time()
+    report = RR.RunReport('threadedParseSyslog.py')
+    mergeSeconds = 0.0
+    # ------ This is where the music is playing ------------
+    fileList = LFF.findFiles(inputDirectory, args.include, args.exclude, args.recursive, args.date_from, args.date_to,
+                             largestFirst=True)
+    # Skipped like by parseSyslog.py, instead of dating them 1970-01-01
+    fileList, undated = LFF.splitUndated(fileList, regExFileDatePattern)
+    for fileName in undated:
+        print("Could not determine logfile date from filename, skipped: {}".format(fileName))
+    chunkSize = args.chunk_size * 1024 * 1024
+
+    # Cached files are merged, only the others are parsed. Their connections are collected per file
+    # (over all chunks) for the cache.
+    cache = None
+    if args.cache:
+        cache = PC.PartialCache(args.cache, args.cache_size * 1024 * 1024, encdg, rules, regExPattern, dedup)
+        fileOrdinals = [LFE.fileDateOrdinal(f, regExFileDatePattern) for f in fileList]
+        cacheKeys = dict(zip(fileList, PC.cacheKeys(cache, fileList, fileOrdinals, executor.map)))
+        newFiles = []
+        for fileName in fileList:
+            connections = cache.get(cacheKeys[fileName])
+            if connections is None:
+                newFiles.append(fileName)
+                continue
+            sumConnections.merge(connections)
+            if sketches is not None:
+                # Cached files are not parsed, their aggregate is sketched instead
+                sketches.addRecords(connections.records())
+            print ('File Cached: {}\n - {} dictionary entries\n - {} total dictionary entries.'.format(fileName, len(connections), len(sumConnections)))
+        fileList = newFiles
+    fileConnections = {}
+
+    def cacheConnections(fileName, connections, fileDone):
+        if cache is None:
+            return
+        if fileName in fileConnections:
+            fileConnections[fileName].merge(connections)
+        else:
+            fileConnections[fileName] = connections
+        if fileDone:
+            cache.put(cacheKeys[fileName], fileConnections.pop(fileName), fileName)
+
+    if args.pipeline:
+        inflater = LFP.findInflater() if args.inflater == "auto" else None
+        # Two chunks per worker keep the workers busy while the next chunk is read
+        pipeline = LFP.Pipeline(executor, fileList, encdg, regExPattern, regExFileDatePattern, 2 * workers,
+                                args.pipeline_chunk_size * 1024 * 1024, inflater, bool(args.report), bool(args.profile),
+                                rules, sketchCapacity)
+        with executor:
+            for fileName, connections, stats, profileData, fileDone, chunkSketches in pipeline:
+                mergeStart = time.time()
+                sumConnections.merge(connections)
+                if chunkSketches is not None:
+                    sketches.merge(chunkSketches)
+                mergeSeconds += time.time() - mergeStart
+                cacheConnections(fileName, connections, fileDone)
+                if stats is not None:
+                    report.addFileStats(stats)
+                if profileData is not None:
+                    report.addProfile(profileData)
+                if fileDone:
+                    print ('File Done: {}\n - {} total dictionary entries.'.format(fileName, len(sumConnections)))
+        reportExtra = dict(inflater=inflater[0] if inflater else 'python', chunks=pipeline.chunks,
+                           readSeconds=round(pipeline.readSeconds, 3))
+    else:
+        reportExtra = {}
+        duplicates = 0
+        with executor:
+            # Gzip indexes hold the uncompressed size and access points. Logs compress by up to ~20:1,
+            # files which cannot exceed chunkSize even then are not worth an index.
+            gzipFiles = [f for f in fileList if f.endswith('.gz') and chunkSize > 0 and os.path.getsize(f) * 20 > chunkSize]
+            gzipIndexes = dict(zip(gzipFiles, executor.map(LFS.getGzipIndex, gzipFiles, [args.gzip_index] * len(gzipFiles))))
+
+            futures = []
+            chunksLeft = {}
+            for fileName in fileList:
+                gzipIndex = gzipIndexes.get(fileName)
+                if fileName in gzipIndexes:
+                    reason = LFS.splitGzipReason(gzipIndex, chunkSize)
+                    if reason is not None:
+                        print ('Not splitting {}: {}'.format(fileName, reason))
+                for startOffset, endOffset in LFS.splitFile(fileName, chunkSize, gzipIndex):
+                    chunksLeft[fileName] = chunksLeft.get(fileName, 0) + 1
+                    futures.append(executor.submit(processFile, fileName, encdg, regExPattern, regExFileDatePattern,
+                                                   startOffset, endOffset, gzipIndex, bool(args.report), bool(args.profile),
+                                                   rules, dedup, args.partition_by, sketchCapacity))
+            # Partial results are merged by the parent only, so no locking is required
+            for future in concurrent.futures.as_completed(futures):
+                fileName, connections, stats, profileData, fileDuplicates, fileSketches = future.result()
+                duplicates += fileDuplicates
+                mergeStart = time.time()
+                sumConnections.merge(connections)
+                if fileSketches is not None:
+                    sketches.merge(fileSketches)
+                mergeSeconds += time.time() - mergeStart
+                chunksLeft[fileName] -= 1
+                cacheConnections(fileName, connections, chunksLeft[fileName] == 0)
+                if stats is not None:
+                    report.addFileStats(stats)
+                if profileData is not None:
+                    report.addProfile(profileData)
+                print ('File Done: {}\n - {} dictionary entries\n - {} total dictionary entries.'.format(fileName, len(connections), len(sumConnections)))
+
+    if dedup is not None:
+        print('Dropped {} duplicate Teardown lines.'.format(duplicates))
+        reportExtra.update(duplicates=duplicates)
+    if cache is not None:
+        reportExtra.update(cacheHits=cache.hits, cacheMisses=cache.misses, cacheEvicted=cache.evict())
+    if args.sketches:
+        sketches.write(args.sketches, args.top)
+        print('Sketches written to {}'.format(args.sketches))
+
+    writeStart = time.time()
+    if args.partition_by:
+        # Partitions are written by the workers, the aggregate of all partitions meanwhile by the parent
+        if args.mode == "process":
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        with executor:
+            futures = [executor.submit(writeDictToFile, store, PS.partitionFileName(outputDirectory, name, args.output_format),
+                                       args.output_format) for name, store in sorted(sumConnections.partitions.items())]
+            reportExtra.update(partitions=len(futures))
+            sumConnections = sumConnections.total()
+            writeDictToFile(sumConnections, connectionFile, args.output_format)
+            for future in futures:
+                future.result()
+        print('{} partitions written.'.format(len(futures)))
+    else:
+        writeDictToFile(sumConnections, connectionFile, args.output_format)
+    if args.report:
+        report.write(args.report, mode=args.mode, workers=workers, connections=len(sumConnections),
+                     mergeSeconds=round(mergeSeconds, 3), writeSeconds=round(time.time() - writeStart, 3), **reportExtra)
+    if args.profile:
+        report.writeProfile(args.profile)
+
+    print('Total job execution time: ',time.time() - start)
 
+if __name__ == "__main__": main()